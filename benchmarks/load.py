@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import random
+from argparse import ArgumentParser
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+import httpx
+import numpy as np
+
+from benchmarks.run import RESULTS_DIR, git_commit, play_doc, track_doc
+from spotify_advance.apis import Settings
+from spotify_advance.apis.mongodb import create_app, get_handler, get_spotify_api
+from spotify_advance.handlers.async_mongodb import AsyncMongoDBHandler
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from tests.helpers import fixture_id, fixture_spotify_api
+
+LOAD_DATABASE = "spotify_advance_load"
+
+DEFAULT_LEVELS = [1, 8, 32, 128]
+
+
+@dataclass
+class Route:
+    name: str
+    weight: float
+    request: Callable[[random.Random], tuple[str, str, dict]]
+
+
+@dataclass
+class RouteStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        self.latencies.append(elapsed)
+        if not ok:
+            self.errors += 1
+
+    def summary(self, duration: float) -> dict:
+        latencies = np.array(self.latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (None, None, None)
+        return {
+            "requests": len(latencies),
+            "throughput": len(latencies) / duration,
+            "error_rate": self.errors / len(latencies) if len(latencies) else 0.0,
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+            "max_ms": float(latencies.max()) if len(latencies) else None,
+        }
+
+
+def read_routes(users: int, tracks: int) -> list[Route]:
+    """Read-heavy traffic: history pages dominate, full track listings are rare."""
+    def user(rng: random.Random) -> str:
+        return f"user-{rng.randrange(users)}"
+
+    return [
+        Route("GET /recently_played/{user_id}", 0.60,
+              lambda rng: ("GET", f"/recently_played/{user(rng)}", {"limit": 50})),
+        Route("GET /recently_played/{user_id}/expanded", 0.10,
+              lambda rng: ("GET", f"/recently_played/{user(rng)}/expanded", {"limit": 50})),
+        Route("GET /tracks/{track_id}", 0.20,
+              lambda rng: ("GET", f"/tracks/{fixture_id(rng.randrange(tracks))}", {})),
+        Route("GET /stats/{user_id}/top_tracks", 0.06,
+              lambda rng: ("GET", f"/stats/{user(rng)}/top_tracks", {"window": "30d"})),
+        Route("GET /me", 0.02,
+              lambda rng: ("GET", "/me", {})),
+        Route("GET /tracks/all", 0.02,
+              lambda rng: ("GET", "/tracks/all", {"limit": 1000})),
+    ]
+
+
+def seed(uri: str, users: int, plays_per_user: int, tracks: int) -> None:
+    """Drop and fill the load database: tracks plus plays_per_user plays for each user."""
+    handler = MongoDBHandler(uri, create_indexes=False, database=LOAD_DATABASE)
+    handler.client.drop_database(LOAD_DATABASE)
+    handler.ensure_indexes()
+    handler.store_tracks_many([track_doc(index) for index in range(tracks)])
+    for user in range(users):
+        plays = [{**play_doc(index, tracks), "user_id": f"user-{user}"} for index in range(plays_per_user)]
+        for start in range(0, len(plays), 1000):
+            counts, message = handler.store_recently_played_many(plays[start:start + 1000])
+            if counts is None:
+                raise RuntimeError(message)
+    handler.client.close()
+    print(f"Seeded {users} users x {plays_per_user} plays and {tracks} tracks")
+
+
+async def send(client: httpx.AsyncClient, stats: dict[str, RouteStats], name: str, method: str, path: str,
+               params: dict) -> None:
+    start = perf_counter()
+    try:
+        response = await client.request(method, path, params=params)
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        ok = False
+    stats.setdefault(name, RouteStats()).record(perf_counter() - start, ok)
+
+
+async def reader(client: httpx.AsyncClient, routes: list[Route], stats: dict[str, RouteStats], deadline: float,
+                 rng: random.Random) -> None:
+    weights = [route.weight for route in routes]
+    while perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        method, path, params = route.request(rng)
+        await send(client, stats, route.name, method, path, params)
+
+
+async def ingester(client: httpx.AsyncClient, stats: dict[str, RouteStats], deadline: float, users: int, tracks: int,
+                   interval: float, burst: int, rng: random.Random) -> None:
+    """Bursts of POST /recently_played, like a sync job flushing a user's new plays."""
+    # Ahead of the seeded history so every play is new
+    played_at = datetime.now(timezone.utc) + timedelta(days=365 * 10)
+    while perf_counter() < deadline:
+        await asyncio.sleep(interval)
+        posts = []
+        user = f"user-{rng.randrange(users)}"
+        for _ in range(burst):
+            played_at += timedelta(seconds=1)
+            params = {"user_id": user, "track_id": fixture_id(rng.randrange(tracks)), "played_at": played_at.isoformat()}
+            posts.append(send(client, stats, "POST /recently_played", "POST", "/recently_played", params))
+        await asyncio.gather(*posts)
+
+
+async def loop_lag(deadline: float, interval: float = 0.01) -> list[float]:
+    """Sample how late the event loop wakes up a sleeping task, a blocked loop shows up as lag."""
+    lags = []
+    while perf_counter() < deadline:
+        start = perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(perf_counter() - start - interval)
+    return lags
+
+
+async def run_level(client: httpx.AsyncClient, routes: list[Route], concurrency: int, duration: float, args,
+                    rng: random.Random) -> dict:
+    stats: dict[str, RouteStats] = {}
+    start = perf_counter()
+    deadline = start + duration
+    lag_task = asyncio.create_task(loop_lag(deadline))
+    await asyncio.gather(
+        *(reader(client, routes, stats, deadline, random.Random(rng.random())) for _ in range(concurrency)),
+        ingester(client, stats, deadline, args.users, args.tracks, args.burst_interval, args.burst_size, rng))
+    lags = np.array(await lag_task) * 1000
+    elapsed = perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "duration": elapsed,
+        "loop_lag_p99_ms": float(np.percentile(lags, 99)) if len(lags) else None,
+        "loop_lag_max_ms": float(lags.max()) if len(lags) else None,
+        "routes": {name: route_stats.summary(elapsed) for name, route_stats in sorted(stats.items())},
+    }
+
+
+def report(level: dict, slo_p99_ms: float, slo_error_rate: float) -> list[str]:
+    """Print a level's per-route table and return the routes breaking the SLO."""
+    print(f"\nconcurrency={level['concurrency']}  loop lag p99={level['loop_lag_p99_ms']:.1f}ms "
+          f"max={level['loop_lag_max_ms']:.1f}ms")
+    print(f"{'route':<42}{'req/s':>9}{'errors':>9}{'p50':>9}{'p95':>9}{'p99':>9}  SLO")
+    violations = []
+    for name, summary in level["routes"].items():
+        ok = summary["p99_ms"] is not None and summary["p99_ms"] <= slo_p99_ms and summary["error_rate"] <= slo_error_rate
+        if not ok:
+            violations.append(name)
+        print(f"{name:<42}{summary['throughput']:>9.1f}{summary['error_rate']:>9.2%}{summary['p50_ms']:>9.1f}"
+              f"{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}  {'ok' if ok else 'FAIL'}")
+    return violations
+
+
+async def run(args) -> list[dict]:
+    # Empty settings, conf.yaml is never read since both clients are overridden
+    app = create_app(Settings())
+    # Fake Spotify: /me is served from the recorded fixtures through the production session setup
+    spotify_api, _ = fixture_spotify_api()
+    handler = AsyncMongoDBHandler(args.uri, database=LOAD_DATABASE)
+    app.dependency_overrides[get_handler] = lambda: handler
+    app.dependency_overrides[get_spotify_api] = lambda: spotify_api
+
+    routes = read_routes(args.users, args.tracks)
+    rng = random.Random(args.seed)
+    levels = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+        for concurrency in args.levels:
+            level = await run_level(client, routes, concurrency, args.duration, args, rng)
+            level["slo_violations"] = report(level, args.slo_p99_ms, args.slo_error_rate)
+            levels.append(level)
+    await handler.close()
+    return levels
+
+
+def main():
+    parser = ArgumentParser(description="Drive the API in-process with mixed traffic and report latency SLOs per route")
+    parser.add_argument("--uri", default="mongodb://localhost:27017",
+                        help="local MongoDB, seeded into the spotify_advance_load database")
+    parser.add_argument("--levels", nargs="+", type=int, default=DEFAULT_LEVELS,
+                        help="concurrent readers at each step of the ramp")
+    parser.add_argument("--duration", type=float, default=20,
+                        help="seconds per concurrency level")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--plays-per-user", type=int, default=2000)
+    parser.add_argument("--tracks", type=int, default=5000)
+    parser.add_argument("--no-seed", action="store_true",
+                        help="reuse the database seeded by a previous run")
+    parser.add_argument("--burst-interval", type=float, default=1.0,
+                        help="seconds between ingestion bursts")
+    parser.add_argument("--burst-size", type=int, default=50,
+                        help="POST /recently_played requests per burst")
+    parser.add_argument("--slo-p99-ms", type=float, default=250)
+    parser.add_argument("--slo-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed of the traffic mix")
+    parser.add_argument("--output", default=None,
+                        help="results file, defaults to benchmarks/results/load-<commit>.json")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args.uri, args.users, args.plays_per_user, args.tracks)
+    levels = asyncio.run(run(args))
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "slo": {"p99_ms": args.slo_p99_ms, "error_rate": args.slo_error_rate},
+            "levels": levels,
+        }, f, indent=2, default=float)
+    print(f"\nWrote results to {output}")
+
+
+if __name__ == "__main__":
+    main()
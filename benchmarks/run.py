@@ -0,0 +1,278 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from bson import ObjectId
+
+from spotify_advance.cache import TTLCache
+from spotify_advance.datamodels.track_record import RecentlyPlayedTrackRecord, TrackRecord
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.handlers.pagination import encode_cursor
+from spotify_advance.pipeline import Prefetcher
+from spotify_advance.utils import datetime_to_unix, datetime_to_unix_ms, parse_spotify_datetime
+from tests.helpers import fixture_id, fixture_spotify_api
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+BENCH_DATABASE = "spotify_advance_bench"
+BENCH_USER = "bench"
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+
+def measure(name: str, fn: Callable[[], object], size: int, items: int, repeat: int = 5, number: int = 1) -> dict:
+    """
+    Time fn, number calls per sample, repeat samples.
+
+    Args:
+        name: Benchmark name
+        fn: Code under test
+        size: Data size the benchmark ran at
+        items: Items processed by one sample, for throughput
+        repeat: Number of samples
+        number: Calls per sample
+
+    Returns:
+        dict: Timing statistics in seconds per sample, and items per second at the median
+    """
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append(perf_counter() - start)
+    median = statistics.median(samples)
+    result = {
+        "name": name,
+        "size": size,
+        "repeat": repeat,
+        "number": number,
+        "items": items,
+        "min": min(samples),
+        "median": median,
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "items_per_second": items / median if median else None,
+    }
+    print(f"{name:<45} size={size:<8} median={median * 1000:10.3f}ms  {result['items_per_second'] or 0:14.0f} items/s")
+    return result
+
+
+def track_doc(index: int) -> dict:
+    return {
+        "name": f"Track {index}",
+        "track_id": fixture_id(index),
+        "popularity": index % 100,
+        "uri": f"spotify:track:{fixture_id(index)}",
+        "album": f"Album {index // 10}",
+        "artists": [f"Artist {index // 50}"],
+        "duration_ms": 180000 + index % 60000,
+    }
+
+
+def play_doc(index: int, track_pool: int) -> dict:
+    return {
+        "user_id": BENCH_USER,
+        "track_id": fixture_id(index % track_pool),
+        "played_at": START + timedelta(minutes=3 * index),
+    }
+
+
+def bench_datamodels(sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for size in sizes:
+        tracks = [{**track_doc(index), "_id": ObjectId()} for index in range(size)]
+        plays = [{**play_doc(index, size), "_id": ObjectId()} for index in range(size)]
+        results.append(measure(
+            "datamodels.TrackRecord.from_bson", lambda: [TrackRecord.from_bson(doc) for doc in tracks], size, size, repeat))
+        results.append(measure(
+            "datamodels.RecentlyPlayedTrackRecord.from_bson",
+            lambda: [RecentlyPlayedTrackRecord.from_bson(doc) for doc in plays], size, size, repeat))
+        records = [RecentlyPlayedTrackRecord.from_bson(doc) for doc in plays]
+        results.append(measure(
+            "datamodels.RecentlyPlayedTrackRecord.to_json", lambda: [record.to_json() for record in records], size, size, repeat))
+    return results
+
+
+def bench_utils(sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for size in sizes:
+        stamps = [(START + timedelta(seconds=index)).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z" for index in range(size)]
+        results.append(measure("utils.datetime_to_unix", lambda: [datetime_to_unix(stamp) for stamp in stamps], size, size, repeat))
+        results.append(measure(
+            "utils.parse_spotify_datetime+datetime_to_unix_ms",
+            lambda: [datetime_to_unix_ms(parse_spotify_datetime(stamp)) for stamp in stamps], size, size, repeat))
+    return results
+
+
+def bench_spotify(pages: list[int], repeat: int) -> list[dict]:
+    results = []
+    for page_count in pages:
+        # TTL 0 so the response cache does not short-circuit repeats
+        spotify_api, _ = fixture_spotify_api(page_count, ttls={"saved_tracks": 0, "recently_played": 0})
+        items = page_count * 50
+        results.append(measure(
+            "spotify.get_recently_played_after", spotify_api.get_recently_played_after, page_count, items, repeat))
+        results.append(measure(
+            "spotify.get_saved_tracks.sequential",
+            lambda: spotify_api.get_saved_tracks(limit=50, concurrency=1), page_count, items, repeat))
+        results.append(measure(
+            "spotify.get_saved_tracks.parallel",
+            lambda: spotify_api.get_saved_tracks(limit=50, concurrency=8), page_count, items, repeat))
+        results.append(measure(
+            "spotify.get_saved_tracks_since", spotify_api.get_saved_tracks_since, page_count, items, repeat))
+        results.append(measure(
+            "spotify.iter_saved_tracks.prefetched",
+            lambda: sum(len(page) for page in Prefetcher(spotify_api.iter_saved_tracks())), page_count, items, repeat))
+    return results
+
+
+def checked(result: tuple) -> object:
+    """Fail the run instead of timing a handler call that only logged an error."""
+    value, message = result
+    if value is None:
+        raise RuntimeError(message)
+    return value
+
+
+def bench_handler(sizes: list[int], repeat: int, uri: str) -> list[dict]:
+    results = []
+    for size in sizes:
+        handler = MongoDBHandler(uri, create_indexes=False, track_cache=TTLCache(max_size=10000), database=BENCH_DATABASE)
+        handler.client.drop_database(BENCH_DATABASE)
+        handler.ensure_indexes()
+        track_pool = min(size, 10000)
+        tracks = [track_doc(index) for index in range(track_pool)]
+        plays = [play_doc(index, track_pool) for index in range(size)]
+
+        def store_plays():
+            for start in range(0, size, 1000):
+                checked(handler.store_recently_played_many(plays[start:start + 1000]))
+
+        # Inserts are not repeatable, the second run would only find duplicates
+        results.append(measure("handler.store_recently_played_many", store_plays, size, size, repeat=1))
+        results.append(measure("handler.store_recently_played_many.duplicates", store_plays, size, size, repeat=1))
+        results.append(measure("handler.store_tracks_many", lambda: checked(handler.store_tracks_many(tracks)), size, track_pool, repeat=1))
+
+        results.append(measure(
+            "handler.get_recently_played.first_page",
+            lambda: handler.get_recently_played(BENCH_USER, limit=50), size, 50 * 20, repeat, number=20))
+        middle = handler.recently_played.find({"user_id": BENCH_USER}).sort(
+            [("played_at", -1), ("_id", -1)]).skip(size // 2).limit(1)[0]
+        cursor = encode_cursor(middle["played_at"], middle["_id"])
+        results.append(measure(
+            "handler.get_recently_played.middle_page",
+            lambda: handler.get_recently_played(BENCH_USER, limit=50, after=cursor), size, 50 * 20, repeat, number=20))
+        results.append(measure(
+            "handler.get_recently_played.projected",
+            lambda: handler.get_recently_played(BENCH_USER, limit=50, projection=["track_id"]), size, 50 * 20, repeat,
+            number=20))
+        results.append(measure(
+            "handler.iter_plays", lambda: sum(1 for _ in handler.iter_plays(BENCH_USER)), size, size, repeat=1))
+
+        track_ids = [fixture_id(index) for index in range(0, track_pool, max(track_pool // 100, 1))]
+
+        def get_tracks_cold():
+            handler.track_cache.invalidate("track")
+            handler.get_tracks(track_ids)
+
+        results.append(measure("handler.get_tracks.cold", get_tracks_cold, size, len(track_ids), repeat, number=10))
+        results.append(measure(
+            "handler.get_tracks.warm", lambda: handler.get_tracks(track_ids), size, len(track_ids), repeat, number=10))
+        results.append(measure(
+            "handler.get_track.warm", lambda: handler.get_track(track_ids[0]), size, 1000, repeat, number=1000))
+
+        handler.client.drop_database(BENCH_DATABASE)
+        handler.client.close()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> list[str]:
+    """
+    Compare median times against a previous results file.
+
+    Returns:
+        list[str]: Benchmarks whose median got slower than the baseline by more than threshold
+    """
+    with open(baseline_path) as f:
+        baseline = {(result["name"], result["size"]): result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["name"], result["size"]))
+        if previous is None or not previous["median"]:
+            continue
+        change = result["median"] / previous["median"] - 1
+        line = f"{result['name']} size={result['size']}: {change:+.1%}"
+        print(line)
+        if change > threshold:
+            regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Run the offline microbenchmarks and write machine-readable results")
+    parser.add_argument("--groups", nargs="+", default=["datamodels", "utils", "spotify", "handler"],
+                        choices=["datamodels", "utils", "spotify", "handler"],
+                        help="benchmark groups to run")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help="document counts for the handler, datamodel and utils benchmarks")
+    parser.add_argument("--pages", nargs="+", type=int, default=[10, 100],
+                        help="page counts for the Spotify pagination benchmarks")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="samples per benchmark")
+    parser.add_argument("--uri", default="mongodb://localhost:27017",
+                        help="local MongoDB used by the handler benchmarks, in the spotify_advance_bench database")
+    parser.add_argument("--output", default=None,
+                        help="results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", default=None,
+                        help="previous results file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = []
+    if "datamodels" in args.groups:
+        results.extend(bench_datamodels(args.sizes, args.repeat))
+    if "utils" in args.groups:
+        results.extend(bench_utils(args.sizes, args.repeat))
+    if "spotify" in args.groups:
+        results.extend(bench_spotify(args.pages, args.repeat))
+    if "handler" in args.groups:
+        results.extend(bench_handler(args.sizes, args.repeat, args.uri))
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongo_uri": args.uri if "handler" in args.groups else None,
+            "results": results,
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+from spotify_advance.apis import get_client_data, get_mongodb_data
+from spotify_advance.apis.spotify import SpotifyAPI
+from spotify_advance.enrichment import TrackEnricher
+from spotify_advance.handlers.mongodb import MongoDBHandler
+
+
+def main():
+    spotify_api = SpotifyAPI(**get_client_data())
+    handler = MongoDBHandler(get_mongodb_data()['uri'])
+    print(TrackEnricher(spotify_api, handler).run())
+
+
+if __name__ == "__main__":
+    main()
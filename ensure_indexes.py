@@ -0,0 +1,21 @@
+from argparse import ArgumentParser
+
+from spotify_advance.apis import get_mongodb_data
+from spotify_advance.handlers.mongodb import MongoDBHandler
+
+
+def main():
+    parser = ArgumentParser(description="Create MongoDB indexes and verify handler query plans")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if any handler query falls back to COLLSCAN")
+    args = parser.parse_args()
+
+    handler = MongoDBHandler(get_mongodb_data()['uri'], create_indexes=False)
+    for name in handler.ensure_indexes():
+        print(name)
+    if args.check:
+        handler.check_query_plans()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,7 @@
-from fastapi import FastAPI
+from spotify_advance.apis.mongodb import create_app
 
-from spotify_advance.apis.mongodb import router as mongodb_router
-
-app = FastAPI(
-    title="Spotify Advance API",
-    description="API for Spotify Advance application",
-    version="1.0.0"
-)
-
-app.include_router(mongodb_router)
+# Nothing is loaded or connected until a server starts the app, so every worker connects on its own
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
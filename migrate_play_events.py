@@ -0,0 +1,22 @@
+from spotify_advance.apis import get_client_data, get_mongodb_data
+from spotify_advance.apis.spotify import SpotifyAPI
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.sync import RecentlyPlayedSync
+
+
+def main():
+    """
+    One-shot migration to per-event play history.
+
+    Plays used to be deduplicated on (user_id, track_id), so repeated plays of a track were dropped.
+    Ensures the (user_id, track_id, played_at) unique index and re-fetches every play Spotify still
+    returns for the authenticated user, inserting the ones that were dropped.
+    """
+    spotify_api = SpotifyAPI(**get_client_data())
+    handler = MongoDBHandler(get_mongodb_data()['uri'])
+    sync = RecentlyPlayedSync(spotify_api, handler)
+    print(sync.run(spotify_api.current_user['id'], backfill=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+from argparse import ArgumentParser
+
+from spotify_advance.apis import get_mongodb_data
+from spotify_advance.handlers.mongodb import MongoDBHandler
+
+
+def main():
+    parser = ArgumentParser(description="Recompute the daily play rollup from recently_played")
+    parser.add_argument("--user-id", help="rebuild a single user, all users if not given")
+    args = parser.parse_args()
+
+    handler = MongoDBHandler(get_mongodb_data()['uri'])
+    success, message = handler.rebuild_daily_plays(args.user_id)
+    print(message)
+    if not success:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
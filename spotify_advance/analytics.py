@@ -0,0 +1,222 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.utils import datetime_to_unix_ms, parse_spotify_datetime
+
+MS_PER_HOUR = 60 * 60 * 1000
+MS_PER_DAY = 24 * MS_PER_HOUR
+
+BUCKETS = {
+    "hour": MS_PER_HOUR,
+    "day": MS_PER_DAY,
+    "week": 7 * MS_PER_DAY,
+}
+
+
+def _encode(values: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Dictionary-encode values into (codes, dictionary)."""
+    dictionary, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+    return codes.astype(np.int32), dictionary
+
+
+def _naive_utc(played_at: datetime | str) -> datetime:
+    if isinstance(played_at, str):
+        played_at = parse_spotify_datetime(played_at)
+    if played_at.tzinfo is not None:
+        played_at = played_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return played_at
+
+
+def _to_unix_ms(played_at: list[datetime | str]) -> np.ndarray:
+    """Convert play times to int64 epoch milliseconds in one NumPy pass, naive datetimes being UTC."""
+    # Naive UTC datetimes, as returned by MongoDB, convert as is, others are normalized first
+    if any(isinstance(value, str) or value.tzinfo is not None for value in played_at):
+        played_at = [_naive_utc(value) for value in played_at]
+    return np.array(played_at, dtype="datetime64[ms]").astype(np.int64)
+
+
+class HistoryFrame:
+    """
+    Columnar view of a user's plays for vectorized analytics.
+
+    Plays are held as parallel NumPy arrays sorted by time: int64 epoch milliseconds and
+    dictionary-encoded track and primary-artist codes, so no per-play objects are built.
+    """
+
+    def __init__(self, played_at: np.ndarray, track_codes: np.ndarray, track_ids: np.ndarray,
+                 artist_codes: np.ndarray, artists: np.ndarray):
+        order = np.argsort(played_at, kind="stable")
+        self._assign(played_at[order], track_codes[order], track_ids, artist_codes[order], artists)
+
+    def _assign(self, played_at: np.ndarray, track_codes: np.ndarray, track_ids: np.ndarray,
+                artist_codes: np.ndarray, artists: np.ndarray):
+        self.played_at = played_at
+        self.track_codes = track_codes
+        self.track_ids = track_ids
+        self.artist_codes = artist_codes
+        self.artists = artists
+
+    @classmethod
+    def _from_sorted(cls, played_at: np.ndarray, track_codes: np.ndarray, track_ids: np.ndarray,
+                     artist_codes: np.ndarray, artists: np.ndarray) -> "HistoryFrame":
+        """Build a frame from columns already sorted by play time, such as slices of another frame."""
+        frame = cls.__new__(cls)
+        frame._assign(played_at, track_codes, track_ids, artist_codes, artists)
+        return frame
+
+    def __len__(self) -> int:
+        return len(self.played_at)
+
+    @classmethod
+    def from_records(cls, played_at: list[datetime | str], track_ids: list[str], artists: list[str] = None) -> "HistoryFrame":
+        """
+        Build a frame from parallel lists.
+
+        Args:
+            played_at: Play times as datetimes or Spotify timestamp strings
+            track_ids: Track ID of each play
+            artists: Primary artist of each play, unknown if not given
+
+        Returns:
+            HistoryFrame: Frame sorted by play time
+        """
+        timestamps = _to_unix_ms(played_at)
+        track_codes, track_dictionary = _encode(track_ids)
+        artist_codes, artist_dictionary = _encode(artists if artists is not None else [""] * len(track_ids))
+        return cls(timestamps, track_codes, track_dictionary, artist_codes, artist_dictionary)
+
+    @classmethod
+    def from_handler(cls, handler: MongoDBHandler, user_id: str, batch_size: int = 10000) -> "HistoryFrame":
+        """
+        Load a user's plays from MongoDB, resolving primary artists through the track cache.
+
+        Args:
+            handler: MongoDB handler
+            user_id: Spotify user ID
+            batch_size: Number of plays fetched per round trip
+
+        Returns:
+            HistoryFrame: Frame sorted by play time
+        """
+        played_at = []
+        track_ids = []
+        for doc in handler.iter_plays(user_id, batch_size):
+            played_at.append(doc["played_at"])
+            track_ids.append(doc["track_id"])
+
+        tracks, _ = handler.get_tracks(list(set(track_ids)))
+        primary_artist = {track["track_id"]: track["artists"][0] for track in tracks or [] if track.get("artists")}
+        artists = [primary_artist.get(track_id, "") for track_id in track_ids]
+        return cls.from_records(played_at, track_ids, artists)
+
+    def between(self, start: datetime = None, end: datetime = None) -> "HistoryFrame":
+        """
+        Slice the plays in [start, end) with a binary search on the sorted timestamps.
+        """
+        lo = np.searchsorted(self.played_at, datetime_to_unix_ms(start)) if start else 0
+        hi = np.searchsorted(self.played_at, datetime_to_unix_ms(end)) if end else len(self)
+        return self._from_sorted(self.played_at[lo:hi], self.track_codes[lo:hi], self.track_ids,
+                                 self.artist_codes[lo:hi], self.artists)
+
+    def _codes(self, by: str) -> tuple[np.ndarray, np.ndarray]:
+        if by == "track":
+            return self.track_codes, self.track_ids
+        if by == "artist":
+            return self.artist_codes, self.artists
+        raise ValueError(f"Invalid group key: {by}, expected 'track' or 'artist'")
+
+    def group_counts(self, by: str = "track") -> dict[str, int]:
+        """
+        Count plays per track or artist.
+
+        Args:
+            by: "track" or "artist"
+
+        Returns:
+            dict: Play count per ID or name
+        """
+        codes, dictionary = self._codes(by)
+        counts = np.bincount(codes, minlength=len(dictionary))
+        nonzero = np.flatnonzero(counts)
+        return dict(zip(dictionary[nonzero].tolist(), counts[nonzero].tolist()))
+
+    def top_k(self, k: int = 10, by: str = "track") -> list[tuple[str, int]]:
+        """
+        Get the k most played tracks or artists.
+
+        Args:
+            k: Number of results
+            by: "track" or "artist"
+
+        Returns:
+            list[tuple]: (ID or name, play count), most played first
+        """
+        codes, dictionary = self._codes(by)
+        counts = np.bincount(codes, minlength=len(dictionary))
+        k = min(k, np.count_nonzero(counts))
+        if k == 0:
+            return []
+        top = np.argpartition(-counts, k - 1)[:k]
+        top = top[np.lexsort((top, -counts[top]))]
+        return list(zip(dictionary[top].tolist(), counts[top].tolist()))
+
+    def bucket(self, unit: str = "day") -> tuple[np.ndarray, np.ndarray]:
+        """
+        Count plays per UTC time bucket.
+
+        Args:
+            unit: "hour", "day" or "week"
+
+        Returns:
+            tuple: Bucket start times (epoch milliseconds) and play counts, for non-empty buckets
+        """
+        if unit not in BUCKETS:
+            raise ValueError(f"Invalid bucket: {unit}, expected one of {', '.join(BUCKETS)}")
+        starts = self.played_at // BUCKETS[unit] * BUCKETS[unit]
+        return np.unique(starts, return_counts=True)
+
+    def plays_per_hour_of_day(self, utc_offset_hours: int = 0) -> np.ndarray:
+        """
+        Count plays per hour of day.
+
+        Args:
+            utc_offset_hours: Offset of the listener's timezone
+
+        Returns:
+            np.ndarray: 24 counts, index 0 being midnight
+        """
+        hours = (self.played_at // MS_PER_HOUR + utc_offset_hours) % 24
+        return np.bincount(hours, minlength=24)
+
+    def rolling_count(self, window_ms: int) -> np.ndarray:
+        """
+        Count, for every play, the plays in the trailing window ending at it (inclusive).
+
+        Args:
+            window_ms: Window length in milliseconds
+
+        Returns:
+            np.ndarray: One count per play
+        """
+        starts = np.searchsorted(self.played_at, self.played_at - window_ms, side="right")
+        return np.arange(1, len(self) + 1) - starts
+
+    def longest_streak(self, utc_offset_hours: int = 0) -> int:
+        """
+        Get the longest run of consecutive days with at least one play.
+
+        Args:
+            utc_offset_hours: Offset of the listener's timezone
+
+        Returns:
+            int: Number of days
+        """
+        if not len(self):
+            return 0
+        days = np.unique((self.played_at + utc_offset_hours * MS_PER_HOUR) // MS_PER_DAY)
+        breaks = np.flatnonzero(np.diff(days) != 1)
+        run_ends = np.concatenate((breaks, [len(days) - 1]))
+        run_starts = np.concatenate(([0], breaks + 1))
+        return int((run_ends - run_starts + 1).max())
@@ -1,4 +1,7 @@
 import os
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from functools import lru_cache
 from logging import getLogger
 
 from yaml import safe_load
@@ -6,20 +9,76 @@ from yaml import safe_load
 logger = getLogger("spotify_advance.api")
 logger.setLevel("INFO")
 
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf.yaml")
 
-def get_client_data():
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(current_dir, "conf.yaml")
-    with open(config_path, "r") as f:
-        return safe_load(f)["spotify"]
+# SPOTIFY_ADVANCE_<SECTION>__<KEY> overrides a conf.yaml value, e.g. SPOTIFY_ADVANCE_MONGODB__URI,
+# and SPOTIFY_ADVANCE_CONFIG points at another config file
+ENV_PREFIX = "SPOTIFY_ADVANCE_"
 
 
-def get_mongodb_data():
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(current_dir, "conf.yaml")
-    with open(config_path, "r") as f:
-        return safe_load(f)["mongodb"]
+@dataclass(frozen=True)
+class Settings:
+    """The spotify, mongodb and api sections of the config."""
 
+    spotify: dict = field(default_factory=dict)
+    mongodb: dict = field(default_factory=dict)
+    api: dict = field(default_factory=dict)
 
-client_data: dict[str, str] = get_client_data()
-mongodb_data: dict[str, str] = get_mongodb_data()
+
+def apply_env_overrides(config: dict, environ: Mapping[str, str]) -> dict:
+    """
+    Overlay SPOTIFY_ADVANCE_<SECTION>__<KEY> variables on a parsed config.
+
+    Values are read as YAML scalars, so numbers and booleans get the types they would have in conf.yaml.
+
+    Args:
+        config: Parsed config, left unchanged
+        environ: Environment variables
+
+    Returns:
+        dict: Config with the overrides applied
+    """
+    config = {section: dict(values or {}) for section, values in config.items()}
+    for name, value in environ.items():
+        if not name.startswith(ENV_PREFIX) or "__" not in name:
+            continue
+        section, _, key = name[len(ENV_PREFIX):].lower().partition("__")
+        config.setdefault(section, {})[key] = safe_load(value) if value else value
+    return config
+
+
+def load_settings(path: str = None, environ: Mapping[str, str] = None) -> Settings:
+    """
+    Read the config file and apply the environment overrides.
+
+    A missing file is not an error, so the config can come from the environment alone.
+
+    Args:
+        path: Config file, defaults to SPOTIFY_ADVANCE_CONFIG or conf.yaml next to this module
+        environ: Environment variables, defaults to os.environ
+
+    Returns:
+        Settings: The loaded settings
+    """
+    environ = os.environ if environ is None else environ
+    path = path or environ.get(f"{ENV_PREFIX}CONFIG", CONFIG_PATH)
+    config = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            config = safe_load(f) or {}
+    config = apply_env_overrides(config, environ)
+    return Settings(spotify=config.get("spotify", {}), mongodb=config.get("mongodb", {}), api=config.get("api", {}))
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """The process settings, loaded once on first use."""
+    return load_settings()
+
+
+def get_client_data() -> dict:
+    return get_settings().spotify
+
+
+def get_mongodb_data() -> dict:
+    return get_settings().mongodb
@@ -1,59 +1,255 @@
+import json
+import zlib
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from datetime import datetime
+from logging import getLogger
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 
-from spotify_advance.apis import client_data, mongodb_data
+from spotify_advance.apis import Settings, get_settings
 from spotify_advance.apis.spotify import SpotifyAPI
-from spotify_advance.datamodels.track_record import RecentlyPlayedTrackRecord
-from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.handlers.async_mongodb import AsyncMongoDBHandler
+from spotify_advance.handlers.pagination import decode_cursor, next_cursor
+from spotify_advance.handlers.similarity import DEFAULT_NEIGHBORS
+from spotify_advance.handlers.stats import window_start
+from spotify_advance.metrics import REGISTRY, MetricsMiddleware, SlowRequestProfiler
 
 
-class TrackRecord(BaseModel):
+class BatchResult(BaseModel):
+    inserted: int
+    duplicates: int
+
+
+class Page(BaseModel):
+    items: list[dict]
+    next: str | None = None
+
+
+# Request bodies of the write routes, unknown fields such as _id are rejected
+class RecentlyPlayedRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     user_id: str
     track_id: str
     played_at: datetime
 
 
-class SavedTrack(BaseModel):
+class SavedTrackRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     user_id: str
     track_id: str
     added_at: datetime
 
 
-app = FastAPI()
-handler = MongoDBHandler(mongodb_data['uri'])
-spotify_api = SpotifyAPI(**client_data)
+def validate_cursor(after: str | None = None) -> str | None:
+    if after is not None:
+        try:
+            decode_cursor(after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+    return after
+
+
+def validate_window(window: str = "7d") -> str:
+    try:
+        window_start(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    return window
+
+
+def to_page(items: list, field: str | None, limit: int) -> Page:
+    return Page(
+        items=[item if isinstance(item, dict) else item.to_json() for item in items],
+        next=next_cursor(items, field, limit))
+
+
+def to_json(value: object) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def ndjson_lines(handler: AsyncMongoDBHandler, user_id: str, batch_size: int) -> AsyncIterator[bytes]:
+    lines = []
+    async for doc in handler.iter_user_history(user_id, batch_size):
+        lines.append(json.dumps(doc, default=to_json))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+logger = getLogger("spotify_advance.api")
+
+router = APIRouter()
+
+
+class Resources:
+    """
+    Clients of an app, created on first use rather than at import or in create_app.
+
+    They are only ever created by the serving process, so a pre-forking server such as gunicorn
+    forks before any connection pool exists and every worker gets its own.
+    """
+
+    def __init__(self, settings: Settings = None):
+        self._settings = settings
+        self._handler: AsyncMongoDBHandler | None = None
+        self._spotify_api: SpotifyAPI | None = None
+
+    @property
+    def settings(self) -> Settings:
+        if self._settings is None:
+            self._settings = get_settings()
+        return self._settings
 
+    @property
+    def handler(self) -> AsyncMongoDBHandler:
+        if self._handler is None:
+            mongodb_data = self.settings.mongodb
+            self._handler = AsyncMongoDBHandler(
+                mongodb_data['uri'],
+                max_pool_size=mongodb_data.get('max_pool_size', 100),
+                min_pool_size=mongodb_data.get('min_pool_size', 0),
+                connect_timeout_ms=mongodb_data.get('connect_timeout_ms', 20000),
+                server_selection_timeout_ms=mongodb_data.get('server_selection_timeout_ms', 30000),
+                socket_timeout_ms=mongodb_data.get('socket_timeout_ms'),
+            )
+            REGISTRY.register_cache("tracks", self._handler.track_cache)
+        return self._handler
 
-@app.get("/me",
-         name="get_me",
-         description="get user from spotify",
-         tags=["me"])
-async def get_me() -> dict:
-    return spotify_api.current_user
+    @property
+    def spotify_api(self) -> SpotifyAPI:
+        if self._spotify_api is None:
+            self._spotify_api = SpotifyAPI(**self.settings.spotify)
+            REGISTRY.register_cache("spotify_responses", self._spotify_api.cache)
+        return self._spotify_api
 
+    async def close(self) -> None:
+        if self._handler is not None:
+            await self._handler.close()
+            self._handler = None
 
-@app.get("/recently_played/{user_id}",
-         name="get_recently_played",
-         description="get user recently played tracks from mongodb",
-         tags=["recently_played"],
-         response_model=list[RecentlyPlayedTrackRecord])
-async def get_recently_played(user_id: str) -> list[RecentlyPlayedTrackRecord]:
-    tracks, message = handler.get_recently_played(user_id)
-    if not tracks:
+
+# Async so the clients are created on the event loop, not concurrently by threadpool workers
+async def get_resources(request: Request) -> Resources:
+    return request.app.state.resources
+
+
+async def get_handler(resources: Resources = Depends(get_resources)) -> AsyncMongoDBHandler:
+    return resources.handler
+
+
+async def get_spotify_api(resources: Resources = Depends(get_resources)) -> SpotifyAPI:
+    return resources.spotify_api
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    resources: Resources = app.state.resources
+    api_data = resources.settings.api
+    # Opt-in: profile a sample of requests and log the ones slower than the threshold
+    app.state.profiler.threshold_ms = api_data.get("slow_request_ms")
+    app.state.profiler.sample_rate = api_data.get("profile_sample_rate", app.state.profiler.sample_rate)
+    await resources.handler.ensure_indexes()
+    yield
+    await resources.close()
+
+
+def create_app(settings: Settings = None) -> FastAPI:
+    """
+    Build the API without loading the config or connecting anything.
+
+    Args:
+        settings: Defaults to get_settings(), loaded when the app starts
+
+    Returns:
+        FastAPI: The app, its clients are created by the lifespan and on first use
+    """
+    app = FastAPI(
+        title="Spotify Advance API",
+        description="API for Spotify Advance application",
+        version="1.0.0",
+        lifespan=lifespan)
+    app.state.resources = Resources(settings)
+    app.state.profiler = SlowRequestProfiler(threshold_ms=None)
+    app.add_middleware(MetricsMiddleware, profiler=app.state.profiler)
+    app.include_router(router)
+    return app
+
+
+@router.get("/metrics",
+            name="get_metrics",
+            description="request, MongoDB, Spotify and cache metrics in Prometheus text format",
+            tags=["metrics"],
+            response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/me",
+            name="get_me",
+            description="get user from spotify",
+            tags=["me"])
+async def get_me(spotify_api: SpotifyAPI = Depends(get_spotify_api)) -> dict:
+    return await run_in_threadpool(lambda: spotify_api.current_user)
+
+
+@router.get("/recently_played/{user_id}",
+            name="get_recently_played",
+            description="get user recently played tracks from mongodb, newest first",
+            tags=["recently_played"],
+            response_model=Page)
+async def get_recently_played(user_id: str, limit: int = Query(50, ge=1, le=1000),
+                              after: str | None = Depends(validate_cursor),
+                              fields: list[str] | None = Query(None),
+                              handler: AsyncMongoDBHandler = Depends(get_handler)) -> Page:
+    tracks, message = await handler.get_recently_played(user_id, limit, after, fields)
+    if tracks is None:
         raise HTTPException(
             status_code=500, detail=message)
-    return tracks
+    return to_page(tracks, "played_at", limit)
+
 
+@router.get("/recently_played/{user_id}/expanded",
+            name="get_recently_played_expanded",
+            description="get user recently played tracks joined with track name, artists and album, newest first",
+            tags=["recently_played"],
+            response_model=Page)
+async def get_recently_played_expanded(user_id: str, limit: int = Query(50, ge=1, le=1000),
+                                       after: str | None = Depends(validate_cursor),
+                                       fields: list[str] | None = Query(None),
+                                       handler: AsyncMongoDBHandler = Depends(get_handler)) -> Page:
+    tracks, message = await handler.get_recently_played_expanded(user_id, limit, after, fields)
+    if tracks is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return to_page(tracks, "played_at", limit)
 
-@app.post("/recently_played",
-          name="store_recently_played",
-          description="store recently played track in mongodb",
-          tags=["recently_played"],
-          response_model=dict)
-async def store_recently_played(user_id: str, track_id: str, played_at: datetime) -> dict:
-    success, message = handler.store_recently_played(
+
+@router.post("/recently_played",
+             name="store_recently_played",
+             description="store recently played track in mongodb",
+             tags=["recently_played"],
+             response_model=dict)
+async def store_recently_played(user_id: str, track_id: str, played_at: datetime, handler: AsyncMongoDBHandler = Depends(get_handler)) -> dict:
+    success, message = await handler.store_recently_played(
         user_id, track_id, played_at)
     if not success:
         raise HTTPException(
@@ -61,25 +257,39 @@ async def store_recently_played(user_id: str, track_id: str, played_at: datetime
     return {"message": message}
 
 
-@app.delete("/recently_played/{user_id}",
-            description="delete all recently played tracks for a user from mongodb",
-            tags=["recently_played"],
-            response_model=bool)
-async def delete_user_recently_played(user_id: str) -> bool:
-    success, message = handler.delete_user_recently_played(user_id)
+@router.post("/recently_played/batch",
+             name="store_recently_played_many",
+             description="store many recently played tracks in mongodb",
+             tags=["recently_played"],
+             response_model=BatchResult)
+async def store_recently_played_many(request: list[RecentlyPlayedRequest], handler: AsyncMongoDBHandler = Depends(get_handler)) -> BatchResult:
+    counts, message = await handler.store_recently_played_many(
+        [record.model_dump() for record in request])
+    if counts is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return BatchResult(**counts)
+
+
+@router.delete("/recently_played/{user_id}",
+               description="delete all recently played tracks for a user from mongodb",
+               tags=["recently_played"],
+               response_model=bool)
+async def delete_user_recently_played(user_id: str, handler: AsyncMongoDBHandler = Depends(get_handler)) -> bool:
+    success, message = await handler.delete_user_recently_played(user_id)
     if not success:
         raise HTTPException(
             status_code=500, detail=message)
     return success
 
 
-@app.post("/saved_tracks",
-          name="store_saved_track",
-          description="store saved track in mongodb",
-          tags=["saved_tracks"],
-          response_model=SavedTrack)
-async def store_saved_track(request: SavedTrack) -> SavedTrack:
-    success, message = handler.store_saved_track(
+@router.post("/saved_tracks",
+             name="store_saved_track",
+             description="store saved track in mongodb",
+             tags=["saved_tracks"],
+             response_model=SavedTrackRequest)
+async def store_saved_track(request: SavedTrackRequest, handler: AsyncMongoDBHandler = Depends(get_handler)) -> SavedTrackRequest:
+    success, message = await handler.store_saved_track(
         request.user_id, request.track_id, request.added_at)
     if not success:
         raise HTTPException(
@@ -87,47 +297,64 @@ async def store_saved_track(request: SavedTrack) -> SavedTrack:
     return request
 
 
-@app.get("/saved_tracks/{user_id}",
-         name="get_saved_tracks",
-         description="get user saved tracks from mongodb",
-         tags=["saved_tracks"],
-         response_model=list[SavedTrack])
-async def get_saved_tracks(user_id: str) -> list[SavedTrack]:
-    tracks, message = handler.get_saved_tracks(user_id)
-    if not tracks:
+@router.post("/saved_tracks/batch",
+             name="store_saved_tracks_many",
+             description="store many saved tracks in mongodb",
+             tags=["saved_tracks"],
+             response_model=BatchResult)
+async def store_saved_tracks_many(request: list[SavedTrackRequest], handler: AsyncMongoDBHandler = Depends(get_handler)) -> BatchResult:
+    counts, message = await handler.store_saved_tracks_many(
+        [record.model_dump() for record in request])
+    if counts is None:
         raise HTTPException(
             status_code=500, detail=message)
-    return tracks
+    return BatchResult(**counts)
 
 
-@app.delete("/saved_tracks",
-            name="delete_user_saved_tracks",
-            description="delete all saved tracks for a user from mongodb",
+@router.get("/saved_tracks/{user_id}",
+            name="get_saved_tracks",
+            description="get user saved tracks from mongodb, most recently added first",
             tags=["saved_tracks"],
-            response_model=dict)
-async def delete_user_saved_tracks(user_id: str, track_id: str) -> dict:
-    success, message = handler.delete_user_saved_tracks(user_id, track_id)
+            response_model=Page)
+async def get_saved_tracks(user_id: str, limit: int = Query(50, ge=1, le=1000),
+                           after: str | None = Depends(validate_cursor),
+                           fields: list[str] | None = Query(None),
+                           handler: AsyncMongoDBHandler = Depends(get_handler)) -> Page:
+    tracks, message = await handler.get_saved_tracks(user_id, limit, after, fields)
+    if tracks is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return to_page(tracks, "added_at", limit)
+
+
+@router.delete("/saved_tracks",
+               name="delete_user_saved_tracks",
+               description="delete all saved tracks for a user from mongodb",
+               tags=["saved_tracks"],
+               response_model=dict)
+async def delete_user_saved_tracks(user_id: str, track_id: str, handler: AsyncMongoDBHandler = Depends(get_handler)) -> dict:
+    success, message = await handler.delete_user_saved_tracks(user_id, track_id)
     if not success:
         raise HTTPException(
             status_code=500, detail=message)
     return {"message": message}
 
 
-@app.post("/tracks",
-          name="store_track",
-          description="store track in mongodb",
-          tags=["tracks"],
-          response_model=bool)
-async def store_track(request: dict) -> None:
-    print(f"request: {request}")
+@router.post("/tracks",
+             name="store_track",
+             description="store track in mongodb",
+             tags=["tracks"],
+             response_model=bool)
+async def store_track(request: dict, handler: AsyncMongoDBHandler = Depends(get_handler)) -> None:
     track = request['track']
+    logger.debug(f"Storing track: {track['id']}")
     name = track['name']
     track_id = track['id']
     popularity = track['popularity']
     uri = track['uri']
     album = track['album']
     artists = track['artists']
-    success, message = handler.store_track(
+    success, message = await handler.store_track(
         name, track_id, popularity, uri, album, artists)
     if not success:
         raise HTTPException(
@@ -135,40 +362,165 @@ async def store_track(request: dict) -> None:
     return success
 
 
-@app.get("/tracks/all",
-         name="get_all_tracks",
-         description="get all tracks from mongodb",
-         tags=["tracks"],
-         response_model=list[dict])
-async def get_all_tracks() -> list[dict]:
-    tracks, message = handler.get_all_tracks()
-    if not tracks:
+@router.get("/tracks",
+            name="get_tracks",
+            description="get many tracks from mongodb",
+            tags=["tracks"],
+            response_model=list[dict])
+async def get_tracks(ids: list[str] = Query(..., max_length=1000),
+                     handler: AsyncMongoDBHandler = Depends(get_handler)) -> list[dict]:
+    tracks, message = await handler.get_tracks(ids)
+    if tracks is None:
         raise HTTPException(
             status_code=500, detail=message)
     return tracks
 
 
-@app.get("/tracks/{track_id}",
-         name="get_track",
-         description="get track from mongodb",
-         tags=["tracks"],
-         response_model=dict)
-async def get_track(track_id: str) -> dict:
-    track, message = handler.get_track(track_id)
+@router.get("/tracks/all",
+            name="get_all_tracks",
+            description="get all tracks from mongodb",
+            tags=["tracks"],
+            response_model=Page)
+async def get_all_tracks(limit: int = Query(100, ge=1, le=1000),
+                         after: str | None = Depends(validate_cursor),
+                         fields: list[str] | None = Query(None),
+                         handler: AsyncMongoDBHandler = Depends(get_handler)) -> Page:
+    tracks, message = await handler.get_all_tracks(limit, after, fields)
+    if tracks is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return to_page(tracks, None, limit)
+
+
+@router.get("/tracks/{track_id}",
+            name="get_track",
+            description="get track from mongodb",
+            tags=["tracks"],
+            response_model=dict)
+async def get_track(track_id: str, handler: AsyncMongoDBHandler = Depends(get_handler)) -> dict:
+    track, message = await handler.get_track(track_id)
     if not track:
         raise HTTPException(
             status_code=500, detail=message)
     return track
 
 
-@app.delete("/tracks/{track_id}",
-            name="delete_track",
-            description="delete track from mongodb",
+@router.get("/tracks/{track_id}/related",
+            name="get_related_tracks",
+            description="get tracks most often listened to together with a track",
             tags=["tracks"],
-            response_model=bool)
-async def delete_track(track_id: str) -> bool:
-    success, message = handler.delete_track(track_id)
+            response_model=list[dict])
+async def get_related_tracks(track_id: str,
+                             limit: int = Query(10, ge=1, le=DEFAULT_NEIGHBORS),
+                             handler: AsyncMongoDBHandler = Depends(get_handler)) -> list[dict]:
+    related, message = await handler.get_related_tracks(track_id, limit)
+    if related is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return related
+
+
+@router.delete("/tracks/{track_id}",
+               name="delete_track",
+               description="delete track from mongodb",
+               tags=["tracks"],
+               response_model=bool)
+async def delete_track(track_id: str, handler: AsyncMongoDBHandler = Depends(get_handler)) -> bool:
+    success, message = await handler.delete_track(track_id)
     if not success:
         raise HTTPException(
             status_code=500, detail=message)
     return success
+
+
+@router.get("/stats/{user_id}/top_tracks",
+            name="get_top_tracks",
+            description="get user most played tracks in a window such as 7d, 30d or all",
+            tags=["stats"],
+            response_model=list[dict])
+async def get_top_tracks(user_id: str,
+                         window: str = Depends(validate_window),
+                         limit: int = Query(10, ge=1, le=100),
+                         handler: AsyncMongoDBHandler = Depends(get_handler)) -> list[dict]:
+    stats, message = await handler.get_top_tracks(user_id, window, limit)
+    if stats is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return stats
+
+
+@router.get("/stats/{user_id}/top_artists",
+            name="get_top_artists",
+            description="get user most played artists in a window such as 7d, 30d or all",
+            tags=["stats"],
+            response_model=list[dict])
+async def get_top_artists(user_id: str,
+                          window: str = Depends(validate_window),
+                          limit: int = Query(10, ge=1, le=100),
+                          handler: AsyncMongoDBHandler = Depends(get_handler)) -> list[dict]:
+    stats, message = await handler.get_top_artists(user_id, window, limit)
+    if stats is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return stats
+
+
+@router.get("/stats/{user_id}/play_counts",
+            name="get_play_counts",
+            description="get user number of plays per day in a window such as 7d, 30d or all",
+            tags=["stats"],
+            response_model=list[dict])
+async def get_play_counts(user_id: str,
+                          window: str = Depends(validate_window),
+                          handler: AsyncMongoDBHandler = Depends(get_handler)) -> list[dict]:
+    stats, message = await handler.get_play_counts(user_id, window)
+    if stats is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return stats
+
+
+@router.get("/sessions/{user_id}",
+            name="get_sessions",
+            description="get user stored listening sessions, newest first",
+            tags=["sessions"],
+            response_model=Page)
+async def get_sessions(user_id: str, limit: int = Query(50, ge=1, le=1000),
+                       after: str | None = Depends(validate_cursor),
+                       handler: AsyncMongoDBHandler = Depends(get_handler)) -> Page:
+    sessions, message = await handler.get_sessions(user_id, limit, after)
+    if sessions is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return to_page(sessions, "start", limit)
+
+
+@router.post("/sessions/{user_id}/refresh",
+             name="refresh_sessions",
+             description="detect listening sessions in plays stored since the last refresh, reopening the sessions "
+                         "that older late-arriving plays fall into",
+             tags=["sessions"])
+async def refresh_sessions(user_id: str, rebuild: bool = False,
+                           handler: AsyncMongoDBHandler = Depends(get_handler)) -> dict:
+    written, message = await handler.update_sessions(user_id, rebuild=rebuild)
+    if written is None:
+        raise HTTPException(
+            status_code=500, detail=message)
+    return {"written": written}
+
+
+@router.get("/export/{user_id}.ndjson",
+            name="export_user_history",
+            description="stream user recently played and saved tracks from mongodb as NDJSON",
+            tags=["export"],
+            response_class=StreamingResponse)
+async def export_user_history(user_id: str,
+                              batch_size: int = Query(1000, ge=1, le=10000),
+                              gzip: bool = False,
+                              handler: AsyncMongoDBHandler = Depends(get_handler)) -> StreamingResponse:
+    chunks = ndjson_lines(handler, user_id, batch_size)
+    headers = {"Content-Disposition": f'attachment; filename="{user_id}.ndjson"'}
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
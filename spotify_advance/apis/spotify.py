@@ -1,12 +1,51 @@
-from functools import lru_cache
+import random
+import time
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import takewhile
 from logging import getLogger
 
-from spotipy import Spotify, SpotifyOAuth
+import requests
+from spotipy import CacheHandler, Spotify, SpotifyException, SpotifyOAuth
+
+from spotify_advance.cache import TTLCache
+from spotify_advance.http_session import DEFAULT_TIMEOUT, shared_session
+from spotify_advance.pipeline import aprefetch
+from spotify_advance.ratelimit import TokenBucket
+from spotify_advance.utils import datetime_to_unix_ms, parse_spotify_datetime
+
+# Seconds each endpoint's responses are served from the cache
+DEFAULT_TTLS = {
+    "current_user": 3600,
+    "recently_played": 60,
+    "saved_tracks": 300,
+}
+
+# Largest page size accepted by the library endpoints
+MAX_PAGE_SIZE = 50
+
+# Largest number of IDs accepted by the multi-ID endpoints
+MAX_TRACK_IDS = 50
+MAX_ARTIST_IDS = 50
+MAX_ALBUM_IDS = 20
 
 
 class SpotifyAPI:
 
-    def __init__(self, client_id: str, client_secret: str, redirect_uri: str):
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        redirect_uri: str,
+        cache: TTLCache = None,
+        ttls: dict[str, float] = None,
+        concurrency: int = 8,
+        max_retries: int = 5,
+        cache_handler: CacheHandler = None,
+        rate_limiter: TokenBucket = None,
+        http_session: requests.Session = None,
+        requests_timeout: float | tuple[float, float] = DEFAULT_TIMEOUT
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
@@ -18,58 +57,252 @@ class SpotifyAPI:
             "user-read-recently-played"
         ]
 
+        # Pooled keep-alive connections are reused by every client and pagination hop
+        self.http_session = http_session if http_session is not None else shared_session()
+
         self.auth_manager = SpotifyOAuth(
             client_id=self.client_id,
             client_secret=self.client_secret,
             redirect_uri=self.redirect_uri,
-            scope=scopes
+            scope=scopes,
+            cache_handler=cache_handler,
+            requests_session=self.http_session,
+            requests_timeout=requests_timeout
         )
 
-        self.sp = Spotify(auth_manager=self.auth_manager)
+        self.sp = Spotify(
+            auth_manager=self.auth_manager,
+            requests_session=self.http_session,
+            requests_timeout=requests_timeout)
         self._logger = getLogger("spotify_advance.api")
 
+        self.cache = cache if cache is not None else TTLCache(max_size=256)
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        # Shared between the clients of every user so they stay within one request budget
+        self.rate_limiter = rate_limiter
+        # (profile, monotonic expiry) of the authenticated user
+        self._current_user: tuple[dict | None, float] = (None, 0.0)
+
     @property
-    @lru_cache(maxsize=1)
     def current_user(self):
-        return self.sp.current_user()
+        # Held by the client rather than the cache, which may be shared with other users' clients
+        # and keys every other endpoint on the user ID read from this profile
+        profile, expires_at = self._current_user
+        if profile is None or time.monotonic() >= expires_at:
+            profile = self.sp.current_user()
+            self._current_user = (profile, time.monotonic() + self.ttls["current_user"])
+        return profile
+
+    @property
+    def user_id(self) -> str:
+        return self.current_user['id']
+
+    def invalidate_cache(self, endpoint: str = None) -> int:
+        """
+        Drop cached responses of the authenticated user.
+
+        Args:
+            endpoint: Only drop this endpoint, e.g. "recently_played"
+
+        Returns:
+            int: Number of dropped entries
+        """
+        if endpoint == "current_user":
+            dropped = int(self._current_user[0] is not None)
+            self._current_user = (None, 0.0)
+            return dropped
+        dropped = self.cache.invalidate(endpoint, self.user_id)
+        if endpoint is None:
+            dropped += self.invalidate_cache("current_user")
+        return dropped
 
-    @lru_cache(maxsize=1)
     def get_recently_played(self, limit: int = 20, before: str = None, after: str = None):
-        recently_played = []
-        tracks = self.sp.current_user_recently_played(
-            limit=limit, after=after, before=before)
+        return self.cache.get_or_set(
+            ("recently_played", self.user_id, limit, before, after),
+            lambda: self._fetch_recently_played(limit, before, after),
+            self.ttls["recently_played"])
+
+    def _fetch_recently_played(self, limit: int, before: str, after: str):
+        return [item for page in self.iter_recently_played(after=after, before=before, limit=limit) for item in page]
+
+    def iter_recently_played(self, after: int = None, before: int = None, limit: int = MAX_PAGE_SIZE) -> Iterator[list[dict]]:
+        """
+        Fetch play history one page per request, bypassing the response cache.
+
+        Args:
+            after: Unix time in milliseconds, only plays after it are returned
+            before: Unix time in milliseconds, only plays before it are returned
+            limit: Page size, at most 50
+
+        Yields:
+            list[dict]: Play history items of a page
+        """
+        tracks = self._call_with_backoff(self.sp.current_user_recently_played, limit=limit, after=after, before=before)
 
         while tracks:
-            for i, item in enumerate(tracks['items']):
-                recently_played.append(item)
-                track = item['track']
-                if i % 10 == 0:
-                    self._logger.debug(
-                        i, track['artists'][0]['name'], ' - ', track['name'], end="\n")
-                else:
-                    self._logger.debug(
-                        i, track['artists'][0]['name'], ' - ', track['name'], end=" ")
+            if tracks['items']:
+                yield tracks['items']
+            tracks = self._call_with_backoff(self.sp.next, tracks) if tracks['next'] else None
+
+    async def aiter_recently_played(self, after: int = None, before: int = None, limit: int = MAX_PAGE_SIZE,
+                                    prefetch: int = 2) -> AsyncIterator[list[dict]]:
+        """iter_recently_played for async callers, pages are fetched in a thread up to prefetch pages ahead."""
+        async for page in aprefetch(self.iter_recently_played(after, before, limit), prefetch):
+            yield page
+
+    def get_recently_played_after(self, after: int = None, limit: int = 50) -> list[dict]:
+        """
+        Fetch plays newer than a cursor, bypassing the response cache.
+
+        Args:
+            after: Unix time in milliseconds, only plays after it are returned
+            limit: Page size, at most 50
+
+        Returns:
+            list[dict]: Play history items, oldest first
+        """
+        recently_played = [item for page in self.iter_recently_played(after=after, limit=limit) for item in page]
+        return sorted(recently_played, key=lambda item: item['played_at'])
 
-            if tracks['next']:
-                tracks = self.sp.next(tracks)
-            else:
-                tracks = None
+    def get_saved_tracks_since(self, after: int = None, market: str = None) -> list[dict]:
+        """
+        Fetch tracks saved after a cursor, bypassing the response cache.
 
-        return recently_played
+        The library is returned newest first, so paging stops at the first page reaching the cursor.
 
-    @lru_cache(maxsize=1)
-    def get_saved_tracks(self, limit: int = 20, offset: int = 0, market: str = None):
-        saved_tracks = []
-        tracks: list[dict] = self.sp.current_user_saved_tracks(
-            limit=limit, offset=offset, market=market)
+        Args:
+            after: Unix time in milliseconds, only tracks added after it are returned
+            market: ISO 3166-1 country code
+
+        Returns:
+            list[dict]: Saved track items, newest first
+        """
+        return [item for page in self.iter_saved_tracks(market=market, after=after) for item in page]
+
+    def iter_saved_tracks(self, limit: int = MAX_PAGE_SIZE, offset: int = 0, market: str = None,
+                          after: int = None) -> Iterator[list[dict]]:
+        """
+        Fetch the user's saved tracks one page per request, newest first, bypassing the response cache.
+
+        Args:
+            limit: Page size, at most 50
+            offset: Index of the first track
+            market: ISO 3166-1 country code
+            after: Unix time in milliseconds, paging stops at the first track added at or before it
+
+        Yields:
+            list[dict]: Saved track items of a page
+        """
+        tracks = self._call_with_backoff(self.sp.current_user_saved_tracks, limit=limit, offset=offset, market=market)
 
         while tracks:
-            for item in tracks['items']:
-                saved_tracks.append(item)
+            items = tracks['items']
+            if after is not None:
+                items = list(takewhile(
+                    lambda item: datetime_to_unix_ms(parse_spotify_datetime(item['added_at'])) > after, items))
+            if items:
+                yield items
+            if len(items) < len(tracks['items']):
+                return
+            tracks = self._call_with_backoff(self.sp.next, tracks) if tracks['next'] else None
+
+    async def aiter_saved_tracks(self, limit: int = MAX_PAGE_SIZE, offset: int = 0, market: str = None,
+                                 after: int = None, prefetch: int = 2) -> AsyncIterator[list[dict]]:
+        """iter_saved_tracks for async callers, pages are fetched in a thread up to prefetch pages ahead."""
+        async for page in aprefetch(self.iter_saved_tracks(limit, offset, market, after), prefetch):
+            yield page
+
+    def _call_with_backoff(self, fetch, *args, **kwargs):
+        """
+        Call a Spotify endpoint, sleeping and retrying when rate limited.
+
+        Honors the Retry-After header of 429 responses, falling back to exponential backoff,
+        with jitter so parallel workers do not retry in lockstep. With a rate limiter every
+        attempt takes a token and a 429 pauses the shared bucket.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                return fetch(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == self.max_retries:
+                    raise
+                retry_after = (e.headers or {}).get("Retry-After")
+                delay = float(retry_after) if retry_after else 2 ** attempt
+                delay += random.uniform(0, 1)
+                self._logger.warning(f"Rate limited by Spotify, retrying in {delay:.1f}s")
+                if self.rate_limiter is not None:
+                    # The limiter sleeps before the next attempt
+                    self.rate_limiter.pause(delay)
+                else:
+                    time.sleep(delay)
+
+    def _get_many(self, fetch, ids: list[str], chunk_size: int, key: str) -> list[dict]:
+        items = []
+        for start in range(0, len(ids), chunk_size):
+            response = self._call_with_backoff(fetch, ids[start:start + chunk_size])
+            # Unknown IDs come back as null entries
+            items.extend(item for item in response[key] if item)
+        return items
+
+    def get_tracks(self, track_ids: list[str]) -> list[dict]:
+        """Get full track objects, 50 IDs per request."""
+        return self._get_many(self.sp.tracks, track_ids, MAX_TRACK_IDS, 'tracks')
+
+    def get_artists(self, artist_ids: list[str]) -> list[dict]:
+        """Get full artist objects, 50 IDs per request."""
+        return self._get_many(self.sp.artists, artist_ids, MAX_ARTIST_IDS, 'artists')
+
+    def get_albums(self, album_ids: list[str]) -> list[dict]:
+        """Get full album objects, 20 IDs per request."""
+        return self._get_many(self.sp.albums, album_ids, MAX_ALBUM_IDS, 'albums')
+
+    def get_saved_tracks(self, limit: int = 20, offset: int = 0, market: str = None, concurrency: int = None):
+        """
+        Get the user's saved tracks from offset to the end of the library.
+
+        Args:
+            limit: Page size of the first request
+            offset: Index of the first track
+            market: ISO 3166-1 country code
+            concurrency: Pages fetched in parallel once the total is known, defaults to the instance setting
+
+        Returns:
+            list[dict]: Saved track items, newest first
+        """
+        concurrency = concurrency or self.concurrency
+        return self.cache.get_or_set(
+            ("saved_tracks", self.user_id, limit, offset, market),
+            lambda: self._fetch_saved_tracks(limit, offset, market, concurrency),
+            self.ttls["saved_tracks"])
+
+    def _fetch_saved_tracks(self, limit: int, offset: int, market: str, concurrency: int):
+        if concurrency > 1:
+            return self._fetch_saved_tracks_parallel(limit, offset, market, concurrency)
+
+        return [item for page in self.iter_saved_tracks(limit, offset, market) for item in page]
+
+    def _fetch_saved_tracks_parallel(self, limit: int, offset: int, market: str, concurrency: int):
+        first = self._call_with_backoff(
+            self.sp.current_user_saved_tracks, limit=limit, offset=offset, market=market)
+        saved_tracks = list(first['items'])
+
+        # The first page carries the library size, so every remaining offset is known up front
+        offsets = range(offset + len(first['items']), first['total'], MAX_PAGE_SIZE)
+        if not first['items'] or not offsets:
+            return saved_tracks
+
+        def fetch_page(page_offset: int) -> list[dict]:
+            page = self._call_with_backoff(
+                self.sp.current_user_saved_tracks, limit=MAX_PAGE_SIZE, offset=page_offset, market=market)
+            return page['items']
 
-            if tracks['next']:
-                tracks = self.sp.next(tracks)
-            else:
-                tracks = None
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # map yields pages in offset order regardless of completion order
+            for items in executor.map(fetch_page, offsets):
+                saved_tracks.extend(items)
 
         return saved_tracks
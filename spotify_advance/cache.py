@@ -0,0 +1,214 @@
+import json
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from threading import Lock
+from time import monotonic
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries optionally expire after a time to live.
+
+    Keys are tuples whose first element names the endpoint and second element the user,
+    so entries can be invalidated per endpoint, per user or both.
+    """
+
+    def __init__(self, max_size: int = 1024, default_ttl: float | None = None, clock: Callable[[], float] = monotonic):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[object, float | None]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: object = None, count: bool = True) -> object:
+        """
+        Get a value and mark it as recently used.
+
+        Args:
+            key: Cache key
+            default: Returned when the key is missing or expired
+            count: Whether the lookup is recorded in the hit/miss metrics
+
+        Returns:
+            The cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: object, ttl: float | None = _MISSING) -> None:
+        """
+        Store a value, evicting the least recently used entries above max_size.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Seconds until the entry expires, None to never expire, default_ttl if not given
+        """
+        ttl = self.default_ttl if ttl is _MISSING else ttl
+        expires_at = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key: Hashable, fetch: Callable[[], object], ttl: float | None = _MISSING) -> object:
+        """
+        Read-through lookup: return the cached value, or fetch, store and return it.
+
+        Args:
+            key: Cache key
+            fetch: Called on a miss to produce the value
+            ttl: Seconds until the entry expires
+
+        Returns:
+            The cached or fetched value
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = fetch()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, endpoint: str | None = None, user_id: str | None = None) -> int:
+        """
+        Drop entries matching an endpoint and/or user, or everything when neither is given.
+
+        Args:
+            endpoint: First element of the key
+            user_id: Second element of the key
+
+        Returns:
+            int: Number of dropped entries
+        """
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (endpoint is None or _part(key, 0) == endpoint) and (user_id is None or _part(key, 1) == user_id)
+            ]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def delete(self, key: Hashable) -> bool:
+        """
+        Drop a single entry.
+
+        Returns:
+            bool: True if the key was cached
+        """
+        with self._lock:
+            return self._entries.pop(key, _MISSING) is not _MISSING
+
+    def stats(self) -> dict:
+        """
+        Get hit/miss metrics.
+
+        Returns:
+            dict: size, hits, misses, evictions, expirations and hit_ratio
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _part(key: Hashable, index: int) -> object:
+    return key[index] if isinstance(key, tuple) and len(key) > index else _MISSING
+
+
+class RedisCache:
+    """
+    Shared cache backend with the TTLCache interface, so several workers can share entries.
+
+    Values must be JSON serializable. Requires the redis package; TTLCache is the
+    in-process stand-in when it is not available.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "spotify_advance", default_ttl: float | None = None):
+        from redis import Redis
+
+        self._redis = Redis.from_url(url)
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key: Hashable) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return ":".join([self.prefix, *(str(part) for part in parts)])
+
+    def __contains__(self, key: Hashable) -> bool:
+        return bool(self._redis.exists(self._key(key)))
+
+    def get(self, key: Hashable, default: object = None, count: bool = True) -> object:
+        raw = self._redis.get(self._key(key))
+        if count:
+            if raw is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key: Hashable, value: object, ttl: float | None = _MISSING) -> None:
+        ttl = self.default_ttl if ttl is _MISSING else ttl
+        if ttl is not None and ttl <= 0:
+            # Already expired, as in TTLCache, rather than stored without an expiry
+            self._redis.delete(self._key(key))
+            return
+        self._redis.set(self._key(key), json.dumps(value, default=str), px=max(int(ttl * 1000), 1) if ttl is not None else None)
+
+    def get_or_set(self, key: Hashable, fetch: Callable[[], object], ttl: float | None = _MISSING) -> object:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = fetch()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, key: Hashable) -> bool:
+        return bool(self._redis.delete(self._key(key)))
+
+    def invalidate(self, endpoint: str | None = None, user_id: str | None = None) -> int:
+        pattern = self._key((endpoint or "*", user_id or "*")) + "*"
+        keys = list(self._redis.scan_iter(match=pattern))
+        return self._redis.delete(*keys) if keys else 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -2,11 +2,37 @@ from spotify_advance.datamodels.artist import Artist
 
 
 class Album:
+    __slots__ = ("album_id", "name", "uri", "artists", "popularity", "images", "release_date", "total_tracks")
 
-    def __init__(self, artists: list[Artist], id: str, uri: str, name: str, popularity: int, images: list[dict], **kwargs):
+    def __init__(
+        self,
+        artists: list[Artist],
+        id: str,
+        uri: str,
+        name: str,
+        images: list[dict],
+        popularity: int = None,
+        release_date: str = None,
+        total_tracks: int = None,
+        **kwargs
+    ):
         self.album_id = id
         self.name = name
         self.uri = uri
         self.artists = artists
         self.popularity = popularity
         self.images = images
+        self.release_date = release_date
+        self.total_tracks = total_tracks
+
+    def to_document(self) -> dict:
+        return {
+            "album_id": self.album_id,
+            "name": self.name,
+            "uri": self.uri,
+            "artist_ids": [artist['id'] if isinstance(artist, dict) else artist.artist_id for artist in self.artists],
+            "popularity": self.popularity,
+            "images": self.images,
+            "release_date": self.release_date,
+            "total_tracks": self.total_tracks,
+        }
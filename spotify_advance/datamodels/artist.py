@@ -1,6 +1,18 @@
 class Artist:
+    __slots__ = ("artist_id", "name", "uri", "genres", "popularity")
 
-    def __init__(self, id: str, name: str, uri: str, **kwargs) -> None:
+    def __init__(self, id: str, name: str, uri: str, genres: list[str] = None, popularity: int = None, **kwargs) -> None:
         self.artist_id = id
         self.name = name
         self.uri = uri
+        self.genres = genres or []
+        self.popularity = popularity
+
+    def to_document(self) -> dict:
+        return {
+            "artist_id": self.artist_id,
+            "name": self.name,
+            "uri": self.uri,
+            "genres": self.genres,
+            "popularity": self.popularity,
+        }
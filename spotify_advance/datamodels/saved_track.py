@@ -1,13 +1,28 @@
+from dataclasses import dataclass
 from datetime import datetime
 
 
+@dataclass(slots=True, repr=False, eq=False)
 class SavedTrack:
+    user_id: str
+    track_id: str
+    added_at: datetime
+    _id: str | None = None
 
-    def __init__(self, _id: object, user_id: str, track_id: str, added_at: datetime):
-        self._id = str(_id)
-        self.user_id = user_id
-        self.track_id = track_id
-        self.added_at = added_at
+    @classmethod
+    def from_bson(cls, doc: dict) -> "SavedTrack":
+        return cls(doc["user_id"], doc["track_id"], doc["added_at"], str(doc["_id"]))
+
+    def to_bson(self) -> dict:
+        return {"user_id": self.user_id, "track_id": self.track_id, "added_at": self.added_at}
+
+    def to_json(self) -> dict:
+        return {
+            "_id": self._id,
+            "user_id": self.user_id,
+            "track_id": self.track_id,
+            "added_at": self.added_at.isoformat(),
+        }
 
     def __str__(self):
         return f"{self.user_id} - {self.track_id} - {self.added_at}"
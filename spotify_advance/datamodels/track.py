@@ -3,6 +3,7 @@ from spotify_advance.datamodels.artist import Artist
 
 
 class Track:
+    __slots__ = ("album", "artists", "track_id", "name", "popularity", "uri", "duration_ms")
 
     def __init__(self, **kwargs):
         self.album = Album(**kwargs['album'])
@@ -11,3 +12,18 @@ class Track:
         self.name = kwargs['name']
         self.popularity = kwargs['popularity']
         self.uri = kwargs['uri']
+        self.duration_ms = kwargs.get('duration_ms')
+
+    def to_document(self) -> dict:
+        """Document stored in the tracks collection."""
+        return {
+            "name": self.name,
+            "track_id": self.track_id,
+            "popularity": self.popularity,
+            "uri": self.uri,
+            "album": self.album.name,
+            "artists": [artist.name for artist in self.artists],
+            "album_id": self.album.album_id,
+            "artist_ids": [artist.artist_id for artist in self.artists],
+            "duration_ms": self.duration_ms,
+        }
@@ -1,16 +1,39 @@
+from dataclasses import dataclass
 from datetime import datetime
 
 
+@dataclass(slots=True, repr=False, eq=False)
 class TrackRecord:
+    name: str
+    track_id: str
+    popularity: int
+    uri: str
+    album: str
+    artists: list[str]
+    album_id: str | None = None
+    artist_ids: list[str] | None = None
+    duration_ms: int | None = None
+    _id: str | None = None
 
-    def __init__(self, _id: object, name: str, track_id: str, popularity: int, uri: str, album: dict, artists: list[dict]):
-        self._id = str(_id)
-        self.name = name
-        self.track_id = track_id
-        self.popularity = popularity
-        self.uri = uri
-        self.album = album
-        self.artists = artists
+    @classmethod
+    def from_bson(cls, doc: dict) -> "TrackRecord":
+        get = doc.get
+        return cls(doc["name"], doc["track_id"], doc["popularity"], doc["uri"], doc["album"], doc["artists"],
+                   get("album_id"), get("artist_ids"), get("duration_ms"), str(doc["_id"]))
+
+    def to_json(self) -> dict:
+        return {
+            "_id": self._id,
+            "name": self.name,
+            "track_id": self.track_id,
+            "popularity": self.popularity,
+            "uri": self.uri,
+            "album": self.album,
+            "artists": self.artists,
+            "album_id": self.album_id,
+            "artist_ids": self.artist_ids,
+            "duration_ms": self.duration_ms,
+        }
 
     def __str__(self):
         return f"{self.name} - {self.track_id} - {self.popularity} - {self.uri} - {self.album} - {self.artists}"
@@ -20,25 +43,39 @@ class TrackRecord:
 
     def __eq__(self, other):
         return (
-            self.name == other.name 
-            and self.track_id == other.track_id 
-            and self.popularity == other.popularity 
-            and self.uri == other.uri 
-            and self.album == other.album 
+            self.name == other.name
+            and self.track_id == other.track_id
+            and self.popularity == other.popularity
+            and self.uri == other.uri
+            and self.album == other.album
             and self.artists == other.artists
         )
 
     def __hash__(self):
-        return hash((self.name, self.track_id, self.popularity, self.uri, self.album, self.artists))
+        return hash((self.name, self.track_id, self.popularity, self.uri, self.album, tuple(self.artists)))
 
 
+@dataclass(slots=True, repr=False, eq=False)
 class RecentlyPlayedTrackRecord:
+    user_id: str
+    track_id: str
+    played_at: datetime
+    _id: str | None = None
+
+    @classmethod
+    def from_bson(cls, doc: dict) -> "RecentlyPlayedTrackRecord":
+        return cls(doc["user_id"], doc["track_id"], doc["played_at"], str(doc["_id"]))
+
+    def to_bson(self) -> dict:
+        return {"user_id": self.user_id, "track_id": self.track_id, "played_at": self.played_at}
 
-    def __init__(self, _id: object, user_id: str, track_id: str, played_at: datetime):
-        self._id = str(_id)
-        self.user_id = user_id
-        self.track_id = track_id
-        self.played_at = played_at
+    def to_json(self) -> dict:
+        return {
+            "_id": self._id,
+            "user_id": self.user_id,
+            "track_id": self.track_id,
+            "played_at": self.played_at.isoformat(),
+        }
 
     def __str__(self):
         return f"{self.user_id} - {self.track_id} - {self.played_at}"
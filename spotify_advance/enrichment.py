@@ -0,0 +1,73 @@
+from logging import getLogger
+
+from spotify_advance.apis.spotify import SpotifyAPI
+from spotify_advance.datamodels.album import Album
+from spotify_advance.datamodels.artist import Artist
+from spotify_advance.datamodels.track import Track
+from spotify_advance.handlers.mongodb import MongoDBHandler
+
+
+class TrackEnricher:
+    """
+    Fill the tracks, artists and albums collections for tracks seen in the play history or library.
+
+    Metadata is fetched with Spotify's multi-ID endpoints (50 tracks, 50 artists or 20 albums per
+    request) and written with one bulk upsert per chunk.
+    """
+
+    def __init__(self, spotify_api: SpotifyAPI, handler: MongoDBHandler, chunk_size: int = 1000):
+        self.spotify_api = spotify_api
+        self.handler = handler
+        self.chunk_size = chunk_size
+        self._logger = getLogger("spotify_advance.enrichment")
+
+    def run(self, track_ids: list[str] = None) -> dict:
+        """
+        Enrich unknown tracks together with their artists and albums.
+
+        Args:
+            track_ids: Tracks to enrich, every unknown track if not given
+
+        Returns:
+            dict: Number of tracks, artists and albums written
+        """
+        if track_ids is None:
+            track_ids, message = self.handler.get_unknown_track_ids()
+            if track_ids is None:
+                raise RuntimeError(message)
+
+        result = {"tracks": 0, "artists": 0, "albums": 0}
+        # Chunks bound memory, each one is written before the next is fetched
+        for start in range(0, len(track_ids), self.chunk_size):
+            chunk_result = self._enrich(track_ids[start:start + self.chunk_size])
+            for key, count in chunk_result.items():
+                result[key] += count
+
+        self._logger.info(f"Enriched {result['tracks']} tracks, {result['artists']} artists, {result['albums']} albums")
+        return result
+
+    def _enrich(self, track_ids: list[str]) -> dict:
+        tracks = [Track(**item) for item in self.spotify_api.get_tracks(track_ids)]
+
+        artist_ids, message = self.handler.get_missing_ids(
+            "artists", "artist_id", [artist.artist_id for track in tracks for artist in track.artists])
+        if artist_ids is None:
+            raise RuntimeError(message)
+        album_ids, message = self.handler.get_missing_ids(
+            "albums", "album_id", [track.album.album_id for track in tracks])
+        if album_ids is None:
+            raise RuntimeError(message)
+        artists = [Artist(**item) for item in self.spotify_api.get_artists(artist_ids)]
+        albums = [Album(**item) for item in self.spotify_api.get_albums(album_ids)]
+
+        written = {}
+        for name, store, docs in (
+            ("artists", self.handler.store_artists_many, [artist.to_document() for artist in artists]),
+            ("albums", self.handler.store_albums_many, [album.to_document() for album in albums]),
+            ("tracks", self.handler.store_tracks_many, [track.to_document() for track in tracks]),
+        ):
+            count, message = store(docs)
+            if count is None:
+                raise RuntimeError(message)
+            written[name] = count
+        return written
@@ -0,0 +1,827 @@
+from collections import Counter
+from collections.abc import AsyncIterator
+from datetime import datetime
+from logging import getLogger
+
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from spotify_advance.cache import TTLCache
+from spotify_advance.datamodels.saved_track import SavedTrack
+from spotify_advance.datamodels.track_record import (
+    RecentlyPlayedTrackRecord,
+    TrackRecord,
+)
+from spotify_advance.handlers.indexes import INDEXES
+from spotify_advance.handlers.pagination import keyset_sort
+from spotify_advance.handlers.queries import (
+    HISTORY_COLLECTIONS,
+    LAST_SESSION_SORT,
+    NEWEST_STORED_SORT,
+    PLAY_KEY,
+    PLAYS_PROJECTION,
+    PLAYS_SORT,
+    SAVED_TRACK_KEY,
+    add_plays,
+    cache_track,
+    expanded_history_pipeline,
+    insert_counts,
+    late_plays_query,
+    ordered_tracks,
+    page_find,
+    play_documents,
+    plays_after_query,
+    reopened_session_query,
+    saved_track_documents,
+    session_operations,
+    sessions_state_query,
+    sessions_state_update,
+    split_cached_tracks,
+    stringify_id,
+    track_document,
+    upsert_operations,
+    upserted_indexes,
+    with_track_metadata,
+)
+from spotify_advance.handlers.similarity import (
+    CO_LISTENS,
+    DEFAULT_NEIGHBORS,
+    RELATED_TRACKS,
+    SAVED_PAIR_PROJECTION,
+    PairClaim,
+    co_listen_operations,
+    neighbors_pipeline,
+    pairs_state_query,
+    saved_pair_counts,
+    saved_window_query,
+    withdrawn_pairs,
+)
+from spotify_advance.handlers.stats import (
+    DAILY_PLAYS,
+    increment_operations,
+    play_counts_pipeline,
+    top_artists_pipeline,
+    top_tracks_pipeline,
+)
+from spotify_advance.metrics import instrument_handler
+from spotify_advance.sessions import DEFAULT_GAP_MS, SessionBuilder
+
+
+@instrument_handler
+class AsyncMongoDBHandler:
+    """Asyncio counterpart of MongoDBHandler, safe to await from FastAPI endpoints."""
+
+    def __init__(
+        self,
+        uri: str,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        connect_timeout_ms: int = 20000,
+        server_selection_timeout_ms: int = 30000,
+        socket_timeout_ms: int | None = None,
+        track_cache: TTLCache | None = None,
+        database: str = "spotify_advance",
+    ):
+        self.client = AsyncMongoClient(
+            uri,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            connectTimeoutMS=connect_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms,
+        )
+        self.db: AsyncDatabase = self.client[database]
+        self.tracks: AsyncCollection = self.db.tracks
+        self.recently_played: AsyncCollection = self.db.recently_played
+        self.saved_tracks: AsyncCollection = self.db.saved_tracks
+        self.daily_plays: AsyncCollection = self.db[DAILY_PLAYS]
+        self.sessions: AsyncCollection = self.db.sessions
+        self.sync_state: AsyncCollection = self.db.sync_state
+        self.co_listens: AsyncCollection = self.db[CO_LISTENS]
+        self.related_tracks: AsyncCollection = self.db[RELATED_TRACKS]
+        self._logger = getLogger("spotify_advance.mongodb")
+        # Track metadata is nearly immutable, so popular tracks are served from memory (or a shared RedisCache)
+        self.track_cache = track_cache if track_cache is not None else TTLCache(max_size=10000, default_ttl=86400)
+
+    async def ensure_indexes(self) -> list[str]:
+        """
+        Create the indexes backing every handler query.
+
+        Returns:
+            list[str]: Names of the ensured indexes
+        """
+        names = []
+        for collection_name, indexes in INDEXES.items():
+            for keys, options in indexes:
+                names.append(await self.db[collection_name].create_index(keys, **options))
+        return names
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def _bulk_upsert(self, collection: AsyncCollection, key_fields: tuple[str, ...], docs: list[dict]) -> list[dict]:
+        """
+        Insert documents with unordered upserts, skipping those whose key already exists.
+
+        Args:
+            collection: Target collection
+            key_fields: Fields forming the unique key of a document
+            docs: Documents to insert
+
+        Returns:
+            list[dict]: The documents that were actually inserted
+        """
+        if not docs:
+            return []
+
+        try:
+            result = await collection.bulk_write(upsert_operations(key_fields, docs), ordered=False)
+            indexes = list(result.upserted_ids)
+        except BulkWriteError as e:
+            indexes = upserted_indexes(e)
+        return [docs[index] for index in indexes]
+
+    async def _count_plays(self, plays: list[dict]) -> None:
+        """
+        Add newly inserted plays to the per-user daily rollup.
+
+        The plays are stored whether or not this succeeds, so a failure is only logged and the
+        rollup is corrected by rebuild_daily_plays.
+
+        Args:
+            plays: Inserted recently played documents
+        """
+        if not plays:
+            return
+        try:
+            await self.daily_plays.bulk_write(increment_operations(plays), ordered=False)
+        except Exception as e:
+            self._logger.error(
+                f"Failed to count {len(plays)} plays in the daily rollup: {str(e)}")
+
+    ### TRACKS ###
+
+    async def store_track(
+        self,
+        name: str,
+        track_id: str,
+        popularity: int,
+        uri: str,
+        album: dict,
+        artists: list[dict]
+    ) -> tuple[bool, str]:
+        """
+        Store a track in MongoDB.
+
+        Args:
+            name: Track name
+            id: Track ID
+            popularity: Track popularity
+            uri: Track URI
+            album: Track album
+            artists: Track artists
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if ("track", track_id) in self.track_cache or await self.tracks.find_one({"track_id": track_id}):
+            self._logger.info(
+                f"Track already exists: {track_id}")
+            return False, "Track already exists"
+
+        try:
+            await self.tracks.insert_one(track_document(name, track_id, popularity, uri, album, artists))
+            return True, "Track stored successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store track: {str(e)}")
+            return False, "Failed to store track"
+
+    async def get_track(self, track_id: str) -> tuple[dict, str]:
+        """
+        Get a track from MongoDB.
+
+        Args:
+            track_id: Spotify track ID
+
+        Returns:
+            Track: Track object
+        """
+        try:
+            track = self.track_cache.get(("track", track_id))
+            if track is None:
+                track = cache_track(self.track_cache, await self.tracks.find_one({"track_id": track_id}))
+            return dict(track), "Track retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get track: {str(e)}")
+            return None, "Failed to get track"
+
+    async def get_tracks(self, track_ids: list[str]) -> tuple[list[dict], str]:
+        """
+        Get many tracks, querying MongoDB only for the ones missing from the track cache.
+
+        Args:
+            track_ids: Spotify track IDs
+
+        Returns:
+            list[dict]: Found tracks in input order, None on failure
+        """
+        try:
+            found, misses = split_cached_tracks(self.track_cache, track_ids)
+            if misses:
+                async for track in self.tracks.find({"track_id": {"$in": misses}}):
+                    found[track['track_id']] = cache_track(self.track_cache, track)
+            return ordered_tracks(found, track_ids), "Tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get tracks: {str(e)}")
+            return None, "Failed to get tracks"
+
+    def track_cache_stats(self) -> dict:
+        """
+        Get hit/miss metrics of the track cache.
+
+        Returns:
+            dict: Cache statistics including hit_ratio
+        """
+        return self.track_cache.stats()
+
+    async def get_all_tracks(
+        self,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[dict], str]:
+        """
+        Get all tracks from MongoDB, paged by _id.
+
+        Args:
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
+
+        Returns:
+            list[Track]: List of tracks, None on failure
+        """
+        try:
+            query, fields, sort = page_find({}, None, ASCENDING, after, projection)
+            cursor = self.tracks.find(query, fields).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            if projection:
+                return [stringify_id(doc) async for doc in cursor], "All tracks retrieved successfully"
+            return [TrackRecord.from_bson(doc).to_json() async for doc in cursor], "All tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get all tracks: {str(e)}")
+            return None, "Failed to get all tracks"
+
+    async def delete_track(self, track_id: str) -> tuple[bool, str]:
+        """
+        Delete a track from MongoDB.
+
+        Args:
+            track_id: Spotify track ID
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            await self.tracks.delete_one({"track_id": track_id})
+            self.track_cache.delete(("track", track_id))
+            return True, "Track deleted successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to delete track: {str(e)}")
+            return False, "Failed to delete track"
+
+    ### RECENTLY PLAYED ###
+
+    async def store_recently_played(self, user_id: str, track_id: str, played_at: datetime) -> tuple[bool, str]:
+        """
+        Store a play event in MongoDB.
+
+        Args:
+            user_id: Spotify user ID
+            track_id: Spotify track ID
+            played_at: Timestamp when the track was played
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        track_data = {
+            "user_id": user_id,
+            "track_id": track_id,
+            "played_at": played_at,
+        }
+
+        try:
+            # Every play is an event keyed on (user_id, track_id, played_at), only exact replays are skipped
+            result = await self.recently_played.update_one(
+                track_data, {"$setOnInsert": track_data}, upsert=True)
+            if result.upserted_id is None:
+                self._logger.info(
+                    f"Recently played track already exists: {track_id} at {played_at} for user: {user_id}")
+                return False, "Recently played track already exists"
+
+            await self._count_plays([track_data])
+            self._logger.info(
+                f"Stored recently played track: {track_id} for user: {user_id}")
+            return True, "Recently played track stored successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store recently played track: {str(e)}")
+            return False, "Failed to store recently played track"
+
+    async def store_recently_played_many(self, records: list[dict]) -> tuple[dict, str]:
+        """
+        Store many recently played tracks in MongoDB in a single bulk write.
+
+        Args:
+            records: Dicts with user_id, track_id and played_at
+
+        Returns:
+            dict: Counts of inserted and duplicate records
+        """
+        docs = play_documents(records)
+
+        try:
+            inserted = await self._bulk_upsert(self.recently_played, PLAY_KEY, docs)
+            await self._count_plays(inserted)
+            counts = insert_counts(inserted, docs)
+            self._logger.info(
+                f"Stored recently played tracks: {counts['inserted']} inserted, {counts['duplicates']} duplicates")
+            return counts, "Recently played tracks stored successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store recently played tracks: {str(e)}")
+            return None, "Failed to store recently played tracks"
+
+    async def get_recently_played(
+        self,
+        user_id: str,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[RecentlyPlayedTrackRecord], str]:
+        """
+        Get recently played tracks for a user, newest first.
+
+        Args:
+            user_id: Spotify user ID
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
+
+        Returns:
+            list[RecentlyPlayedTrackRecord]: List of recently played tracks (dicts when projected), None on failure
+        """
+        try:
+            query, fields, sort = page_find({"user_id": user_id}, "played_at", DESCENDING, after, projection)
+            cursor = self.recently_played.find(query, fields).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            if projection:
+                return [stringify_id(doc) async for doc in cursor], "Recently played tracks retrieved successfully"
+            return [RecentlyPlayedTrackRecord.from_bson(doc) async for doc in cursor], "Recently played tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get recently played tracks: {str(e)}")
+            return None, "Failed to get recently played tracks"
+
+    async def get_recently_played_expanded(
+        self,
+        user_id: str,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[dict], str]:
+        """
+        Get recently played tracks for a user joined with track metadata, newest first.
+
+        Args:
+            user_id: Spotify user ID
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
+
+        Returns:
+            list[dict]: Plays with name, artists and album, None on failure
+        """
+        try:
+            cursor = await self.recently_played.aggregate(
+                expanded_history_pipeline(user_id, limit, after, projection))
+            return [stringify_id(doc) async for doc in cursor], "Recently played tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get recently played tracks: {str(e)}")
+            return None, "Failed to get recently played tracks"
+
+    async def delete_user_recently_played(self, user_id: str) -> tuple[bool, str]:
+        """
+        Delete all recently played tracks for a user.
+
+        Args:
+            user_id: Spotify user ID
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            await self.recently_played.delete_many({"user_id": user_id})
+            await self.daily_plays.delete_many({"user_id": user_id})
+            return True, "Recently played tracks deleted successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to delete recently played tracks: {str(e)}")
+            return False, "Failed to delete recently played tracks"
+
+    ### SAVED TRACKS ###
+
+    async def store_saved_track(self, user_id: str, track_id: str, added_at: datetime) -> tuple[bool, str]:
+        """
+        Store a saved track in MongoDB.
+
+        Args:
+            user_id: Spotify user ID
+            track_id: Spotify track ID
+            added_at: Timestamp when the track was added
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        track_data = {
+            "user_id": user_id,
+            "track_id": track_id,
+            "added_at": added_at,
+        }
+
+        try:
+            if await self.saved_tracks.find_one({"user_id": user_id, "track_id": track_id}):
+                self._logger.info(
+                    f"Saved track already exists: {track_id} for user: {user_id}")
+                return False, "Saved track already exists"
+
+            await self.saved_tracks.insert_one(track_data)
+            await self._add_co_listens(await self._saved_pairs([track_data]))
+            self._logger.info(
+                f"Stored saved track: {track_id} for user: {user_id}")
+            return True, "Saved track stored successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store saved track: {str(e)}")
+            return False, "Failed to store saved track"
+
+    async def store_saved_tracks_many(self, records: list[dict]) -> tuple[dict, str]:
+        """
+        Store many saved tracks in MongoDB in a single bulk write.
+
+        Args:
+            records: Dicts with user_id, track_id and added_at
+
+        Returns:
+            dict: Counts of inserted and duplicate records
+        """
+        docs = saved_track_documents(records)
+
+        try:
+            inserted = await self._bulk_upsert(self.saved_tracks, SAVED_TRACK_KEY, docs)
+            counts = insert_counts(inserted, docs)
+            await self._add_co_listens(await self._saved_pairs(inserted))
+            self._logger.info(
+                f"Stored saved tracks: {counts['inserted']} inserted, {counts['duplicates']} duplicates")
+            return counts, "Saved tracks stored successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store saved tracks: {str(e)}")
+            return None, "Failed to store saved tracks"
+
+    async def get_saved_tracks(
+        self,
+        user_id: str,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[SavedTrack], str]:
+        """
+        Get saved tracks for a user, most recently added first.
+
+        Args:
+            user_id: Spotify user ID
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
+
+        Returns:
+            list[SavedTrack]: List of saved tracks (dicts when projected), None on failure
+        """
+        try:
+            query, fields, sort = page_find({"user_id": user_id}, "added_at", DESCENDING, after, projection)
+            cursor = self.saved_tracks.find(query, fields).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            if projection:
+                return [stringify_id(doc) async for doc in cursor], "Saved tracks retrieved successfully"
+            return [SavedTrack.from_bson(doc) async for doc in cursor], "Saved tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get saved tracks: {str(e)}")
+            return None, "Failed to get saved tracks"
+
+    async def delete_user_saved_tracks(self, user_id: str, track_id: str) -> tuple[bool, str]:
+        """
+        Delete a saved track for a user.
+
+        Args:
+            user_id: Spotify user ID
+            track_id: Spotify track ID
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            removed_pairs = await self._saved_pairs(await self._find_saved_tracks(user_id, [track_id]))
+            await self.saved_tracks.delete_one(
+                {"user_id": user_id, "track_id": track_id})
+            await self._remove_co_listens(removed_pairs)
+            return True, "Saved track deleted successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to delete saved track: {str(e)}")
+            return False, "Failed to delete saved track"
+
+    ### STATS ###
+
+    async def get_top_tracks(self, user_id: str, window: str = "7d", limit: int = 10) -> tuple[list[dict], str]:
+        """
+        Get the most played tracks of a user from the daily rollup.
+
+        Args:
+            user_id: Spotify user ID
+            window: Number of days such as "7d", or "all"
+            limit: Number of results
+
+        Returns:
+            list[dict]: Stats rows, None on failure
+        """
+        try:
+            cursor = await self.daily_plays.aggregate(top_tracks_pipeline(user_id, window, limit))
+            return await cursor.to_list(), "Stats retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get stats: {str(e)}")
+            return None, "Failed to get stats"
+
+    async def get_top_artists(self, user_id: str, window: str = "7d", limit: int = 10) -> tuple[list[dict], str]:
+        """
+        Get the most played artists of a user from the daily rollup.
+
+        Args:
+            user_id: Spotify user ID
+            window: Number of days such as "7d", or "all"
+            limit: Number of results
+
+        Returns:
+            list[dict]: Stats rows, None on failure
+        """
+        try:
+            cursor = await self.daily_plays.aggregate(top_artists_pipeline(user_id, window, limit))
+            return await cursor.to_list(), "Stats retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get stats: {str(e)}")
+            return None, "Failed to get stats"
+
+    async def get_play_counts(self, user_id: str, window: str = "30d") -> tuple[list[dict], str]:
+        """
+        Get the number of plays per day of a user from the daily rollup.
+
+        Args:
+            user_id: Spotify user ID
+            window: Number of days such as "7d", or "all"
+
+        Returns:
+            list[dict]: Stats rows, None on failure
+        """
+        try:
+            cursor = await self.daily_plays.aggregate(play_counts_pipeline(user_id, window))
+            return await cursor.to_list(), "Stats retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get stats: {str(e)}")
+            return None, "Failed to get stats"
+
+    async def iter_plays(self, user_id: str, batch_size: int = 10000, after: datetime | None = None) -> AsyncIterator[dict]:
+        """
+        Stream a user's plays oldest first, projected to track_id and played_at.
+
+        Args:
+            user_id: Spotify user ID
+            batch_size: Number of documents fetched per round trip
+            after: Only plays strictly after this time
+
+        Yields:
+            dict: track_id and played_at of each play
+        """
+        cursor = self.recently_played.find(
+            plays_after_query(user_id, after), PLAYS_PROJECTION).sort(PLAYS_SORT).batch_size(batch_size)
+        async for doc in cursor:
+            yield doc
+
+    ### SESSIONS ###
+
+    async def update_sessions(
+        self,
+        user_id: str,
+        gap_ms: int = DEFAULT_GAP_MS,
+        rebuild: bool = False,
+        batch_size: int = 1000
+    ) -> tuple[int, str]:
+        """
+        Detect listening sessions in plays newer than the user's last stored session.
+
+        Plays are streamed oldest first and processed in batches, each batch resolving track
+        durations through get_tracks and upserting the sessions it created or extended.
+        Plays stored since the previous refresh but played before the last session's end, e.g.
+        from a batch import or a delayed sync, reopen the session they fall into, which is
+        rebuilt with every later one. Only sessions are rebuilt for them, their co-listen pairs
+        are not counted.
+
+        Args:
+            user_id: Spotify user ID
+            gap_ms: Inactivity after the end of a track that closes a session
+            rebuild: Drop the user's sessions and reprocess the whole history. Co-listen pairs are
+                not counted again, run MongoDBHandler.rebuild_co_listens afterwards to match the
+                similarity index to the rebuilt sessions.
+            batch_size: Number of plays processed per batch
+
+        Returns:
+            int: Number of session writes, None on failure
+        """
+        try:
+            if rebuild:
+                await self.sessions.delete_many({"user_id": user_id})
+            # Read before any play so plays stored during the refresh are checked by the next one
+            newest = await self.recently_played.find_one({"user_id": user_id}, {"_id": 1}, sort=NEWEST_STORED_SORT)
+            last_session = await self._reopen_sessions(user_id)
+            claim = PairClaim(user_id, await self.sync_state.find_one(pairs_state_query(user_id)))
+            builder = SessionBuilder(user_id, gap_ms, last_session, pair_tracks=not rebuild, pair_after=claim.claimed)
+            after = last_session["end"] if last_session else None
+
+            written = 0
+            batch = []
+            async for play in self.iter_plays(user_id, batch_size, after):
+                batch.append(play)
+                if len(batch) >= batch_size:
+                    written += await self._add_session_batch(builder, batch, claim)
+                    batch = []
+            written += await self._add_session_batch(builder, batch, claim)
+            if newest:
+                await self.sync_state.update_one(
+                    sessions_state_query(user_id), sessions_state_update(newest["_id"]), upsert=True)
+            return written, "Sessions updated successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to update sessions: {str(e)}")
+            return None, "Failed to update sessions"
+
+    async def _reopen_sessions(self, user_id: str) -> dict | None:
+        """
+        Drop the sessions that late plays fall into.
+
+        Returns:
+            dict: The stored session new plays may extend, None to start from the first play
+        """
+        last_session = await self.sessions.find_one({"user_id": user_id}, sort=LAST_SESSION_SORT)
+        state = await self.sync_state.find_one(sessions_state_query(user_id))
+        if last_session is None or state is None:
+            return last_session
+        late = await self.recently_played.find_one(
+            late_plays_query(user_id, state["stored_through"], last_session["end"]), PLAYS_PROJECTION, sort=PLAYS_SORT)
+        if late is None:
+            return last_session
+        reopened = await self.sessions.find_one(reopened_session_query(user_id, late["played_at"]), sort=LAST_SESSION_SORT)
+        start = reopened["start"] if reopened else late["played_at"]
+        await self.sessions.delete_many({"user_id": user_id, "start": {"$gte": start}})
+        return await self.sessions.find_one({"user_id": user_id}, sort=LAST_SESSION_SORT)
+
+    async def _add_session_batch(self, builder: SessionBuilder, plays: list[dict], claim: PairClaim) -> int:
+        if not plays:
+            return 0
+        tracks, _ = await self.get_tracks(list({play["track_id"] for play in plays}))
+        sessions, pairs = add_plays(builder, plays, tracks)
+        await self.sessions.bulk_write(session_operations(sessions), ordered=False)
+        if pairs and await self._claim_pairs(claim, plays[-1]["played_at"]):
+            await self._add_co_listens(pairs)
+        return len(sessions)
+
+    async def _claim_pairs(self, claim: PairClaim, through: datetime) -> bool:
+        """Move the user's pair cursor to through, False if those plays were counted or claimed concurrently."""
+        if not claim.claimable(through):
+            return False
+        try:
+            await self.sync_state.find_one_and_update(claim.query(), claim.update(through), upsert=True)
+        except DuplicateKeyError:
+            claim.lost = True
+            self._logger.warning(f"Co-listen pairs of user: {claim.user_id} are counted by a concurrent refresh")
+            return False
+        claim.claimed = through
+        return True
+
+    async def get_sessions(self, user_id: str, limit: int | None = None, after: str | None = None) -> tuple[list[dict], str]:
+        """
+        Get stored listening sessions for a user, newest first.
+
+        Args:
+            user_id: Spotify user ID
+            limit: Maximum number of sessions to retrieve
+            after: Cursor of the last session of the previous page
+
+        Returns:
+            list[dict]: Sessions, None on failure
+        """
+        try:
+            query, _, sort = page_find({"user_id": user_id}, "start", DESCENDING, after)
+            cursor = self.sessions.find(query).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return [stringify_id(doc) async for doc in cursor], "Sessions retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get sessions: {str(e)}")
+            return None, "Failed to get sessions"
+
+    ### RELATED TRACKS ###
+
+    async def _find_saved_tracks(self, user_id: str, track_ids: list[str]) -> list[dict]:
+        return await self.saved_tracks.find(
+            {"user_id": user_id, "track_id": {"$in": track_ids}}, SAVED_PAIR_PROJECTION).to_list()
+
+    async def _saved_pairs(self, saved: list[dict]) -> Counter:
+        """Pairs of stored saved tracks with the user's saved tracks around them, see saved_pair_counts."""
+        if not saved:
+            return Counter()
+        window = await self.saved_tracks.find(saved_window_query(saved), SAVED_PAIR_PROJECTION).to_list()
+        return saved_pair_counts(window, {(doc["user_id"], doc["track_id"]) for doc in saved})
+
+    async def _add_co_listens(self, pairs: Counter) -> None:
+        """Apply co-occurrence increments and refresh the neighbors of the touched tracks."""
+        if not pairs:
+            return
+        await self.co_listens.bulk_write(co_listen_operations(pairs), ordered=False)
+        await self.co_listens.aggregate(neighbors_pipeline(list({track_id for track_id, _ in pairs})))
+
+    async def _remove_co_listens(self, pairs: Counter) -> None:
+        """Withdraw co-occurrence counts, drop the cells they empty and refresh the neighbors of the touched tracks."""
+        if not pairs:
+            return
+        track_ids = list({track_id for track_id, _ in pairs})
+        await self.co_listens.bulk_write(co_listen_operations(withdrawn_pairs(pairs)), ordered=False)
+        await self.co_listens.delete_many({"track_id": {"$in": track_ids}, "count": {"$lte": 0}})
+        await self.related_tracks.delete_many({"track_id": {"$in": track_ids}})
+        await self.co_listens.aggregate(neighbors_pipeline(track_ids))
+
+    async def get_related_tracks(self, track_id: str, limit: int = DEFAULT_NEIGHBORS) -> tuple[list[dict], str]:
+        """
+        Get the tracks most often listened to together with a track.
+
+        Args:
+            track_id: Spotify track ID
+            limit: Maximum number of related tracks
+
+        Returns:
+            list[dict]: track_id, count and, when known, name and artists of each related track,
+                strongest first, None on failure
+        """
+        try:
+            doc = await self.related_tracks.find_one({"track_id": track_id}, {"_id": 0, "neighbors": 1})
+            neighbors = doc["neighbors"][:limit] if doc else []
+            tracks, _ = await self.get_tracks([neighbor["track_id"] for neighbor in neighbors])
+            return with_track_metadata(neighbors, tracks), "Related tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get related tracks: {str(e)}")
+            return None, "Failed to get related tracks"
+
+    ### EXPORT ###
+
+    async def iter_user_history(self, user_id: str, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """
+        Stream a user's recently played and saved tracks straight from the cursors.
+
+        Args:
+            user_id: Spotify user ID
+            batch_size: Number of documents fetched per round trip
+
+        Yields:
+            dict: Raw document tagged with its collection under "type"
+        """
+        for name, field in HISTORY_COLLECTIONS:
+            cursor = self.db[name].find({"user_id": user_id}).sort(
+                keyset_sort(field, DESCENDING)).batch_size(batch_size)
+            async for doc in cursor:
+                doc["type"] = name
+                yield doc
@@ -0,0 +1,129 @@
+from logging import getLogger
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.database import Database
+
+logger = getLogger("spotify_advance.mongodb")
+
+# collection name -> list of (keys, options)
+INDEXES: dict[str, list[tuple[list[tuple[str, int]], dict]]] = {
+    "tracks": [
+        ([("track_id", ASCENDING)], {"unique": True}),
+    ],
+    "recently_played": [
+        ([("user_id", ASCENDING), ("played_at", DESCENDING), ("_id", DESCENDING)], {}),
+        ([("user_id", ASCENDING), ("track_id", ASCENDING), ("played_at", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("_id", DESCENDING)], {}),
+    ],
+    "saved_tracks": [
+        ([("user_id", ASCENDING), ("added_at", DESCENDING), ("_id", DESCENDING)], {}),
+        ([("user_id", ASCENDING), ("track_id", ASCENDING)], {"unique": True}),
+    ],
+    "artists": [
+        ([("artist_id", ASCENDING)], {"unique": True}),
+    ],
+    "albums": [
+        ([("album_id", ASCENDING)], {"unique": True}),
+    ],
+    "daily_plays": [
+        ([("user_id", ASCENDING), ("day", ASCENDING), ("track_id", ASCENDING)], {"unique": True}),
+    ],
+    "sessions": [
+        ([("user_id", ASCENDING), ("start", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("start", DESCENDING), ("_id", DESCENDING)], {}),
+    ],
+    "sync_state": [
+        ([("user_id", ASCENDING), ("stream", ASCENDING)], {"unique": True}),
+    ],
+    "spotify_tokens": [
+        ([("user_id", ASCENDING)], {"unique": True}),
+    ],
+    "co_listens": [
+        ([("track_id", ASCENDING), ("other_id", ASCENDING)], {"unique": True}),
+        ([("track_id", ASCENDING), ("count", DESCENDING), ("other_id", ASCENDING)], {}),
+    ],
+    "related_tracks": [
+        ([("track_id", ASCENDING)], {"unique": True}),
+    ],
+}
+
+# Query shapes issued by MongoDBHandler: (method, collection, filter, sort)
+HANDLER_QUERIES: list[tuple[str, str, dict, list[tuple[str, int]] | None]] = [
+    ("store_track", "tracks", {"track_id": ""}, None),
+    ("get_track", "tracks", {"track_id": ""}, None),
+    ("get_tracks", "tracks", {"track_id": {"$in": []}}, None),
+    ("delete_track", "tracks", {"track_id": ""}, None),
+    ("store_recently_played", "recently_played", {"user_id": "", "track_id": "", "played_at": None}, None),
+    ("get_recently_played", "recently_played", {"user_id": ""}, [("played_at", DESCENDING), ("_id", DESCENDING)]),
+    ("delete_user_recently_played", "recently_played", {"user_id": ""}, None),
+    ("update_sessions", "recently_played", {"user_id": "", "_id": {"$gt": None}}, [("_id", DESCENDING)]),
+    ("store_saved_track", "saved_tracks", {"user_id": "", "track_id": ""}, None),
+    ("get_saved_tracks", "saved_tracks", {"user_id": ""}, [("added_at", DESCENDING), ("_id", DESCENDING)]),
+    ("get_saved_track_ids", "saved_tracks", {"user_id": ""}, None),
+    ("get_saved_track_added_at", "saved_tracks", {"user_id": ""}, None),
+    ("get_newest_added_at", "saved_tracks", {"user_id": ""}, [("added_at", DESCENDING)]),
+    ("delete_user_saved_tracks", "saved_tracks", {"user_id": "", "track_id": ""}, None),
+    ("get_missing_ids", "artists", {"artist_id": {"$in": []}}, None),
+    ("get_missing_ids", "albums", {"album_id": {"$in": []}}, None),
+    ("get_top_tracks", "daily_plays", {"user_id": "", "day": {"$gte": None}}, None),
+    ("get_sessions", "sessions", {"user_id": ""}, [("start", DESCENDING), ("_id", DESCENDING)]),
+    ("get_high_water_mark", "sync_state", {"user_id": "", "stream": ""}, None),
+    ("get_token", "spotify_tokens", {"user_id": ""}, None),
+    ("get_related_tracks", "related_tracks", {"track_id": ""}, None),
+]
+
+
+class QueryPlanError(Exception):
+    """Raised when a handler query is not served by an index."""
+
+
+def ensure_indexes(db: Database) -> list[str]:
+    """
+    Create all indexes used by MongoDBHandler. Safe to run repeatedly.
+
+    Args:
+        db: spotify_advance database
+
+    Returns:
+        list[str]: Names of the ensured indexes
+    """
+    names = []
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            names.append(db[collection_name].create_index(keys, **options))
+    logger.info(f"Ensured indexes: {', '.join(names)}")
+    return names
+
+
+def _has_collscan(plan: object) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(value) for value in plan)
+    return False
+
+
+def check_query_plans(db: Database) -> None:
+    """
+    Explain every handler query and fail if any falls back to a collection scan.
+
+    Args:
+        db: spotify_advance database
+
+    Raises:
+        QueryPlanError: If one or more queries use COLLSCAN
+    """
+    failed = []
+    for method, collection_name, query, sort in HANDLER_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        if _has_collscan(plan):
+            failed.append(method)
+
+    if failed:
+        raise QueryPlanError(f"Queries fall back to COLLSCAN: {', '.join(failed)}")
+    logger.info("All handler queries are served by an index")
@@ -1,26 +1,189 @@
-from datetime import datetime
+from collections import Counter
+from collections.abc import Iterator
+from datetime import datetime, timezone
 from logging import getLogger
 
-from pymongo import DESCENDING, MongoClient
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateOne
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
+from spotify_advance.cache import TTLCache
 from spotify_advance.datamodels.saved_track import SavedTrack
 from spotify_advance.datamodels.track_record import (
     RecentlyPlayedTrackRecord,
     TrackRecord,
 )
+from spotify_advance.handlers.indexes import INDEXES, check_query_plans, ensure_indexes
+from spotify_advance.handlers.pagination import keyset_sort
+from spotify_advance.handlers.queries import (
+    HISTORY_COLLECTIONS,
+    LAST_SESSION_SORT,
+    NEWEST_STORED_SORT,
+    PLAY_KEY,
+    PLAYS_PROJECTION,
+    PLAYS_SORT,
+    SAVED_TRACK_KEY,
+    add_plays,
+    cache_track,
+    expanded_history_pipeline,
+    insert_counts,
+    late_plays_query,
+    ordered_tracks,
+    page_find,
+    play_documents,
+    plays_after_query,
+    reopened_session_query,
+    saved_track_documents,
+    saved_tracks_delta_operations,
+    session_operations,
+    sessions_state_query,
+    sessions_state_update,
+    split_cached_tracks,
+    stringify_id,
+    track_document,
+    upsert_operations,
+    upserted_indexes,
+    with_track_metadata,
+)
+from spotify_advance.handlers.similarity import (
+    CO_LISTENS,
+    CO_LISTENS_REBUILD,
+    DEFAULT_NEIGHBORS,
+    RELATED_TRACKS,
+    RELATED_TRACKS_REBUILD,
+    SAVED_PAIR_PROJECTION,
+    PairClaim,
+    co_listen_operations,
+    neighbors_pipeline,
+    pairs_state_query,
+    saved_pair_counts,
+    saved_window_query,
+    session_pair_counts,
+    withdrawn_pairs,
+)
+from spotify_advance.handlers.stats import (
+    DAILY_PLAYS,
+    increment_operations,
+    play_counts_pipeline,
+    rebuild_pipeline,
+    stale_buckets_query,
+    top_artists_pipeline,
+    top_tracks_pipeline,
+)
+from spotify_advance.metrics import instrument_handler
+from spotify_advance.sessions import DEFAULT_GAP_MS, SessionBuilder
 
 
+@instrument_handler
 class MongoDBHandler:
 
-    def __init__(self, uri: str):
+    def __init__(self, uri: str, create_indexes: bool = True, track_cache: TTLCache | None = None,
+                 database: str = "spotify_advance"):
         self.client = MongoClient(uri)
-        self.db: Database = self.client.spotify_advance
+        self.db: Database = self.client[database]
         self.tracks: Collection = self.db.tracks
         self.recently_played: Collection = self.db.recently_played
         self.saved_tracks: Collection = self.db.saved_tracks
+        self.artists: Collection = self.db.artists
+        self.albums: Collection = self.db.albums
+        self.daily_plays: Collection = self.db[DAILY_PLAYS]
+        self.sessions: Collection = self.db.sessions
+        self.sync_state: Collection = self.db.sync_state
+        self.spotify_tokens: Collection = self.db.spotify_tokens
+        self.co_listens: Collection = self.db[CO_LISTENS]
+        self.related_tracks: Collection = self.db[RELATED_TRACKS]
         self._logger = getLogger("spotify_advance.mongodb")
+        # Track metadata is nearly immutable, so popular tracks are served from memory (or a shared RedisCache)
+        self.track_cache = track_cache if track_cache is not None else TTLCache(max_size=10000, default_ttl=86400)
+
+        if create_indexes:
+            ensure_indexes(self.db)
+
+    def ensure_indexes(self) -> list[str]:
+        """
+        Create the indexes backing every handler query.
+
+        Returns:
+            list[str]: Names of the ensured indexes
+        """
+        return ensure_indexes(self.db)
+
+    def check_query_plans(self) -> None:
+        """
+        Verify that no handler query falls back to a collection scan.
+
+        Raises:
+            QueryPlanError: If a query uses COLLSCAN
+        """
+        check_query_plans(self.db)
+
+    def _bulk_upsert(self, collection: Collection, key_fields: tuple[str, ...], docs: list[dict]) -> list[dict]:
+        """
+        Insert documents with unordered upserts, skipping those whose key already exists.
+
+        Args:
+            collection: Target collection
+            key_fields: Fields forming the unique key of a document
+            docs: Documents to insert
+
+        Returns:
+            list[dict]: The documents that were actually inserted
+        """
+        if not docs:
+            return []
+
+        try:
+            result = collection.bulk_write(upsert_operations(key_fields, docs), ordered=False)
+            indexes = list(result.upserted_ids)
+        except BulkWriteError as e:
+            indexes = upserted_indexes(e)
+        return [docs[index] for index in indexes]
+
+    def _bulk_replace(self, collection: Collection, key_field: str, docs: list[dict], name: str) -> tuple[int, str]:
+        """
+        Upsert documents keyed on a single field, overwriting stored fields.
+
+        Args:
+            collection: Target collection
+            key_field: Unique key of a document
+            docs: Documents to write
+            name: Collection name used in messages
+
+        Returns:
+            int: Number of inserted or modified documents, None on failure
+        """
+        if not docs:
+            return 0, f"No {name} to store"
+
+        operations = [UpdateOne({key_field: doc[key_field]}, {"$set": doc}, upsert=True) for doc in docs]
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+            written = result.upserted_count + result.modified_count
+            self._logger.info(f"Stored {written} {name}")
+            return written, f"Stored {name} successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store {name}: {str(e)}")
+            return None, f"Failed to store {name}"
+
+    def _count_plays(self, plays: list[dict]) -> None:
+        """
+        Add newly inserted plays to the per-user daily rollup.
+
+        The plays are stored whether or not this succeeds, so a failure is only logged and the
+        rollup is corrected by rebuild_daily_plays.
+
+        Args:
+            plays: Inserted recently played documents
+        """
+        if not plays:
+            return
+        try:
+            self.daily_plays.bulk_write(increment_operations(plays), ordered=False)
+        except Exception as e:
+            self._logger.error(
+                f"Failed to count {len(plays)} plays in the daily rollup: {str(e)}")
 
     ### TRACKS ###
 
@@ -47,22 +210,13 @@ class MongoDBHandler:
         Returns:
             bool: True if successful, False otherwise
         """
-        if self.tracks.find_one({"track_id": track_id}):
+        if ("track", track_id) in self.track_cache or self.tracks.find_one({"track_id": track_id}):
             self._logger.info(
                 f"Track already exists: {track_id}")
             return False, "Track already exists"
 
-        track_data = {
-            "name": name,
-            "track_id": track_id,
-            "popularity": popularity,
-            "uri": uri,
-            "album": album['name'],
-            "artists": [artist['name'] for artist in artists]
-        }
-
         try:
-            self.tracks.insert_one(track_data)
+            self.tracks.insert_one(track_document(name, track_id, popularity, uri, album, artists))
             return True, "Track stored successfully"
         except Exception as e:
             self._logger.error(
@@ -80,28 +234,74 @@ class MongoDBHandler:
             Track: Track object
         """
         try:
-            track = self.tracks.find_one({"track_id": track_id})
-            track['_id'] = str(track['_id'])
-            return track, "Track retrieved successfully"
+            track = self.track_cache.get(("track", track_id))
+            if track is None:
+                track = cache_track(self.track_cache, self.tracks.find_one({"track_id": track_id}))
+            return dict(track), "Track retrieved successfully"
         except Exception as e:
             self._logger.error(
                 f"Failed to get track: {str(e)}")
             return None, "Failed to get track"
 
-    def get_all_tracks(self) -> tuple[list[dict], str]:
+    def get_tracks(self, track_ids: list[str]) -> tuple[list[dict], str]:
         """
-        Get all tracks from MongoDB.
+        Get many tracks, querying MongoDB only for the ones missing from the track cache.
+
+        Args:
+            track_ids: Spotify track IDs
 
         Returns:
-            list[Track]: List of all tracks
+            list[dict]: Found tracks in input order, None on failure
         """
         try:
-            cursor = self.tracks.find()
-            return [TrackRecord(**doc).__dict__ for doc in cursor]
+            found, misses = split_cached_tracks(self.track_cache, track_ids)
+            if misses:
+                for track in self.tracks.find({"track_id": {"$in": misses}}):
+                    found[track['track_id']] = cache_track(self.track_cache, track)
+            return ordered_tracks(found, track_ids), "Tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get tracks: {str(e)}")
+            return None, "Failed to get tracks"
+
+    def track_cache_stats(self) -> dict:
+        """
+        Get hit/miss metrics of the track cache.
+
+        Returns:
+            dict: Cache statistics including hit_ratio
+        """
+        return self.track_cache.stats()
+
+    def get_all_tracks(
+        self,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[dict], str]:
+        """
+        Get all tracks from MongoDB, paged by _id.
+
+        Args:
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
+
+        Returns:
+            list[Track]: List of tracks, None on failure
+        """
+        try:
+            query, fields, sort = page_find({}, None, ASCENDING, after, projection)
+            cursor = self.tracks.find(query, fields).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            if projection:
+                return [stringify_id(doc) for doc in cursor], "All tracks retrieved successfully"
+            return [TrackRecord.from_bson(doc).to_json() for doc in cursor], "All tracks retrieved successfully"
         except Exception as e:
             self._logger.error(
                 f"Failed to get all tracks: {str(e)}")
-            return [], "Failed to get all tracks"
+            return None, "Failed to get all tracks"
 
     def delete_track(self, track_id: str) -> tuple[bool, str]:
         """
@@ -114,18 +314,100 @@ class MongoDBHandler:
             bool: True if successful, False otherwise
         """
         try:
-            self.tracks.delete_one({"id": track_id})
+            self.tracks.delete_one({"track_id": track_id})
+            self.track_cache.delete(("track", track_id))
             return True, "Track deleted successfully"
         except Exception as e:
             self._logger.error(
                 f"Failed to delete track: {str(e)}")
             return False, "Failed to delete track"
 
+    def store_tracks_many(self, tracks: list[dict]) -> tuple[int, str]:
+        """
+        Insert or refresh many track documents in a single bulk write.
+
+        Args:
+            tracks: Track documents keyed on track_id
+
+        Returns:
+            int: Number of inserted or modified tracks, None on failure
+        """
+        for track in tracks:
+            self.track_cache.delete(("track", track["track_id"]))
+        return self._bulk_replace(self.tracks, "track_id", tracks, "tracks")
+
+    def get_unknown_track_ids(self) -> tuple[list[str], str]:
+        """
+        Get the track IDs referenced by recently_played or saved_tracks but missing from tracks.
+
+        Returns:
+            list[str]: Unknown track IDs, None on failure
+        """
+        pipeline = [
+            {"$group": {"_id": "$track_id"}},
+            {"$unionWith": {"coll": "saved_tracks", "pipeline": [{"$group": {"_id": "$track_id"}}]}},
+            {"$group": {"_id": "$_id"}},
+            {"$lookup": {"from": "tracks", "localField": "_id", "foreignField": "track_id", "as": "track"}},
+            {"$match": {"track": {"$size": 0}}},
+        ]
+        try:
+            return [doc["_id"] for doc in self.recently_played.aggregate(pipeline)], "Unknown track IDs retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get unknown track IDs: {str(e)}")
+            return None, "Failed to get unknown track IDs"
+
+    ### ARTISTS & ALBUMS ###
+
+    def store_artists_many(self, artists: list[dict]) -> tuple[int, str]:
+        """
+        Insert or refresh many artist documents in a single bulk write.
+
+        Args:
+            artists: Artist documents keyed on artist_id
+
+        Returns:
+            int: Number of inserted or modified artists, None on failure
+        """
+        return self._bulk_replace(self.artists, "artist_id", artists, "artists")
+
+    def store_albums_many(self, albums: list[dict]) -> tuple[int, str]:
+        """
+        Insert or refresh many album documents in a single bulk write.
+
+        Args:
+            albums: Album documents keyed on album_id
+
+        Returns:
+            int: Number of inserted or modified albums, None on failure
+        """
+        return self._bulk_replace(self.albums, "album_id", albums, "albums")
+
+    def get_missing_ids(self, collection: str, field: str, ids: list[str]) -> tuple[list[str], str]:
+        """
+        Get the IDs that have no document in a collection.
+
+        Args:
+            collection: Collection name, e.g. "artists"
+            field: ID field, e.g. "artist_id"
+            ids: IDs to look up
+
+        Returns:
+            list[str]: IDs without a document, in input order, None on failure
+        """
+        try:
+            known = set(self.db[collection].distinct(field, {field: {"$in": ids}}))
+            return [_id for _id in dict.fromkeys(ids) if _id not in known], f"Missing {collection} IDs retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get missing {collection} IDs: {str(e)}")
+            return None, f"Failed to get missing {collection} IDs"
+
     ### RECENTLY PLAYED ###
 
     def store_recently_played(self, user_id: str, track_id: str, played_at: datetime) -> tuple[bool, str]:
         """
-        Store a recently played track in MongoDB.
+        Store a play event in MongoDB.
 
         Args:
             user_id: Spotify user ID
@@ -142,12 +424,15 @@ class MongoDBHandler:
         }
 
         try:
-            if self.recently_played.find_one({"user_id": user_id, "track_id": track_id}):
+            # Every play is an event keyed on (user_id, track_id, played_at), only exact replays are skipped
+            result = self.recently_played.update_one(
+                track_data, {"$setOnInsert": track_data}, upsert=True)
+            if result.upserted_id is None:
                 self._logger.info(
-                    f"Recently played track already exists: {track_id} for user: {user_id}")
+                    f"Recently played track already exists: {track_id} at {played_at} for user: {user_id}")
                 return False, "Recently played track already exists"
 
-            self.recently_played.insert_one(track_data)
+            self._count_plays([track_data])
             self._logger.info(
                 f"Stored recently played track: {track_id} for user: {user_id}")
             return True, "Recently played track stored successfully"
@@ -156,23 +441,89 @@ class MongoDBHandler:
                 f"Failed to store recently played track: {str(e)}")
             return False, "Failed to store recently played track"
 
-    def get_recently_played(self, user_id: str) -> tuple[list[RecentlyPlayedTrackRecord], str]:
+    def store_recently_played_many(self, records: list[dict]) -> tuple[dict, str]:
         """
-        Get recently played tracks for a user.
+        Store many recently played tracks in MongoDB in a single bulk write.
+
+        Args:
+            records: Dicts with user_id, track_id and played_at
+
+        Returns:
+            dict: Counts of inserted and duplicate records
+        """
+        docs = play_documents(records)
+
+        try:
+            inserted = self._bulk_upsert(self.recently_played, PLAY_KEY, docs)
+            self._count_plays(inserted)
+            counts = insert_counts(inserted, docs)
+            self._logger.info(
+                f"Stored recently played tracks: {counts['inserted']} inserted, {counts['duplicates']} duplicates")
+            return counts, "Recently played tracks stored successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store recently played tracks: {str(e)}")
+            return None, "Failed to store recently played tracks"
+
+    def get_recently_played(
+        self,
+        user_id: str,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[RecentlyPlayedTrackRecord], str]:
+        """
+        Get recently played tracks for a user, newest first.
+
+        Args:
+            user_id: Spotify user ID
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
+
+        Returns:
+            list[RecentlyPlayedTrackRecord]: List of recently played tracks (dicts when projected), None on failure
+        """
+        try:
+            query, fields, sort = page_find({"user_id": user_id}, "played_at", DESCENDING, after, projection)
+            cursor = self.recently_played.find(query, fields).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            if projection:
+                return [stringify_id(doc) for doc in cursor], "Recently played tracks retrieved successfully"
+            return [RecentlyPlayedTrackRecord.from_bson(doc) for doc in cursor], "Recently played tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get recently played tracks: {str(e)}")
+            return None, "Failed to get recently played tracks"
+
+    def get_recently_played_expanded(
+        self,
+        user_id: str,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[dict], str]:
+        """
+        Get recently played tracks for a user joined with track metadata, newest first.
 
         Args:
             user_id: Spotify user ID
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
 
         Returns:
-            list[RecentlyPlayedTrackRecord]: List of recently played tracks
+            list[dict]: Plays with name, artists and album, None on failure
         """
         try:
-            cursor = self.recently_played.find({"user_id": user_id})
-            return [RecentlyPlayedTrackRecord(**doc) for doc in cursor], "Recently played tracks retrieved successfully"
+            cursor = self.recently_played.aggregate(
+                expanded_history_pipeline(user_id, limit, after, projection))
+            return [stringify_id(doc) for doc in cursor], "Recently played tracks retrieved successfully"
         except Exception as e:
             self._logger.error(
                 f"Failed to get recently played tracks: {str(e)}")
-            return [], "Failed to get recently played tracks"
+            return None, "Failed to get recently played tracks"
 
     def delete_user_recently_played(self, user_id: str) -> tuple[bool, str]:
         """
@@ -186,6 +537,7 @@ class MongoDBHandler:
         """
         try:
             self.recently_played.delete_many({"user_id": user_id})
+            self.daily_plays.delete_many({"user_id": user_id})
             return True, "Recently played tracks deleted successfully"
         except Exception as e:
             self._logger.error(
@@ -219,6 +571,7 @@ class MongoDBHandler:
                 return False, "Saved track already exists"
 
             self.saved_tracks.insert_one(track_data)
+            self._add_co_listens(self._saved_pairs([track_data]))
             self._logger.info(
                 f"Stored saved track: {track_id} for user: {user_id}")
             return True, "Saved track stored successfully"
@@ -227,25 +580,61 @@ class MongoDBHandler:
                 f"Failed to store saved track: {str(e)}")
             return False, "Failed to store saved track"
 
-    def get_saved_tracks(self, user_id: str) -> tuple[list[SavedTrack], str]:
+    def store_saved_tracks_many(self, records: list[dict]) -> tuple[dict, str]:
+        """
+        Store many saved tracks in MongoDB in a single bulk write.
+
+        Args:
+            records: Dicts with user_id, track_id and added_at
+
+        Returns:
+            dict: Counts of inserted and duplicate records
+        """
+        docs = saved_track_documents(records)
+
+        try:
+            inserted = self._bulk_upsert(self.saved_tracks, SAVED_TRACK_KEY, docs)
+            counts = insert_counts(inserted, docs)
+            self._add_co_listens(self._saved_pairs(inserted))
+            self._logger.info(
+                f"Stored saved tracks: {counts['inserted']} inserted, {counts['duplicates']} duplicates")
+            return counts, "Saved tracks stored successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to store saved tracks: {str(e)}")
+            return None, "Failed to store saved tracks"
+
+    def get_saved_tracks(
+        self,
+        user_id: str,
+        limit: int | None = None,
+        after: str | None = None,
+        projection: list[str] | None = None
+    ) -> tuple[list[SavedTrack], str]:
         """
-        Get saved tracks for a user.
+        Get saved tracks for a user, most recently added first.
 
         Args:
             user_id: Spotify user ID
-            limit: Number of tracks to retrieve
+            limit: Maximum number of tracks to retrieve
+            after: Cursor of the last track of the previous page
+            projection: Fields to retrieve, all fields if not given
 
         Returns:
-            list[SavedTrack]: List of saved tracks
+            list[SavedTrack]: List of saved tracks (dicts when projected), None on failure
         """
         try:
-            cursor = self.saved_tracks.find({"user_id": user_id}).sort(
-                "added_at", DESCENDING)
-            return [SavedTrack(**doc) for doc in cursor], "Saved tracks retrieved successfully"
+            query, fields, sort = page_find({"user_id": user_id}, "added_at", DESCENDING, after, projection)
+            cursor = self.saved_tracks.find(query, fields).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            if projection:
+                return [stringify_id(doc) for doc in cursor], "Saved tracks retrieved successfully"
+            return [SavedTrack.from_bson(doc) for doc in cursor], "Saved tracks retrieved successfully"
         except Exception as e:
             self._logger.error(
                 f"Failed to get saved tracks: {str(e)}")
-            return [], "Failed to get saved tracks"
+            return None, "Failed to get saved tracks"
 
     def delete_user_saved_tracks(self, user_id: str, track_id: str) -> tuple[bool, str]:
         """
@@ -259,10 +648,549 @@ class MongoDBHandler:
             bool: True if successful, False otherwise
         """
         try:
+            removed_pairs = self._saved_pairs(self._find_saved_tracks(user_id, [track_id]))
             self.saved_tracks.delete_one(
                 {"user_id": user_id, "track_id": track_id})
+            self._remove_co_listens(removed_pairs)
             return True, "Saved track deleted successfully"
         except Exception as e:
             self._logger.error(
                 f"Failed to delete saved track: {str(e)}")
             return False, "Failed to delete saved track"
+
+    def get_saved_track_ids(self, user_id: str) -> tuple[list[str], str]:
+        """
+        Get the IDs of a user's saved tracks, read from the (user_id, track_id) index only.
+
+        Args:
+            user_id: Spotify user ID
+
+        Returns:
+            list[str]: Spotify track IDs, None on failure
+        """
+        try:
+            cursor = self.saved_tracks.find({"user_id": user_id}, {"_id": 0, "track_id": 1})
+            return [doc["track_id"] for doc in cursor], "Saved track IDs retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get saved track IDs: {str(e)}")
+            return None, "Failed to get saved track IDs"
+
+    def get_saved_track_added_at(self, user_id: str) -> tuple[dict[str, datetime], str]:
+        """
+        Get when each of a user's saved tracks was added.
+
+        Args:
+            user_id: Spotify user ID
+
+        Returns:
+            dict: added_at keyed on Spotify track ID, None on failure
+        """
+        try:
+            cursor = self.saved_tracks.find({"user_id": user_id}, {"_id": 0, "track_id": 1, "added_at": 1})
+            return {doc["track_id"]: doc["added_at"] for doc in cursor}, "Saved track times retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get saved track times: {str(e)}")
+            return None, "Failed to get saved track times"
+
+    def get_newest_added_at(self, user_id: str) -> datetime | None:
+        """
+        Get when the user's most recently saved track was added.
+
+        Args:
+            user_id: Spotify user ID
+
+        Returns:
+            datetime: added_at of the newest saved track, None if there is none
+        """
+        doc = self.saved_tracks.find_one(
+            {"user_id": user_id}, {"_id": 0, "added_at": 1}, sort=[("added_at", DESCENDING)])
+        return doc["added_at"] if doc else None
+
+    def apply_saved_tracks_delta(self, user_id: str, added: list[dict], removed: list[str]) -> tuple[dict, str]:
+        """
+        Insert, re-date and remove saved tracks of a user in a single bulk write.
+
+        A track saved again since it was stored keeps its document with the new added_at,
+        and its saved pairs move from the old save time to the new one.
+
+        Args:
+            user_id: Spotify user ID
+            added: Dicts with user_id, track_id and added_at to insert, or to update if already stored
+            removed: Spotify track IDs to remove
+
+        Returns:
+            dict: Counts of inserted, updated and removed records
+        """
+        docs = saved_track_documents(added)
+        operations = saved_tracks_delta_operations(user_id, docs, removed)
+        if not operations:
+            return {"inserted": 0, "updated": 0, "removed": 0}, "No saved tracks changed"
+
+        try:
+            # The removed and re-saved tracks' pairs are counted against the library they are leaving
+            previous = self._find_saved_tracks(user_id, removed + [doc["track_id"] for doc in docs])
+            previous_pairs = self._saved_pairs(previous)
+            try:
+                result = self.saved_tracks.bulk_write(operations, ordered=False)
+                indexes, updated, deleted = list(result.upserted_ids), result.modified_count, result.deleted_count
+            except BulkWriteError as e:
+                indexes, updated, deleted = upserted_indexes(e), e.details.get("nModified", 0), e.details.get("nRemoved", 0)
+            inserted = [docs[index] for index in indexes]
+            stored_ids = {doc["track_id"] for doc in previous}
+            resaved = [doc for doc in docs if doc["track_id"] in stored_ids]
+            self._remove_co_listens(previous_pairs)
+            self._add_co_listens(self._saved_pairs(inserted + resaved))
+            counts = {"inserted": len(inserted), "updated": updated, "removed": deleted}
+            self._logger.info(
+                f"Reconciled saved tracks for user: {user_id}: {counts['inserted']} inserted, "
+                f"{counts['updated']} updated, {counts['removed']} removed")
+            return counts, "Saved tracks reconciled successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to reconcile saved tracks: {str(e)}")
+            return None, "Failed to reconcile saved tracks"
+
+    ### SYNC STATE ###
+
+    def get_high_water_mark(self, user_id: str, stream: str) -> int | None:
+        """
+        Get the sync cursor of a user's stream.
+
+        Args:
+            user_id: Spotify user ID
+            stream: Synced stream, e.g. "recently_played"
+
+        Returns:
+            int: Unix time in milliseconds of the newest synced item, None if never synced
+        """
+        state = self.sync_state.find_one({"user_id": user_id, "stream": stream})
+        return state["high_water_mark"] if state else None
+
+    def set_high_water_mark(self, user_id: str, stream: str, high_water_mark: int) -> None:
+        """
+        Advance the sync cursor of a user's stream. The cursor never moves backwards.
+
+        Args:
+            user_id: Spotify user ID
+            stream: Synced stream, e.g. "recently_played"
+            high_water_mark: Unix time in milliseconds of the newest synced item
+        """
+        self.sync_state.update_one(
+            {"user_id": user_id, "stream": stream},
+            {"$max": {"high_water_mark": high_water_mark}, "$set": {"synced_at": datetime.now(timezone.utc)}},
+            upsert=True)
+
+    def record_sync(self, user_id: str, stream: str, error: str | None = None) -> None:
+        """
+        Record the outcome of a sync run of a user's stream.
+
+        Args:
+            user_id: Spotify user ID
+            stream: Synced stream, e.g. "recently_played"
+            error: Error message, None if the run succeeded
+        """
+        now = datetime.now(timezone.utc)
+        update = {"last_run_at": now, "last_error": error}
+        if error is None:
+            update["last_success_at"] = now
+        self.sync_state.update_one({"user_id": user_id, "stream": stream}, {"$set": update}, upsert=True)
+
+    def get_sync_states(self, stream: str | None = None) -> list[dict]:
+        """
+        Get the sync state of every user.
+
+        Args:
+            stream: Only this stream, all streams if not given
+
+        Returns:
+            list[dict]: user_id, stream, high_water_mark and last run fields
+        """
+        return list(self.sync_state.find({"stream": stream} if stream else {}, {"_id": 0}))
+
+    ### TOKENS ###
+
+    def get_token(self, user_id: str) -> dict | None:
+        """
+        Get the stored OAuth token of a user.
+
+        Args:
+            user_id: Spotify user ID
+
+        Returns:
+            dict: spotipy token info, None if the user never authorized
+        """
+        doc = self.spotify_tokens.find_one({"user_id": user_id})
+        return doc["token"] if doc else None
+
+    def save_token(self, user_id: str, token: dict) -> None:
+        """
+        Store the OAuth token of a user, e.g. after spotipy refreshed it.
+
+        Args:
+            user_id: Spotify user ID
+            token: spotipy token info
+        """
+        self.spotify_tokens.update_one(
+            {"user_id": user_id},
+            {"$set": {"token": token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True)
+
+    def get_token_user_ids(self) -> list[str]:
+        """
+        Get the users with a stored OAuth token.
+
+        Returns:
+            list[str]: Spotify user IDs
+        """
+        return self.spotify_tokens.distinct("user_id")
+
+    ### STATS ###
+
+    def get_top_tracks(self, user_id: str, window: str = "7d", limit: int = 10) -> tuple[list[dict], str]:
+        """
+        Get the most played tracks of a user from the daily rollup.
+
+        Args:
+            user_id: Spotify user ID
+            window: Number of days such as "7d", or "all"
+            limit: Number of results
+
+        Returns:
+            list[dict]: Stats rows, None on failure
+        """
+        try:
+            return list(self.daily_plays.aggregate(top_tracks_pipeline(user_id, window, limit))), "Stats retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get stats: {str(e)}")
+            return None, "Failed to get stats"
+
+    def get_top_artists(self, user_id: str, window: str = "7d", limit: int = 10) -> tuple[list[dict], str]:
+        """
+        Get the most played artists of a user from the daily rollup.
+
+        Args:
+            user_id: Spotify user ID
+            window: Number of days such as "7d", or "all"
+            limit: Number of results
+
+        Returns:
+            list[dict]: Stats rows, None on failure
+        """
+        try:
+            return list(self.daily_plays.aggregate(top_artists_pipeline(user_id, window, limit))), "Stats retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get stats: {str(e)}")
+            return None, "Failed to get stats"
+
+    def get_play_counts(self, user_id: str, window: str = "30d") -> tuple[list[dict], str]:
+        """
+        Get the number of plays per day of a user from the daily rollup.
+
+        Args:
+            user_id: Spotify user ID
+            window: Number of days such as "7d", or "all"
+
+        Returns:
+            list[dict]: Stats rows, None on failure
+        """
+        try:
+            return list(self.daily_plays.aggregate(play_counts_pipeline(user_id, window))), "Stats retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get stats: {str(e)}")
+            return None, "Failed to get stats"
+
+    def rebuild_daily_plays(self, user_id: str | None = None) -> tuple[bool, str]:
+        """
+        Recompute the daily rollup from recently_played with an aggregation pipeline.
+
+        Buckets are replaced in place and the stale ones deleted afterwards, so concurrent
+        writers keep counting into the rollup while it is rebuilt.
+
+        Args:
+            user_id: Rebuild a single user, all users if not given
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            rebuilt_at = datetime.now(timezone.utc).replace(microsecond=0)
+            self.recently_played.aggregate(rebuild_pipeline(rebuilt_at, user_id))
+            self.daily_plays.delete_many(stale_buckets_query(rebuilt_at, user_id))
+            return True, "Daily plays rebuilt successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to rebuild daily plays: {str(e)}")
+            return False, "Failed to rebuild daily plays"
+
+    ### SESSIONS ###
+
+    def update_sessions(
+        self,
+        user_id: str,
+        gap_ms: int = DEFAULT_GAP_MS,
+        rebuild: bool = False,
+        batch_size: int = 1000
+    ) -> tuple[int, str]:
+        """
+        Detect listening sessions in plays newer than the user's last stored session.
+
+        Plays are streamed oldest first and processed in batches, each batch resolving track
+        durations through get_tracks and upserting the sessions it created or extended.
+        Plays stored since the previous refresh but played before the last session's end, e.g.
+        from a batch import or a delayed sync, reopen the session they fall into, which is
+        rebuilt with every later one. Only sessions are rebuilt for them, their co-listen pairs
+        are not counted.
+
+        Args:
+            user_id: Spotify user ID
+            gap_ms: Inactivity after the end of a track that closes a session
+            rebuild: Drop the user's sessions and reprocess the whole history. Co-listen pairs are
+                not counted again, run rebuild_co_listens afterwards to match the similarity index
+                to the rebuilt sessions.
+            batch_size: Number of plays processed per batch
+
+        Returns:
+            int: Number of session writes, None on failure
+        """
+        try:
+            if rebuild:
+                self.sessions.delete_many({"user_id": user_id})
+            # Read before any play so plays stored during the refresh are checked by the next one
+            newest = self.recently_played.find_one({"user_id": user_id}, {"_id": 1}, sort=NEWEST_STORED_SORT)
+            last_session = self._reopen_sessions(user_id)
+            claim = PairClaim(user_id, self.sync_state.find_one(pairs_state_query(user_id)))
+            builder = SessionBuilder(user_id, gap_ms, last_session, pair_tracks=not rebuild, pair_after=claim.claimed)
+            after = last_session["end"] if last_session else None
+
+            written = 0
+            batch = []
+            for play in self.iter_plays(user_id, batch_size, after):
+                batch.append(play)
+                if len(batch) >= batch_size:
+                    written += self._add_session_batch(builder, batch, claim)
+                    batch = []
+            written += self._add_session_batch(builder, batch, claim)
+            if newest:
+                self.sync_state.update_one(
+                    sessions_state_query(user_id), sessions_state_update(newest["_id"]), upsert=True)
+            return written, "Sessions updated successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to update sessions: {str(e)}")
+            return None, "Failed to update sessions"
+
+    def _reopen_sessions(self, user_id: str) -> dict | None:
+        """
+        Drop the sessions that late plays fall into.
+
+        Returns:
+            dict: The stored session new plays may extend, None to start from the first play
+        """
+        last_session = self.sessions.find_one({"user_id": user_id}, sort=LAST_SESSION_SORT)
+        state = self.sync_state.find_one(sessions_state_query(user_id))
+        if last_session is None or state is None:
+            return last_session
+        late = self.recently_played.find_one(
+            late_plays_query(user_id, state["stored_through"], last_session["end"]), PLAYS_PROJECTION, sort=PLAYS_SORT)
+        if late is None:
+            return last_session
+        reopened = self.sessions.find_one(reopened_session_query(user_id, late["played_at"]), sort=LAST_SESSION_SORT)
+        start = reopened["start"] if reopened else late["played_at"]
+        self.sessions.delete_many({"user_id": user_id, "start": {"$gte": start}})
+        return self.sessions.find_one({"user_id": user_id}, sort=LAST_SESSION_SORT)
+
+    def _add_session_batch(self, builder: SessionBuilder, plays: list[dict], claim: PairClaim) -> int:
+        if not plays:
+            return 0
+        tracks, _ = self.get_tracks(list({play["track_id"] for play in plays}))
+        sessions, pairs = add_plays(builder, plays, tracks)
+        self.sessions.bulk_write(session_operations(sessions), ordered=False)
+        if pairs and self._claim_pairs(claim, plays[-1]["played_at"]):
+            self._add_co_listens(pairs)
+        return len(sessions)
+
+    def _claim_pairs(self, claim: PairClaim, through: datetime) -> bool:
+        """Move the user's pair cursor to through, False if those plays were counted or claimed concurrently."""
+        if not claim.claimable(through):
+            return False
+        try:
+            self.sync_state.find_one_and_update(claim.query(), claim.update(through), upsert=True)
+        except DuplicateKeyError:
+            claim.lost = True
+            self._logger.warning(f"Co-listen pairs of user: {claim.user_id} are counted by a concurrent refresh")
+            return False
+        claim.claimed = through
+        return True
+
+    def get_sessions(self, user_id: str, limit: int | None = None, after: str | None = None) -> tuple[list[dict], str]:
+        """
+        Get stored listening sessions for a user, newest first.
+
+        Args:
+            user_id: Spotify user ID
+            limit: Maximum number of sessions to retrieve
+            after: Cursor of the last session of the previous page
+
+        Returns:
+            list[dict]: Sessions, None on failure
+        """
+        try:
+            query, _, sort = page_find({"user_id": user_id}, "start", DESCENDING, after)
+            cursor = self.sessions.find(query).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return [stringify_id(doc) for doc in cursor], "Sessions retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get sessions: {str(e)}")
+            return None, "Failed to get sessions"
+
+    ### RELATED TRACKS ###
+
+    def _find_saved_tracks(self, user_id: str, track_ids: list[str]) -> list[dict]:
+        return list(self.saved_tracks.find(
+            {"user_id": user_id, "track_id": {"$in": track_ids}}, SAVED_PAIR_PROJECTION))
+
+    def _saved_pairs(self, saved: list[dict]) -> Counter:
+        """Pairs of stored saved tracks with the user's saved tracks around them, see saved_pair_counts."""
+        if not saved:
+            return Counter()
+        window = list(self.saved_tracks.find(saved_window_query(saved), SAVED_PAIR_PROJECTION))
+        return saved_pair_counts(window, {(doc["user_id"], doc["track_id"]) for doc in saved})
+
+    def _add_co_listens(self, pairs: Counter) -> None:
+        """Apply co-occurrence increments and refresh the neighbors of the touched tracks."""
+        if not pairs:
+            return
+        self.co_listens.bulk_write(co_listen_operations(pairs), ordered=False)
+        self.co_listens.aggregate(neighbors_pipeline(list({track_id for track_id, _ in pairs})))
+
+    def _remove_co_listens(self, pairs: Counter) -> None:
+        """Withdraw co-occurrence counts, drop the cells they empty and refresh the neighbors of the touched tracks."""
+        if not pairs:
+            return
+        track_ids = list({track_id for track_id, _ in pairs})
+        self.co_listens.bulk_write(co_listen_operations(withdrawn_pairs(pairs)), ordered=False)
+        self.co_listens.delete_many({"track_id": {"$in": track_ids}, "count": {"$lte": 0}})
+        self.related_tracks.delete_many({"track_id": {"$in": track_ids}})
+        self.co_listens.aggregate(neighbors_pipeline(track_ids))
+
+    def rebuild_co_listens(self, batch_size: int = 1000, flush_pairs: int = 100000) -> tuple[bool, str]:
+        """
+        Recompute co_listens and related_tracks from every stored session and saved track.
+
+        Sessions keep their distinct tracks in joining order, so their pairs are recounted without
+        replaying plays. Both collections are built in scratch collections renamed over the live
+        ones, so readers see the old or the new index, never a partial one. Each user's pair cursor
+        moves to the end of their last session, as those plays are now counted. Run it while no
+        session refresh or saved tracks sync is in progress.
+
+        Args:
+            batch_size: Number of sessions fetched per round trip
+            flush_pairs: Distinct pairs held in memory before they are written
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            scratch = self.db[CO_LISTENS_REBUILD]
+            scratch.drop()
+            for keys, options in INDEXES[CO_LISTENS]:
+                scratch.create_index(keys, **options)
+
+            pairs = Counter()
+            for session in self.sessions.find({}, {"_id": 0, "track_ids": 1}).batch_size(batch_size):
+                pairs.update(session_pair_counts(session["track_ids"]))
+                if len(pairs) >= flush_pairs:
+                    scratch.bulk_write(co_listen_operations(pairs), ordered=False)
+                    pairs = Counter()
+            for user_id in self.saved_tracks.distinct("user_id"):
+                pairs.update(saved_pair_counts(list(self.saved_tracks.find({"user_id": user_id}, SAVED_PAIR_PROJECTION))))
+                if len(pairs) >= flush_pairs:
+                    scratch.bulk_write(co_listen_operations(pairs), ordered=False)
+                    pairs = Counter()
+            if pairs:
+                scratch.bulk_write(co_listen_operations(pairs), ordered=False)
+
+            related = self.db[RELATED_TRACKS_REBUILD]
+            related.drop()
+            for keys, options in INDEXES[RELATED_TRACKS]:
+                related.create_index(keys, **options)
+            scratch.aggregate(neighbors_pipeline(None, into=RELATED_TRACKS_REBUILD))
+            scratch.rename(CO_LISTENS, dropTarget=True)
+            related.rename(RELATED_TRACKS, dropTarget=True)
+
+            cursors = self.sessions.aggregate([{"$group": {"_id": "$user_id", "end": {"$max": "$end"}}}])
+            operations = [
+                UpdateOne(pairs_state_query(cursor["_id"]), {"$max": {"pairs_through": cursor["end"]}}, upsert=True)
+                for cursor in cursors
+            ]
+            if operations:
+                self.sync_state.bulk_write(operations, ordered=False)
+            return True, "Co-listens rebuilt successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to rebuild co-listens: {str(e)}")
+            return False, "Failed to rebuild co-listens"
+
+    def get_related_tracks(self, track_id: str, limit: int = DEFAULT_NEIGHBORS) -> tuple[list[dict], str]:
+        """
+        Get the tracks most often listened to together with a track.
+
+        Args:
+            track_id: Spotify track ID
+            limit: Maximum number of related tracks
+
+        Returns:
+            list[dict]: track_id, count and, when known, name and artists of each related track,
+                strongest first, None on failure
+        """
+        try:
+            doc = self.related_tracks.find_one({"track_id": track_id}, {"_id": 0, "neighbors": 1})
+            neighbors = doc["neighbors"][:limit] if doc else []
+            tracks, _ = self.get_tracks([neighbor["track_id"] for neighbor in neighbors])
+            return with_track_metadata(neighbors, tracks), "Related tracks retrieved successfully"
+        except Exception as e:
+            self._logger.error(
+                f"Failed to get related tracks: {str(e)}")
+            return None, "Failed to get related tracks"
+
+    ### EXPORT ###
+
+    def iter_plays(self, user_id: str, batch_size: int = 10000, after: datetime | None = None) -> Iterator[dict]:
+        """
+        Stream a user's plays oldest first, projected to track_id and played_at.
+
+        Args:
+            user_id: Spotify user ID
+            batch_size: Number of documents fetched per round trip
+            after: Only plays strictly after this time
+
+        Yields:
+            dict: track_id and played_at of each play
+        """
+        yield from self.recently_played.find(
+            plays_after_query(user_id, after), PLAYS_PROJECTION).sort(PLAYS_SORT).batch_size(batch_size)
+
+    def iter_user_history(self, user_id: str, batch_size: int = 1000) -> Iterator[dict]:
+        """
+        Stream a user's recently played and saved tracks straight from the cursors.
+
+        Args:
+            user_id: Spotify user ID
+            batch_size: Number of documents fetched per round trip
+
+        Yields:
+            dict: Raw document tagged with its collection under "type"
+        """
+        for name, field in HISTORY_COLLECTIONS:
+            cursor = self.db[name].find({"user_id": user_id}).sort(
+                keyset_sort(field, DESCENDING)).batch_size(batch_size)
+            for doc in cursor:
+                doc["type"] = name
+                yield doc
@@ -0,0 +1,118 @@
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+
+def encode_cursor(value: datetime | None, _id: object) -> str:
+    """
+    Encode the sort key of the last item of a page into an opaque cursor.
+
+    Args:
+        value: Value of the sort field (played_at/added_at), None when paging on _id only
+        _id: Document ID, used as tie-breaker
+
+    Returns:
+        str: URL-safe cursor
+    """
+    payload = {"v": value.isoformat() if value is not None else None, "id": str(_id)}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, ObjectId]:
+    """
+    Decode a cursor created by encode_cursor.
+
+    Args:
+        cursor: Opaque cursor
+
+    Returns:
+        tuple: Sort field value and document ID
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value = datetime.fromisoformat(payload["v"]) if payload["v"] is not None else None
+        return value, ObjectId(payload["id"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_query(query: dict, field: str | None, direction: int, after: str | None) -> dict:
+    """
+    Extend a query so it only matches documents after the cursor in (field, _id) order.
+
+    Args:
+        query: Base query, e.g. {"user_id": ...}
+        field: Sort field, None when paging on _id only
+        direction: ASCENDING or DESCENDING
+        after: Cursor of the last item of the previous page
+
+    Returns:
+        dict: Range query on the indexed sort keys
+    """
+    if after is None:
+        return query
+
+    value, _id = decode_cursor(after)
+    op = "$gt" if direction == ASCENDING else "$lt"
+    if field is None:
+        return {**query, "_id": {op: _id}}
+    return {
+        **query,
+        "$or": [
+            {field: {op: value}},
+            {field: value, "_id": {op: _id}},
+        ],
+    }
+
+
+def keyset_sort(field: str | None, direction: int) -> list[tuple[str, int]]:
+    """Sort specification matching keyset_query."""
+    if field is None:
+        return [("_id", direction)]
+    return [(field, direction), ("_id", direction)]
+
+
+def build_projection(fields: list[str] | None, field: str | None) -> dict | None:
+    """
+    Build a projection that always keeps the keys needed to continue paging.
+
+    Args:
+        fields: Requested fields, None for the whole document
+        field: Sort field
+
+    Returns:
+        dict: Projection, or None for the whole document
+    """
+    if not fields:
+        return None
+    projection = {name: 1 for name in fields}
+    if field is not None:
+        projection[field] = 1
+    return projection
+
+
+def next_cursor(items: list, field: str | None, limit: int | None) -> str | None:
+    """
+    Build the cursor of the page following items.
+
+    Args:
+        items: Current page, records or dicts
+        field: Sort field, None when paging on _id only
+        limit: Page size
+
+    Returns:
+        str: Cursor, or None when this is the last page
+    """
+    if not items or limit is None or len(items) < limit:
+        return None
+    last = items[-1]
+    if isinstance(last, dict):
+        return encode_cursor(last.get(field) if field else None, last["_id"])
+    return encode_cursor(getattr(last, field) if field else None, last._id)
+
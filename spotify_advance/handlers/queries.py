@@ -0,0 +1,238 @@
+# Filters, pipelines, bulk operations and document shaping shared by MongoDBHandler and
+# AsyncMongoDBHandler, so the two handlers only differ in how they perform the I/O
+from collections import Counter
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, DeleteMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from spotify_advance.handlers.pagination import build_projection, keyset_query, keyset_sort
+from spotify_advance.sessions import SessionBuilder
+
+# Plays streamed into the session builder
+PLAYS_PROJECTION = {"_id": 0, "track_id": 1, "played_at": 1}
+PLAYS_SORT = [("played_at", ASCENDING)]
+
+# The newest stored session of a user, which new plays may extend
+LAST_SESSION_SORT = [("start", DESCENDING)]
+
+# Most recently stored play first, whatever its played_at
+NEWEST_STORED_SORT = [("_id", DESCENDING)]
+
+# sync_state stream whose stored_through is the _id of the newest play seen by a session refresh
+SESSIONS_STREAM = "sessions"
+
+# Collections exported per user, with the field they are sorted on
+HISTORY_COLLECTIONS = (("recently_played", "played_at"), ("saved_tracks", "added_at"))
+
+PLAY_KEY = ("user_id", "track_id", "played_at")
+SAVED_TRACK_KEY = ("user_id", "track_id")
+
+
+def upsert_operations(key_fields: tuple[str, ...], docs: list[dict]) -> list[UpdateOne]:
+    """Build insert-if-absent upserts keyed on the given fields."""
+    return [
+        UpdateOne({field: doc[field] for field in key_fields}, {"$setOnInsert": doc}, upsert=True)
+        for doc in docs
+    ]
+
+
+def upserted_indexes(error: BulkWriteError) -> list[int]:
+    """
+    Return the indexes of the upserted operations of a bulk write that only failed on duplicate keys.
+
+    Concurrent writers may race on the same key and the unique index rejects the loser,
+    any other write error is re-raised.
+    """
+    errors = error.details.get("writeErrors", [])
+    if any(write_error.get("code") != 11000 for write_error in errors):
+        raise error
+    return [upserted["index"] for upserted in error.details.get("upserted", [])]
+
+
+def insert_counts(inserted: list[dict], docs: list[dict]) -> dict:
+    return {"inserted": len(inserted), "duplicates": len(docs) - len(inserted)}
+
+
+def track_document(name: str, track_id: str, popularity: int, uri: str, album: dict, artists: list[dict]) -> dict:
+    return {
+        "name": name,
+        "track_id": track_id,
+        "popularity": popularity,
+        "uri": uri,
+        "album": album['name'],
+        "artists": [artist['name'] for artist in artists]
+    }
+
+
+def play_documents(records: list[dict]) -> list[dict]:
+    """recently_played documents of records with user_id, track_id and played_at."""
+    return [
+        {"user_id": record["user_id"], "track_id": record["track_id"], "played_at": record["played_at"]}
+        for record in records
+    ]
+
+
+def saved_track_documents(records: list[dict]) -> list[dict]:
+    """saved_tracks documents of records with user_id, track_id and added_at."""
+    return [
+        {"user_id": record["user_id"], "track_id": record["track_id"], "added_at": record["added_at"]}
+        for record in records
+    ]
+
+
+def saved_tracks_delta_operations(user_id: str, docs: list[dict], removed: list[str]) -> list[UpdateOne | DeleteMany]:
+    """
+    Upserts of added saved tracks followed by one delete of the removed ones, for a single bulk write.
+
+    A track saved again since it was stored matches its document, whose added_at moves to the new save.
+    """
+    operations = [
+        UpdateOne({field: doc[field] for field in SAVED_TRACK_KEY}, {"$set": {"added_at": doc["added_at"]}}, upsert=True)
+        for doc in docs
+    ]
+    if removed:
+        operations.append(DeleteMany({"user_id": user_id, "track_id": {"$in": removed}}))
+    return operations
+
+
+def page_find(base: dict, field: str | None, direction: int, after: str | None,
+              projection: list[str] | None = None) -> tuple[dict, dict | None, list]:
+    """
+    Arguments of a keyset-paginated find.
+
+    Args:
+        base: Filter of the whole result, e.g. {"user_id": user_id}
+        field: Sort field, _id only if None
+        direction: ASCENDING or DESCENDING
+        after: Cursor of the last document of the previous page
+        projection: Fields to retrieve, all fields if not given
+
+    Returns:
+        tuple: Filter, projection and sort
+    """
+    return (
+        keyset_query(base, field, direction, after),
+        build_projection(projection, field),
+        keyset_sort(field, direction))
+
+
+def stringify_id(doc: dict) -> dict:
+    return {**doc, "_id": str(doc["_id"])}
+
+
+def expanded_history_pipeline(user_id: str, limit: int | None, after: str | None, projection: list[str] | None) -> list[dict]:
+    """
+    Aggregation returning a page of plays joined with their track name, artists and album.
+
+    The page is selected with the same keyset range as get_recently_played before the $lookup,
+    so only the returned plays are joined.
+    """
+    pipeline = [
+        {"$match": keyset_query({"user_id": user_id}, "played_at", DESCENDING, after)},
+        {"$sort": dict(keyset_sort("played_at", DESCENDING))},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.extend([
+        {"$lookup": {"from": "tracks", "localField": "track_id", "foreignField": "track_id", "as": "track"}},
+        {"$unwind": {"path": "$track", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "user_id": 1,
+            "track_id": 1,
+            "played_at": 1,
+            "name": "$track.name",
+            "artists": "$track.artists",
+            "album": "$track.album",
+        }},
+    ])
+    fields = build_projection(projection, "played_at")
+    if fields:
+        pipeline.append({"$project": fields})
+    return pipeline
+
+
+def plays_after_query(user_id: str, after: datetime | None) -> dict:
+    """Query matching a user's plays strictly after a time, all plays if not given."""
+    query = {"user_id": user_id}
+    if after is not None:
+        query["played_at"] = {"$gt": after}
+    return query
+
+
+def sessions_state_query(user_id: str) -> dict:
+    return {"user_id": user_id, "stream": SESSIONS_STREAM}
+
+
+def sessions_state_update(stored_through: ObjectId) -> dict:
+    return {"$max": {"stored_through": stored_through}}
+
+
+def late_plays_query(user_id: str, stored_through: ObjectId, end: datetime) -> dict:
+    """
+    Plays stored since the last session refresh but played before the end of the last session.
+
+    Batch imports and delayed syncs insert such plays, which a refresh reading plays after the
+    last session's end would never reach.
+    """
+    return {"user_id": user_id, "_id": {"$gt": stored_through}, "played_at": {"$lte": end}}
+
+
+def reopened_session_query(user_id: str, played_at: datetime) -> dict:
+    """The newest session a late play may extend, i.e. the last one starting at or before it."""
+    return {"user_id": user_id, "start": {"$lte": played_at}}
+
+
+def split_cached_tracks(track_cache, track_ids: list[str]) -> tuple[dict, list[str]]:
+    """
+    Look tracks up in the track cache.
+
+    Returns:
+        tuple: Cached tracks keyed on track_id and the distinct IDs to query
+    """
+    found = {}
+    misses = []
+    for track_id in dict.fromkeys(track_ids):
+        track = track_cache.get(("track", track_id))
+        if track is None:
+            misses.append(track_id)
+        else:
+            found[track_id] = track
+    return found, misses
+
+
+def cache_track(track_cache, track: dict) -> dict:
+    """Make a track document JSON friendly and keep it in the track cache."""
+    track['_id'] = str(track['_id'])
+    track_cache.set(("track", track['track_id']), track)
+    return track
+
+
+def ordered_tracks(found: dict, track_ids: list[str]) -> list[dict]:
+    return [dict(found[track_id]) for track_id in track_ids if track_id in found]
+
+
+def add_plays(builder: SessionBuilder, plays: list[dict], tracks: list[dict] | None) -> tuple[list[dict], Counter]:
+    """Feed a batch of plays to a session builder, with durations from their tracks, and drain it."""
+    durations = {track["track_id"]: track.get("duration_ms") for track in tracks or []}
+    for play in plays:
+        builder.add(play["played_at"], play["track_id"], durations.get(play["track_id"]))
+    return builder.drain()
+
+
+def session_operations(sessions: list[dict]) -> list[UpdateOne]:
+    return [
+        UpdateOne({"user_id": session["user_id"], "start": session["start"]}, {"$set": session}, upsert=True)
+        for session in sessions
+    ]
+
+
+def with_track_metadata(neighbors: list[dict], tracks: list[dict] | None) -> list[dict]:
+    """Add the name and artists of each related track, None when the track is unknown."""
+    metadata = {track["track_id"]: track for track in tracks or []}
+    related = []
+    for neighbor in neighbors:
+        track = metadata.get(neighbor["track_id"], {})
+        related.append({**neighbor, "name": track.get("name"), "artists": track.get("artists")})
+    return related
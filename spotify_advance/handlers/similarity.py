@@ -0,0 +1,154 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from spotify_advance.utils import datetime_to_unix_ms
+
+# Sparse track x track co-occurrence matrix, one document per non-zero (track_id, other_id) cell
+CO_LISTENS = "co_listens"
+
+# Precomputed top neighbors per track
+RELATED_TRACKS = "related_tracks"
+
+# Scratch collections a full rebuild fills before they are renamed over the live ones
+CO_LISTENS_REBUILD = "co_listens_rebuild"
+RELATED_TRACKS_REBUILD = "related_tracks_rebuild"
+
+DEFAULT_NEIGHBORS = 20
+
+# A track joining a session co-occurs with at most this many of the session's previous distinct tracks
+CO_LISTEN_WINDOW = 20
+
+# Tracks saved by a user within this time of each other co-occur
+SAVE_WINDOW_MS = 60 * 60 * 1000
+
+# Fields of the saved tracks read to count saved pairs
+SAVED_PAIR_PROJECTION = {"_id": 0, "user_id": 1, "track_id": 1, "added_at": 1}
+
+# sync_state stream whose pairs_through is the played_at of the last play whose pairs were counted
+PAIRS_STREAM = "co_listen_pairs"
+
+
+def pairs_state_query(user_id: str) -> dict:
+    return {"user_id": user_id, "stream": PAIRS_STREAM}
+
+
+class PairClaim:
+    """
+    Compare-and-set cursor over the plays whose co-listen pairs were counted.
+
+    Concurrent session refreshes of a user read the same plays, but a batch's increments are
+    only applied by the refresh that moves the cursor from the value it read, so no play is
+    counted twice. The refresh that loses a claim stops counting and only upserts sessions.
+    """
+
+    def __init__(self, user_id: str, state: dict | None):
+        self.user_id = user_id
+        self.claimed: datetime | None = state.get("pairs_through") if state else None
+        self.lost = False
+
+    def claimable(self, through: datetime) -> bool:
+        """Check whether plays up to through may still be counted by this refresh."""
+        return not self.lost and (self.claimed is None or through > self.claimed)
+
+    def query(self) -> dict:
+        return {**pairs_state_query(self.user_id), "pairs_through": self.claimed}
+
+    def update(self, through: datetime) -> dict:
+        return {"$set": {"pairs_through": through}}
+
+
+def pair_counts(track_id: str, previous_ids: list[str]) -> Counter:
+    """Symmetric co-occurrence increments between a track and the tracks heard before it."""
+    pairs = Counter()
+    for other_id in previous_ids:
+        if other_id != track_id:
+            pairs[(track_id, other_id)] += 1
+            pairs[(other_id, track_id)] += 1
+    return pairs
+
+
+def session_pair_counts(track_ids: list[str]) -> Counter:
+    """Co-occurrence increments of a stored session, as SessionBuilder counted them when its tracks joined."""
+    pairs = Counter()
+    for index, track_id in enumerate(track_ids):
+        pairs.update(pair_counts(track_id, track_ids[max(index - CO_LISTEN_WINDOW, 0):index]))
+    return pairs
+
+
+def saved_pair_counts(saved: list[dict], changed: set[tuple[str, str]] | None = None) -> Counter:
+    """
+    Co-occurrence increments between tracks a user saved close together.
+
+    The saved-pair counts in co_listens always equal saved_pair_counts over every stored saved track,
+    so a track saved or removed later changes exactly the pairs it forms with its stored neighbors.
+
+    Args:
+        saved: saved_tracks documents
+        changed: (user_id, track_id) of the saved or removed tracks, only their pairs are counted when given
+
+    Returns:
+        Counter: Increments keyed on (track_id, other_id)
+    """
+    pairs = Counter()
+    by_user: dict[str, list[tuple[int, str]]] = {}
+    for doc in saved:
+        by_user.setdefault(doc["user_id"], []).append((datetime_to_unix_ms(doc["added_at"]), doc["track_id"]))
+
+    for user_id, saves in by_user.items():
+        saves.sort()
+        start = 0
+        for end, (added_ms, track_id) in enumerate(saves):
+            while added_ms - saves[start][0] > SAVE_WINDOW_MS:
+                start += 1
+            previous_ids = [other_id for _, other_id in saves[start:end]]
+            if changed is not None and (user_id, track_id) not in changed:
+                previous_ids = [other_id for other_id in previous_ids if (user_id, other_id) in changed]
+            pairs.update(pair_counts(track_id, previous_ids))
+    return pairs
+
+
+def saved_window_query(saved: list[dict]) -> dict:
+    """Query matching the saved tracks that may pair with the given ones, i.e. saved within SAVE_WINDOW_MS."""
+    bounds: dict[str, tuple[datetime, datetime]] = {}
+    for doc in saved:
+        low, high = bounds.get(doc["user_id"], (doc["added_at"], doc["added_at"]))
+        bounds[doc["user_id"]] = (min(low, doc["added_at"]), max(high, doc["added_at"]))
+    window = timedelta(milliseconds=SAVE_WINDOW_MS)
+    return {"$or": [
+        {"user_id": user_id, "added_at": {"$gte": low - window, "$lte": high + window}}
+        for user_id, (low, high) in bounds.items()
+    ]}
+
+
+def withdrawn_pairs(pairs: Counter) -> Counter:
+    """Negated co-occurrence counts, withdrawing pairs of tracks that are no longer saved."""
+    return Counter({pair: -count for pair, count in pairs.items()})
+
+
+def co_listen_operations(pairs: Counter) -> list[UpdateOne]:
+    """Build the $inc upserts applying co-occurrence increments."""
+    return [
+        UpdateOne({"track_id": track_id, "other_id": other_id}, {"$inc": {"count": count}}, upsert=True)
+        for (track_id, other_id), count in pairs.items()
+    ]
+
+
+def neighbors_pipeline(track_ids: list[str] | None, k: int = DEFAULT_NEIGHBORS, into: str = RELATED_TRACKS) -> list[dict]:
+    """
+    Aggregation recomputing the top-k neighbors of tracks and merging them into related_tracks.
+
+    Args:
+        track_ids: Tracks whose co-occurrence row changed, every track if None
+        k: Number of neighbors kept per track
+        into: Collection merged into
+    """
+    pipeline = [{"$match": {"track_id": {"$in": track_ids}}}] if track_ids is not None else []
+    pipeline.extend([
+        {"$sort": {"track_id": 1, "count": -1, "other_id": 1}},
+        {"$group": {"_id": "$track_id", "neighbors": {"$push": {"track_id": "$other_id", "count": "$count"}}}},
+        {"$project": {"_id": 0, "track_id": "$_id", "neighbors": {"$slice": ["$neighbors", k]}}},
+        {"$merge": {"into": into, "on": "track_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ])
+    return pipeline
@@ -0,0 +1,158 @@
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+# Rollup collection holding one counter per (user_id, day, track_id)
+DAILY_PLAYS = "daily_plays"
+
+WINDOW_PATTERN = re.compile(r"^(\d+)d$")
+
+
+def play_day(played_at: datetime) -> datetime:
+    """Truncate a play timestamp to its UTC day, as stored in the rollup."""
+    if played_at.tzinfo is not None:
+        played_at = played_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime(played_at.year, played_at.month, played_at.day)
+
+
+def window_start(window: str, now: datetime | None = None) -> datetime | None:
+    """
+    Parse a stats window such as '7d', '30d' or 'all'.
+
+    Args:
+        window: Number of days followed by 'd', or 'all'
+        now: Reference time, defaults to the current UTC time
+
+    Returns:
+        datetime: First day included in the window, None for all-time
+
+    Raises:
+        ValueError: If the window is malformed
+    """
+    if window == "all":
+        return None
+    match = WINDOW_PATTERN.match(window)
+    if not match or int(match.group(1)) < 1:
+        raise ValueError(f"Invalid window: {window}, expected e.g. '7d' or 'all'")
+    now = now or datetime.now(timezone.utc)
+    return play_day(now) - timedelta(days=int(match.group(1)) - 1)
+
+
+def increment_operations(plays: list[dict]) -> list[UpdateOne]:
+    """
+    Build the rollup increments for newly inserted plays.
+
+    Args:
+        plays: Inserted recently played documents
+
+    Returns:
+        list[UpdateOne]: One $inc per (user_id, day, track_id), stamping updated_at for rebuild_pipeline
+    """
+    counts = Counter(
+        (play["user_id"], play_day(play["played_at"]), play["track_id"]) for play in plays)
+    return [
+        UpdateOne(
+            {"user_id": user_id, "day": day, "track_id": track_id},
+            {"$inc": {"count": count}, "$currentDate": {"updated_at": True}},
+            upsert=True)
+        for (user_id, day, track_id), count in counts.items()
+    ]
+
+
+def _match(user_id: str, window: str) -> dict:
+    match = {"user_id": user_id}
+    start = window_start(window)
+    if start is not None:
+        match["day"] = {"$gte": start}
+    return match
+
+
+def top_tracks_pipeline(user_id: str, window: str, limit: int) -> list[dict]:
+    """Aggregation over the rollup returning the most played tracks in a window."""
+    return [
+        {"$match": _match(user_id, window)},
+        {"$group": {"_id": "$track_id", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "track_id": "$_id", "count": 1}},
+    ]
+
+
+def top_artists_pipeline(user_id: str, window: str, limit: int) -> list[dict]:
+    """Aggregation over the rollup, joined to tracks, returning the most played artists in a window."""
+    return [
+        {"$match": _match(user_id, window)},
+        {"$group": {"_id": "$track_id", "count": {"$sum": "$count"}}},
+        {"$lookup": {"from": "tracks", "localField": "_id", "foreignField": "track_id", "as": "track"}},
+        {"$unwind": "$track"},
+        {"$unwind": "$track.artists"},
+        {"$group": {"_id": "$track.artists", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "artist": "$_id", "count": 1}},
+    ]
+
+
+def play_counts_pipeline(user_id: str, window: str) -> list[dict]:
+    """Aggregation over the rollup returning the number of plays per day in a window."""
+    return [
+        {"$match": _match(user_id, window)},
+        {"$group": {"_id": "$day", "count": {"$sum": "$count"}}},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "day": "$_id", "count": 1}},
+    ]
+
+
+def rebuild_pipeline(rebuilt_at: datetime, user_id: str | None = None) -> list[dict]:
+    """
+    Aggregation recomputing the rollup from recently_played and merging it into daily_plays.
+
+    Recomputed buckets replace the stored ones in place, so the rollup is never emptied while
+    plays keep being counted. Buckets whose plays are gone are left for stale_buckets_query.
+
+    Args:
+        rebuilt_at: Start of the rebuild, stamped on every recomputed bucket
+        user_id: Rebuild a single user, all users if not given
+    """
+    pipeline = [{"$match": {"user_id": user_id}}] if user_id else []
+    pipeline.extend([
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "day": {"$dateTrunc": {"date": "$played_at", "unit": "day"}},
+                "track_id": "$track_id",
+            },
+            "count": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "day": "$_id.day",
+            "track_id": "$_id.track_id",
+            "count": 1,
+            "rebuilt_at": {"$literal": rebuilt_at},
+        }},
+        {"$merge": {
+            "into": DAILY_PLAYS,
+            "on": ["user_id", "day", "track_id"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ])
+    return pipeline
+
+
+def stale_buckets_query(rebuilt_at: datetime, user_id: str | None = None) -> dict:
+    """
+    Rollup buckets a rebuild started at rebuilt_at did not recompute and no play was counted into since.
+
+    Buckets incremented during the rebuild carry a newer updated_at and are kept.
+    """
+    query = {"user_id": user_id} if user_id else {}
+    query.update({
+        "rebuilt_at": {"$ne": rebuilt_at},
+        "$or": [{"updated_at": {"$lt": rebuilt_at}}, {"updated_at": {"$exists": False}}],
+    })
+    return query
@@ -0,0 +1,113 @@
+import os
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from spotify_advance.metrics import record_spotify_response
+
+# Connections kept alive per host, should be at least the number of threads calling Spotify
+DEFAULT_POOL_SIZE = 32
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (3.05, 15)
+
+# Transient server errors retried by the adapter. 429 is left to SpotifyAPI, which shares
+# the pause with every worker through its rate limiter instead of sleeping in one thread.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_shared: "SpotifySession | None" = None
+_lock = Lock()
+
+
+class SpotifySession(requests.Session):
+    """
+    requests session meant to be shared by every Spotify client of a process.
+
+    spotipy closes its session when a client is garbage collected, which would drop the pooled
+    keep-alive connections of every other client, so close() is a no-op and shutdown() closes.
+    """
+
+    def close(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        """Close the pooled connections."""
+        super().close()
+
+
+def build_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = 3,
+    backoff_factor: float = 0.3,
+    backoff_jitter: float = 0.5,
+    gzip: bool = True
+) -> SpotifySession:
+    """
+    Build a pooled session with retries on connection errors and transient 5xx responses.
+
+    Every response is recorded in the Spotify request metrics.
+
+    Args:
+        pool_size: Keep-alive connections per host
+        retries: Attempts after the first one
+        backoff_factor: Exponential backoff base in seconds
+        backoff_jitter: Random seconds added to every backoff, so workers do not retry in lockstep
+        gzip: Ask for compressed responses
+
+    Returns:
+        SpotifySession: Session to pass to SpotifyAPI
+    """
+    retry = Retry(
+        total=retries,
+        read=False,
+        allowed_methods=frozenset(["GET", "PUT", "DELETE"]),
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = SpotifySession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate" if gzip else "identity"
+    session.hooks["response"].append(record_spotify_response)
+    return session
+
+
+def shared_session() -> SpotifySession:
+    """Get the process-wide session, building it with the defaults on first use."""
+    global _shared
+    with _lock:
+        if _shared is None:
+            _shared = build_session()
+        return _shared
+
+
+def configure_shared_session(**options) -> SpotifySession:
+    """
+    Replace the process-wide session, e.g. to size the pool for a worker count.
+
+    Args:
+        **options: build_session arguments
+
+    Returns:
+        SpotifySession: The new shared session
+    """
+    global _shared
+    with _lock:
+        previous, _shared = _shared, build_session(**options)
+    if previous is not None:
+        previous.shutdown()
+    return _shared
+
+
+def _reset_after_fork() -> None:
+    # Pooled sockets inherited from the parent are shared with it, the child builds its own session
+    global _shared, _lock
+    _shared, _lock = None, Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,364 @@
+import cProfile
+import functools
+import inspect
+import io
+import pstats
+import random
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable
+from logging import getLogger
+from threading import Lock
+from time import perf_counter
+
+# Seconds, covering a cached lookup up to a slow aggregation or paginated Spotify pull
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Spotify IDs in request paths, replaced so every track or user does not get its own series
+SPOTIFY_ID = re.compile(r"^[0-9A-Za-z]{22}$")
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        pass
+
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._values.get(self._key(labels))
+        return series[2] if series else 0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = {key: (list(series[0]), series[1], series[2]) for key, series in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics of a process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._caches: dict[str, object] = {}
+
+    def counter(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, description, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, description, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_cache(self, name: str, cache: object) -> None:
+        """
+        Expose the stats() of a TTLCache or RedisCache, read at scrape time.
+
+        Args:
+            name: Value of the cache label
+            cache: Cache with a stats() method
+        """
+        self._caches[name] = cache
+
+    def _cache_lines(self) -> list[str]:
+        stats = {name: cache.stats() for name, cache in self._caches.items()}
+        lines = []
+        for field, kind, description in (
+            ("hits", "counter", "Cache lookups served from the cache"),
+            ("misses", "counter", "Cache lookups that missed"),
+            ("hit_ratio", "gauge", "Share of cache lookups served from the cache"),
+            ("size", "gauge", "Entries held by the cache"),
+        ):
+            metric = f"cache_{field}_total" if kind == "counter" else f"cache_{field}"
+            samples = [f'{metric}{{cache="{_escape(name)}"}} {values[field]}' for name, values in stats.items() if field in values]
+            if samples:
+                lines.extend([f"# HELP {metric} {description}", f"# TYPE {metric} {kind}", *samples])
+        return lines
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(self._cache_lines())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Latency of API requests", ("method", "route", "status"))
+MONGO_OPERATION_SECONDS = REGISTRY.histogram(
+    "mongo_operation_duration_seconds", "Latency of MongoDB handler methods", ("handler", "method", "status"))
+MONGO_DOCUMENTS = REGISTRY.counter(
+    "mongo_documents_total", "Documents returned or written by MongoDB handler methods", ("handler", "method", "status"))
+SPOTIFY_REQUEST_SECONDS = REGISTRY.histogram(
+    "spotify_request_duration_seconds", "Latency of Spotify Web API requests", ("endpoint", "status"))
+SPOTIFY_RATE_LIMITED = REGISTRY.counter(
+    "spotify_rate_limited_total", "Spotify responses with status 429", ("endpoint",))
+
+
+def _document_count(result: object) -> int:
+    """Number of documents in a handler return value, e.g. (list, message) or ({"inserted": n, ...}, message)."""
+    value = result
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], str):
+        value = result[0]
+        # Write counts, bare ints elsewhere are cursors such as high water marks
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    if value is None or isinstance(value, (bool, int)):
+        return 0
+    if isinstance(value, dict):
+        return value.get("inserted", value.get("written", 1))
+    if isinstance(value, list):
+        return len(value)
+    return 1
+
+
+def _status(result: object) -> str:
+    """ok, or error for a handler failure such as (None, "Failed to ...")."""
+    failed = isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], str) and result[0] is None
+    return "error" if failed else "ok"
+
+
+def _timed(handler_name: str, method_name: str, method: Callable) -> Callable:
+    labels = {"handler": handler_name, "method": method_name}
+
+    def record(start: float, documents: int, status: str) -> None:
+        MONGO_OPERATION_SECONDS.observe(perf_counter() - start, status=status, **labels)
+        MONGO_DOCUMENTS.inc(documents, status=status, **labels)
+
+    # Recorded in finally so raising calls are timed too, with status="error"
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start, documents, status = perf_counter(), 0, "error"
+            try:
+                async for doc in method(*args, **kwargs):
+                    documents += 1
+                    yield doc
+                status = "ok"
+            finally:
+                record(start, documents, status)
+    elif inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start, documents, status = perf_counter(), 0, "error"
+            try:
+                for doc in method(*args, **kwargs):
+                    documents += 1
+                    yield doc
+                status = "ok"
+            finally:
+                record(start, documents, status)
+    elif inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start, result, status = perf_counter(), None, "error"
+            try:
+                result = await method(*args, **kwargs)
+                status = _status(result)
+                return result
+            finally:
+                record(start, _document_count(result), status)
+    else:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start, result, status = perf_counter(), None, "error"
+            try:
+                result = method(*args, **kwargs)
+                status = _status(result)
+                return result
+            finally:
+                record(start, _document_count(result), status)
+    return wrapper
+
+
+def instrument_handler(cls: type) -> type:
+    """
+    Class decorator timing every public method of a MongoDB handler and counting its documents.
+
+    Generators count the documents they yield and are timed until exhausted or closed.
+    """
+    for name, method in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.isfunction(method):
+            setattr(cls, name, _timed(cls.__name__, name, method))
+    return cls
+
+
+def spotify_endpoint(url: str) -> str:
+    """Normalize a Spotify request URL into a low-cardinality label, e.g. api.spotify.com/v1/tracks/{id}."""
+    host, _, path = url.split("://", 1)[-1].partition("/")
+    segments = ["{id}" if SPOTIFY_ID.match(segment) else segment for segment in path.split("?", 1)[0].split("/")]
+    return "/".join([host, *segments])
+
+
+def record_spotify_response(response, *args, **kwargs) -> None:
+    """requests response hook recording Spotify call latency, status and 429s."""
+    endpoint = spotify_endpoint(response.request.url)
+    SPOTIFY_REQUEST_SECONDS.observe(response.elapsed.total_seconds(), endpoint=endpoint, status=response.status_code)
+    if response.status_code == 429:
+        SPOTIFY_RATE_LIMITED.inc(endpoint=endpoint)
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in profiler for a sample of requests, logging the hottest functions of the slow ones.
+
+    cProfile traces the event loop thread, so concurrent requests show up in the same profile;
+    only one request is profiled at a time and sample_rate bounds the overhead. A threshold_ms
+    of None disables profiling.
+    """
+
+    def __init__(self, threshold_ms: float | None = 500, sample_rate: float = 0.01, top: int = 20):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.top = top
+        self._active = False
+        self._logger = getLogger("spotify_advance.api")
+
+    def start(self) -> cProfile.Profile | None:
+        """Start profiling the current request if sampled and no other request is profiled."""
+        if self.threshold_ms is None or self._active or random.random() >= self.sample_rate:
+            return None
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile: cProfile.Profile, route: str, elapsed: float) -> None:
+        """Stop profiling and log the profile if the request was slow."""
+        profile.disable()
+        self._active = False
+        if elapsed * 1000 < self.threshold_ms:
+            return
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(self.top)
+        self._logger.warning(f"Slow request {route} took {elapsed * 1000:.0f}ms\n{output.getvalue()}")
+
+
+def route_template(scope) -> str:
+    """Path template of the route that handled a request, e.g. /tracks/{track_id}, unmatched if none did."""
+    route = scope.get("route")
+    if route is None and "endpoint" in scope and "app" in scope:
+        # Plain Starlette routes, such as FastAPI's /openapi.json and /docs, only set the endpoint
+        routes = getattr(scope["app"], "routes", [])
+        route = next((candidate for candidate in routes if getattr(candidate, "endpoint", None) is scope["endpoint"]), None)
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every request per route template and status.
+
+    Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app, profiler: SlowRequestProfiler | None = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profile = self.profiler.start() if self.profiler else None
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - start
+            # Set by the router once a route matched, unmatched paths share one series
+            route = route_template(scope)
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status)
+            if profile is not None:
+                self.profiler.stop(profile, route, elapsed)
@@ -0,0 +1,157 @@
+import asyncio
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import TypeVar
+
+T = TypeVar("T")
+
+# Pages fetched ahead of the consumer, bounding memory when writes are slower than Spotify
+DEFAULT_PREFETCH = 2
+
+# Seconds between checks of the stop flag while blocked on the buffer
+_POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Failure:
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class Prefetcher(Iterator[T]):
+    """
+    Iterate a blocking iterator while a background thread pulls up to depth items ahead.
+
+    The bounded buffer is the backpressure: once it is full the thread waits for the consumer,
+    so a slow consumer holds at most depth items plus the one being fetched. Errors raised by the
+    source are re-raised by the consumer, and close() stops the thread when iteration ends early.
+    """
+
+    def __init__(self, source: Iterable[T], depth: int = DEFAULT_PREFETCH):
+        self._buffer: Queue = Queue(maxsize=max(depth, 1))
+        self._stop = Event()
+        self._thread = Thread(target=self._produce, args=(iter(source),), name="prefetch", daemon=True)
+        self._thread.start()
+
+    def _put(self, item: object) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._buffer.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _produce(self, source: Iterator[T]) -> None:
+        try:
+            for item in source:
+                if not self._put(item):
+                    return
+            self._put(_DONE)
+        except BaseException as e:
+            self._put(_Failure(e))
+
+    def __next__(self) -> T:
+        while True:
+            try:
+                item = self._buffer.get(timeout=_POLL_INTERVAL)
+                break
+            except Empty:
+                if self._stop.is_set():
+                    raise StopIteration
+        if item is _DONE:
+            self._stop.set()
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self._stop.set()
+            raise item.error
+        return item
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def __enter__(self) -> "Prefetcher[T]":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+async def aprefetch(source: Iterable[T], depth: int = DEFAULT_PREFETCH) -> AsyncIterator[T]:
+    """
+    Iterate a blocking iterator from async code without blocking the event loop.
+
+    Args:
+        source: Blocking iterator, e.g. SpotifyAPI.iter_saved_tracks()
+        depth: Items pulled ahead by the background thread
+
+    Yields:
+        Items of the source, in order
+    """
+    with Prefetcher(source, depth) as prefetcher:
+        while (item := await asyncio.to_thread(next, prefetcher, _DONE)) is not _DONE:
+            yield item
+
+
+def _add_counts(totals: dict, records: list[dict], counts: dict | None, message: str) -> None:
+    if counts is None:
+        raise RuntimeError(message)
+    totals["pages"] += 1
+    totals["fetched"] += len(records)
+    totals["inserted"] += counts.get("inserted", 0)
+    totals["duplicates"] += counts.get("duplicates", 0)
+
+
+def store_pages(
+    pages: Iterable[list[dict]],
+    convert: Callable[[list[dict]], list[dict]],
+    write: Callable[[list[dict]], tuple[dict, str]],
+    depth: int = DEFAULT_PREFETCH
+) -> dict:
+    """
+    Convert and bulk-write each page while the next ones are fetched.
+
+    Network and database time overlap, and only the pages in the prefetch buffer are held in memory.
+
+    Args:
+        pages: Blocking page iterator, e.g. SpotifyAPI.iter_recently_played()
+        convert: Turns a page of Spotify items into handler records
+        write: Handler bulk write such as store_recently_played_many, returning (counts, message)
+        depth: Pages fetched ahead of the write
+
+    Returns:
+        dict: pages, fetched, inserted and duplicates totals
+
+    Raises:
+        RuntimeError: A write failed, pages before it are stored
+    """
+    totals = {"pages": 0, "fetched": 0, "inserted": 0, "duplicates": 0}
+    with Prefetcher(pages, depth) as prefetcher:
+        for page in prefetcher:
+            records = convert(page)
+            counts, message = write(records) if records else ({}, "")
+            _add_counts(totals, records, counts, message)
+    return totals
+
+
+async def astore_pages(
+    pages: AsyncIterable[list[dict]],
+    convert: Callable[[list[dict]], list[dict]],
+    write: Callable[[list[dict]], Awaitable[tuple[dict, str]]],
+) -> dict:
+    """
+    store_pages for async handlers, e.g. pages from SpotifyAPI.aiter_saved_tracks() written with
+    AsyncMongoDBHandler.store_saved_tracks_many. The async page iterators already prefetch.
+
+    Returns:
+        dict: pages, fetched, inserted and duplicates totals
+    """
+    totals = {"pages": 0, "fetched": 0, "inserted": 0, "duplicates": 0}
+    async for page in pages:
+        records = convert(page)
+        counts, message = await write(records) if records else ({}, "")
+        _add_counts(totals, records, counts, message)
+    return totals
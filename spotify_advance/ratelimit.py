@@ -0,0 +1,84 @@
+import time
+from collections.abc import Callable
+from threading import Lock
+from time import monotonic
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every Spotify client of a process.
+
+    Each request takes one token, tokens refill at a steady rate up to capacity. A 429 pauses
+    the whole bucket for its Retry-After, so other workers back off instead of piling on.
+    """
+
+    def __init__(
+        self,
+        rate: float = 5.0,
+        capacity: float | None = None,
+        clock: Callable[[], float] = monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = Lock()
+        self.waited = 0.0
+        self.pauses = 0
+
+    def _refill(self, now: float) -> None:
+        # Nothing accrues while paused, so a pause is not followed by a burst
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one may be
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if self._paused_until > now:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> float:
+        """
+        Block until a token is taken.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        waited = 0.0
+        while (delay := self.try_acquire()) > 0:
+            self._sleep(delay)
+            waited += delay
+        with self._lock:
+            self.waited += waited
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for a while, e.g. for the Retry-After of a 429.
+
+        Args:
+            seconds: Pause length from now, extends but never shortens a running pause
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, now + seconds)
+            self.pauses += 1
@@ -0,0 +1,199 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+import requests
+from spotipy import CacheHandler, MemoryCacheHandler
+
+from spotify_advance.apis.spotify import SpotifyAPI
+from spotify_advance.cache import TTLCache
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.http_session import shared_session
+from spotify_advance.ratelimit import TokenBucket
+from spotify_advance.sync import RecentlyPlayedSync, SavedTracksSync
+from spotify_advance.utils import datetime_to_unix_ms
+
+# Users who played something within this window are synced on the active interval
+ACTIVE_WINDOW_MS = 24 * 60 * 60 * 1000
+
+DEFAULT_ACTIVE_INTERVAL = 5 * 60
+DEFAULT_IDLE_INTERVAL = 60 * 60
+
+
+class MongoTokenCache(CacheHandler):
+    """spotipy cache handler keeping a user's OAuth token in MongoDB, so any worker can refresh it."""
+
+    def __init__(self, handler: MongoDBHandler, user_id: str):
+        self.handler = handler
+        self.user_id = user_id
+
+    def get_cached_token(self) -> dict | None:
+        return self.handler.get_token(self.user_id)
+
+    def save_token_to_cache(self, token_info: dict) -> None:
+        self.handler.save_token(self.user_id, token_info)
+
+
+def register_user(client_data: dict, handler: MongoDBHandler) -> str:
+    """
+    Run the interactive OAuth flow and store the resulting token for the scheduler.
+
+    Args:
+        client_data: Spotify client_id, client_secret and redirect_uri
+        handler: MongoDB handler
+
+    Returns:
+        str: Spotify user ID of the authorized user
+    """
+    cache_handler = MemoryCacheHandler()
+    spotify_api = SpotifyAPI(**client_data, cache_handler=cache_handler)
+    user_id = spotify_api.user_id
+    handler.save_token(user_id, cache_handler.get_cached_token())
+    return user_id
+
+
+class SyncScheduler:
+    """
+    Sync the recently played and saved tracks of every user with a stored token.
+
+    Users are synced on a worker pool, each with their own Spotify client and Mongo-backed token
+    cache, while all clients share one token bucket so the process as a whole stays within
+    Spotify's rate limit, and one pooled HTTP session so connections are kept alive across users.
+    Users who listened recently are synced more often and first.
+    """
+
+    STREAMS = (RecentlyPlayedSync, SavedTracksSync)
+
+    def __init__(
+        self,
+        handler: MongoDBHandler,
+        client_data: dict,
+        workers: int = 8,
+        rate_limiter: TokenBucket = None,
+        active_interval: float = DEFAULT_ACTIVE_INTERVAL,
+        idle_interval: float = DEFAULT_IDLE_INTERVAL,
+        http_session: requests.Session = None
+    ):
+        self.handler = handler
+        self.client_data = client_data
+        self.workers = workers
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket()
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.http_session = http_session if http_session is not None else shared_session()
+        self.cache = TTLCache(max_size=1024)
+        self._logger = getLogger("spotify_advance.sync")
+
+    def _states(self) -> dict[tuple[str, str], dict]:
+        return {(state["user_id"], state["stream"]): state for state in self.handler.get_sync_states()}
+
+    def due_users(self, now: float = None) -> list[str]:
+        """
+        Get the users whose sync interval elapsed, active users first, then the stalest.
+
+        Args:
+            now: Unix time in seconds, defaults to the current time
+
+        Returns:
+            list[str]: Spotify user IDs in sync order
+        """
+        now_ms = int((now if now is not None else time.time()) * 1000)
+        states = self._states()
+        due = []
+        for user_id in self.handler.get_token_user_ids():
+            user_states = [states.get((user_id, sync.STREAM), {}) for sync in self.STREAMS]
+            last_runs = [state.get("last_run_at") for state in user_states]
+            last_run_ms = min(datetime_to_unix_ms(last_run) for last_run in last_runs) if all(last_runs) else 0
+
+            newest_play = states.get((user_id, RecentlyPlayedSync.STREAM), {}).get("high_water_mark")
+            active = newest_play is not None and now_ms - newest_play <= ACTIVE_WINDOW_MS
+            interval_ms = (self.active_interval if active else self.idle_interval) * 1000
+            if now_ms - last_run_ms >= interval_ms:
+                due.append((not active, last_run_ms, user_id))
+        return [user_id for _, _, user_id in sorted(due)]
+
+    def client(self, user_id: str) -> SpotifyAPI:
+        """Build a Spotify client authorized as the user, sharing the rate limiter."""
+        return SpotifyAPI(
+            **self.client_data,
+            cache=self.cache,
+            cache_handler=MongoTokenCache(self.handler, user_id),
+            rate_limiter=self.rate_limiter,
+            http_session=self.http_session)
+
+    def sync_user(self, user_id: str) -> dict:
+        """
+        Run every stream sync of a user, recording each outcome in sync_state.
+
+        Args:
+            user_id: Spotify user ID
+
+        Returns:
+            dict: Result of each stream, or its error under "error"
+        """
+        results = {}
+        spotify_api = self.client(user_id)
+        # Refreshes an expired token; without a usable one spotipy would fall back to the interactive flow
+        if spotify_api.auth_manager.validate_token(spotify_api.auth_manager.cache_handler.get_cached_token()) is None:
+            for sync in self.STREAMS:
+                self.handler.record_sync(user_id, sync.STREAM, "No valid token")
+            self._logger.error(f"No valid token for user: {user_id}")
+            return {sync.STREAM: {"error": "No valid token"} for sync in self.STREAMS}
+
+        for sync in self.STREAMS:
+            try:
+                results[sync.STREAM] = sync(spotify_api, self.handler).run(user_id)
+                self.handler.record_sync(user_id, sync.STREAM)
+            except Exception as e:
+                self._logger.error(f"Failed to sync {sync.STREAM} for user: {user_id}: {str(e)}")
+                self.handler.record_sync(user_id, sync.STREAM, str(e))
+                results[sync.STREAM] = {"error": str(e)}
+        return results
+
+    def run_once(self) -> dict[str, dict]:
+        """
+        Sync every due user on the worker pool.
+
+        Returns:
+            dict: Per-user results keyed on user ID
+        """
+        user_ids = self.due_users()
+        if not user_ids:
+            return {}
+        self._logger.info(f"Syncing {len(user_ids)} users on {self.workers} workers")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip(user_ids, executor.map(self.sync_user, user_ids)))
+
+    def run_forever(self, poll_interval: float = 30) -> None:
+        """Sync due users, then poll again after poll_interval seconds, until interrupted."""
+        while True:
+            self.run_once()
+            time.sleep(poll_interval)
+
+    def lag(self, now: float = None) -> list[dict]:
+        """
+        Report how far behind every user's streams are.
+
+        Args:
+            now: Unix time in seconds, defaults to the current time
+
+        Returns:
+            list[dict]: user_id, stream, seconds since the last successful sync (None if never),
+                seconds since the newest synced item and the last error, most lagging first
+        """
+        now_ms = int((now if now is not None else time.time()) * 1000)
+        states = self._states()
+        report = []
+        for user_id in self.handler.get_token_user_ids():
+            for sync in self.STREAMS:
+                state = states.get((user_id, sync.STREAM), {})
+                last_success = state.get("last_success_at")
+                newest = state.get("high_water_mark")
+                report.append({
+                    "user_id": user_id,
+                    "stream": sync.STREAM,
+                    "lag_seconds": (now_ms - datetime_to_unix_ms(last_success)) / 1000 if last_success else None,
+                    "newest_item_age_seconds": (now_ms - newest) / 1000 if newest is not None else None,
+                    "last_error": state.get("last_error"),
+                })
+        return sorted(report, key=lambda row: (row["lag_seconds"] is not None, -(row["lag_seconds"] or 0)))
@@ -0,0 +1,113 @@
+from collections import Counter
+from datetime import datetime, timezone
+
+from spotify_advance.handlers.similarity import CO_LISTEN_WINDOW, pair_counts
+from spotify_advance.utils import datetime_to_unix_ms
+
+# Default inactivity between the end of a track and the next play that closes a session
+DEFAULT_GAP_MS = 30 * 60 * 1000
+
+# A play counts as skipped when the next one starts before this share of its duration
+SKIP_RATIO = 0.5
+
+
+def _from_unix_ms(unix_ms: int) -> datetime:
+    return datetime.fromtimestamp(unix_ms / 1000, tz=timezone.utc)
+
+
+class SessionBuilder:
+    """
+    Single-pass listening-session detection over plays sorted by played_at.
+
+    A new session starts when the time between the end of the previous track (its played_at
+    plus its duration, when known from enrichment) and the next play exceeds the gap.
+    Starting from the user's last stored session lets new plays extend it instead of
+    reprocessing the whole history. Tracks joining a session are paired with the session's
+    previous distinct tracks for the co-listening index, unless pair_tracks is off (e.g. when
+    reprocessing plays whose pairs were already counted). Plays at or before pair_after are
+    only sessionized, their pairs having been counted by an earlier run.
+    """
+
+    def __init__(self, user_id: str, gap_ms: int = DEFAULT_GAP_MS, last_session: dict = None, pair_tracks: bool = True,
+                 pair_after: datetime | None = None):
+        self.user_id = user_id
+        self.gap_ms = gap_ms
+        self.pair_tracks = pair_tracks
+        self._pair_after_ms = datetime_to_unix_ms(pair_after) if pair_after is not None else None
+        self._open = {key: value for key, value in last_session.items() if key != "_id"} if last_session else None
+        self._touched: list[dict] = []
+        self.pairs = Counter()
+        if self._open:
+            self._open["track_ids"] = list(self._open["track_ids"])
+            self._last_ms = datetime_to_unix_ms(self._open["end"])
+
+    def add(self, played_at: datetime, track_id: str, duration_ms: int | None) -> None:
+        """
+        Add the next play in time order.
+
+        Args:
+            played_at: Play time
+            track_id: Spotify track ID
+            duration_ms: Track duration, None if the track was not enriched
+        """
+        played_ms = datetime_to_unix_ms(played_at)
+        session = self._open
+        if session is not None:
+            last_duration = session["last_duration_ms"] or 0
+            if played_ms - (self._last_ms + last_duration) > self.gap_ms:
+                session = None
+
+        if session is None:
+            session = {
+                "user_id": self.user_id,
+                "start": _from_unix_ms(played_ms),
+                "plays": 0,
+                "track_ids": [],
+                "skips": 0,
+                "repeats": 0,
+                "transitions": 0,
+                "listened_ms": 0,
+                "last_track_id": None,
+                "last_duration_ms": None,
+            }
+            self._open = session
+        else:
+            if session["last_duration_ms"] and played_ms - self._last_ms < session["last_duration_ms"] * SKIP_RATIO:
+                session["skips"] += 1
+            if track_id == session["last_track_id"]:
+                session["repeats"] += 1
+            else:
+                session["transitions"] += 1
+
+        session["plays"] += 1
+        session["end"] = _from_unix_ms(played_ms)
+        if track_id not in session["track_ids"]:
+            if self.pair_tracks and (self._pair_after_ms is None or played_ms > self._pair_after_ms):
+                self.pairs.update(pair_counts(track_id, session["track_ids"][-CO_LISTEN_WINDOW:]))
+            session["track_ids"].append(track_id)
+        session["listened_ms"] += duration_ms or 0
+        session["last_track_id"] = track_id
+        session["last_duration_ms"] = duration_ms
+        self._last_ms = played_ms
+        if not self._touched or self._touched[-1] is not session:
+            self._touched.append(session)
+
+    def drain(self) -> tuple[list[dict], Counter]:
+        """
+        Return the sessions created or extended since the last drain, with derived fields.
+
+        Returns:
+            tuple: Session documents keyed on (user_id, start) and the co-listening increments
+        """
+        touched, self._touched = self._touched, []
+        pairs, self.pairs = self.pairs, Counter()
+        return [
+            {
+                **session,
+                "length_ms": datetime_to_unix_ms(session["end"]) - datetime_to_unix_ms(session["start"])
+                + (session["last_duration_ms"] or 0),
+                "unique_tracks": len(session["track_ids"]),
+                "skip_rate": session["skips"] / max(session["plays"] - 1, 1),
+            }
+            for session in touched
+        ], pairs
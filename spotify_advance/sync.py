@@ -0,0 +1,246 @@
+import time
+from logging import getLogger
+
+from spotify_advance.apis.spotify import SpotifyAPI
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.pipeline import DEFAULT_PREFETCH, Prefetcher, store_pages
+from spotify_advance.utils import datetime_to_unix_ms, parse_spotify_datetime
+
+# Full passes over a saved library, the only way removals are noticed
+DEFAULT_RECONCILE_INTERVAL_MS = 24 * 60 * 60 * 1000
+
+
+def play_records(user_id: str, items: list[dict]) -> list[dict]:
+    """Convert Spotify play history items into recently_played records."""
+    return [
+        {
+            "user_id": user_id,
+            "track_id": item['track']['id'],
+            "played_at": parse_spotify_datetime(item['played_at']),
+        }
+        for item in items
+    ]
+
+
+def saved_track_records(user_id: str, items: list[dict]) -> list[dict]:
+    """Convert Spotify saved track items into saved_tracks records."""
+    return [
+        {
+            "user_id": user_id,
+            "track_id": item['track']['id'],
+            "added_at": parse_spotify_datetime(item['added_at']),
+        }
+        for item in items
+    ]
+
+
+def _dry_run_write(records: list[dict]) -> tuple[dict, str]:
+    return {"inserted": 0, "duplicates": 0}, "Dry run"
+
+
+class _Watermark:
+    """Page converter also tracking the newest timestamp of the converted records."""
+
+    def __init__(self, convert, user_id: str, field: str, start: int | None):
+        self.convert = convert
+        self.user_id = user_id
+        self.field = field
+        self.newest = start
+
+    def __call__(self, items: list[dict]) -> list[dict]:
+        records = self.convert(self.user_id, items)
+        for record in records:
+            self.newest = max(datetime_to_unix_ms(record[self.field]), self.newest or 0)
+        return records
+
+
+class RecentlyPlayedSync:
+    """
+    Incrementally copy a user's Spotify play history into MongoDB.
+
+    The newest synced played_at is kept per user in the sync_state collection, so every
+    run only asks Spotify for plays after it. Each page is bulk-written while the next one is
+    fetched, and the cursor only moves once every page is stored. New plays then extend the
+    user's sessions, which feeds the co-listening index.
+    """
+
+    STREAM = "recently_played"
+
+    def __init__(self, spotify_api: SpotifyAPI, handler: MongoDBHandler, prefetch: int = DEFAULT_PREFETCH):
+        self.spotify_api = spotify_api
+        self.handler = handler
+        self.prefetch = prefetch
+        self._logger = getLogger("spotify_advance.sync")
+
+    def run(self, user_id: str, backfill: bool = False, dry_run: bool = False) -> dict:
+        """
+        Sync new plays for a user.
+
+        Args:
+            user_id: Spotify user ID
+            backfill: Ignore the stored cursor and fetch all history Spotify still returns
+            dry_run: Fetch and count plays without writing anything
+
+        Returns:
+            dict: fetched, inserted and duplicates counts and the resulting high_water_mark
+        """
+        high_water_mark = None if backfill else self.handler.get_high_water_mark(user_id, self.STREAM)
+        convert = _Watermark(play_records, user_id, "played_at", high_water_mark)
+        write = _dry_run_write if dry_run else self.handler.store_recently_played_many
+        totals = store_pages(self.spotify_api.iter_recently_played(after=high_water_mark), convert, write, self.prefetch)
+
+        result = {
+            "fetched": totals["fetched"], "inserted": totals["inserted"], "duplicates": totals["duplicates"],
+            "high_water_mark": convert.newest}
+        if not totals["fetched"]:
+            self._logger.info(f"No new plays for user: {user_id}")
+            return result
+        if dry_run:
+            self._logger.info(f"Dry run, would store {totals['fetched']} plays for user: {user_id}")
+            return result
+
+        self.handler.set_high_water_mark(user_id, self.STREAM, result["high_water_mark"])
+        if totals["inserted"]:
+            self.handler.update_sessions(user_id)
+        self._logger.info(
+            f"Synced {totals['inserted']} new plays for user: {user_id} ({totals['duplicates']} duplicates)")
+        return result
+
+
+class SavedTracksSync:
+    """
+    Differentially copy a user's saved tracks into MongoDB.
+
+    Spotify returns the library newest first, so a routine run pages only until the newest
+    added_at already synced, kept per user in the sync_state collection, usually one or two
+    pages. Pages are written as they arrive, so a full backfill holds a few pages in memory,
+    not the library.
+
+    Paging from the top never sees removals or tracks saved again, so every reconcile_interval_ms
+    a run instead reads the whole library and diffs it against the stored saved tracks.
+    """
+
+    STREAM = "saved_tracks"
+    # Its high water mark is the Unix time in milliseconds of the last full reconcile
+    RECONCILE_STREAM = "saved_tracks_reconcile"
+
+    def __init__(
+        self,
+        spotify_api: SpotifyAPI,
+        handler: MongoDBHandler,
+        prefetch: int = DEFAULT_PREFETCH,
+        reconcile_interval_ms: int = DEFAULT_RECONCILE_INTERVAL_MS
+    ):
+        self.spotify_api = spotify_api
+        self.handler = handler
+        self.prefetch = prefetch
+        self.reconcile_interval_ms = reconcile_interval_ms
+        self._logger = getLogger("spotify_advance.sync")
+
+    def run(self, user_id: str, backfill: bool = False, dry_run: bool = False, reconcile: bool | None = None) -> dict:
+        """
+        Sync newly saved tracks for a user, or reconcile the whole library when due.
+
+        Args:
+            user_id: Spotify user ID
+            backfill: Ignore the stored cursor and fetch the whole library
+            dry_run: Fetch and count tracks without writing anything
+            reconcile: Force or skip a full reconcile, by default it runs once reconcile_interval_ms elapsed
+
+        Returns:
+            dict: fetched, inserted and duplicates counts and the resulting high_water_mark,
+                see reconcile() for a reconcile run
+        """
+        if reconcile or (reconcile is None and not backfill and self.reconcile_due(user_id)):
+            return self.reconcile(user_id, dry_run)
+
+        high_water_mark = None if backfill else self.cursor(user_id)
+        convert = _Watermark(saved_track_records, user_id, "added_at", high_water_mark)
+        write = _dry_run_write if dry_run else self.handler.store_saved_tracks_many
+        totals = store_pages(self.spotify_api.iter_saved_tracks(after=high_water_mark), convert, write, self.prefetch)
+
+        result = {
+            "fetched": totals["fetched"], "inserted": totals["inserted"], "duplicates": totals["duplicates"],
+            "high_water_mark": convert.newest}
+        if not totals["fetched"]:
+            self._logger.info(f"No new saved tracks for user: {user_id}")
+            return result
+        if dry_run:
+            self._logger.info(f"Dry run, would store {totals['fetched']} saved tracks for user: {user_id}")
+            return result
+
+        self.handler.set_high_water_mark(user_id, self.STREAM, result["high_water_mark"])
+        self._logger.info(
+            f"Synced {totals['inserted']} new saved tracks for user: {user_id} ({totals['duplicates']} duplicates)")
+        return result
+
+    def cursor(self, user_id: str) -> int | None:
+        """
+        Get the added_at paging stops at: the sync cursor, or the newest stored track if the
+        stream was never synced, e.g. when tracks were stored through the API.
+
+        Returns:
+            int: Unix time in milliseconds, None if nothing is stored
+        """
+        high_water_mark = self.handler.get_high_water_mark(user_id, self.STREAM)
+        if high_water_mark is None:
+            newest = self.handler.get_newest_added_at(user_id)
+            high_water_mark = datetime_to_unix_ms(newest) if newest else None
+        return high_water_mark
+
+    def reconcile_due(self, user_id: str, now_ms: int = None) -> bool:
+        """Check whether the user's library was never reconciled or not within reconcile_interval_ms."""
+        last_reconcile = self.handler.get_high_water_mark(user_id, self.RECONCILE_STREAM)
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        return last_reconcile is None or now_ms - last_reconcile >= self.reconcile_interval_ms
+
+    def reconcile(self, user_id: str, dry_run: bool = False) -> dict:
+        """
+        Fetch the whole library and apply the differences with the stored saved tracks: tracks missing
+        from MongoDB are inserted, tracks saved again since they were stored get their new added_at and
+        unsaved ones are removed, in one bulk write.
+
+        Args:
+            user_id: Spotify user ID
+            dry_run: Fetch and count the differences without writing anything
+
+        Returns:
+            dict: fetched, inserted, updated and removed counts, the resulting high_water_mark and reconciled=True
+        """
+        started_ms = int(time.time() * 1000)
+        library: dict[str, dict] = {}
+        with Prefetcher(self.spotify_api.iter_saved_tracks(), self.prefetch) as pages:
+            for page in pages:
+                for record in saved_track_records(user_id, page):
+                    library[record['track_id']] = record
+
+        stored, message = self.handler.get_saved_track_added_at(user_id)
+        if stored is None:
+            raise RuntimeError(message)
+        # New tracks and tracks saved again since they were stored, the latter keeping their document
+        added = [
+            record for track_id, record in library.items()
+            if track_id not in stored or datetime_to_unix_ms(stored[track_id]) != datetime_to_unix_ms(record['added_at'])
+        ]
+        removed = sorted(stored.keys() - library.keys())
+
+        newest = max((datetime_to_unix_ms(record['added_at']) for record in library.values()), default=None)
+        result = {
+            "fetched": len(library), "inserted": 0, "updated": 0, "removed": 0, "high_water_mark": newest,
+            "reconciled": True}
+        if dry_run:
+            self._logger.info(
+                f"Dry run, would upsert {len(added)} and remove {len(removed)} saved tracks for user: {user_id}")
+            return result
+
+        counts, message = self.handler.apply_saved_tracks_delta(user_id, added, removed)
+        if counts is None:
+            raise RuntimeError(message)
+        result.update(counts)
+        if newest is not None:
+            self.handler.set_high_water_mark(user_id, self.STREAM, newest)
+        self.handler.set_high_water_mark(user_id, self.RECONCILE_STREAM, started_ms)
+        self._logger.info(
+            f"Reconciled saved tracks for user: {user_id}: {counts['inserted']} inserted, "
+            f"{counts['updated']} updated, {counts['removed']} removed")
+        return result
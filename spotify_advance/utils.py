@@ -40,3 +40,33 @@ def get_one_week_before() -> int:
     # 7 days * 24 hours * 60 minutes * 60 seconds
     one_week_ago = current_time.timestamp() - (7 * 24 * 60 * 60)
     return int(one_week_ago)
+
+
+def parse_spotify_datetime(datetime_str: str) -> datetime:
+    """
+    Parse a Spotify timestamp such as '2024-01-01T12:00:00.123Z' or '2024-01-01T12:00:00Z'.
+
+    Args:
+        datetime_str: The datetime string to parse.
+
+    Returns:
+        Timezone-aware UTC datetime.
+    """
+    return datetime.fromisoformat(datetime_str.replace("Z", "+00:00"))
+
+
+def datetime_to_unix_ms(dt: datetime) -> int:
+    """
+    Convert a datetime to Unix time in milliseconds, as used by Spotify's cursors.
+
+    Naive datetimes (as returned by MongoDB) are treated as UTC.
+
+    Args:
+        dt: The datetime to convert.
+
+    Returns:
+        Unix time in milliseconds.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
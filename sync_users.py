@@ -0,0 +1,43 @@
+import json
+from argparse import ArgumentParser
+
+from spotify_advance.apis import get_client_data, get_mongodb_data
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.http_session import DEFAULT_POOL_SIZE, configure_shared_session
+from spotify_advance.ratelimit import TokenBucket
+from spotify_advance.scheduler import SyncScheduler, register_user
+
+
+def main():
+    parser = ArgumentParser(description="Sync recently played and saved tracks of every registered user")
+    parser.add_argument("--register", action="store_true",
+                        help="authorize a user interactively and store their token")
+    parser.add_argument("--once", action="store_true",
+                        help="sync the due users once instead of polling forever")
+    parser.add_argument("--lag", action="store_true",
+                        help="print the per-user sync lag and exit")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="number of users synced in parallel")
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="Spotify requests per second shared by all workers")
+    args = parser.parse_args()
+
+    handler = MongoDBHandler(get_mongodb_data()['uri'])
+    if args.register:
+        print(f"Registered user: {register_user(get_client_data(), handler)}")
+        return
+
+    # Every worker holds a connection, a smaller pool would discard and reopen them
+    http_session = configure_shared_session(pool_size=max(args.workers, DEFAULT_POOL_SIZE))
+    scheduler = SyncScheduler(handler, get_client_data(), workers=args.workers, rate_limiter=TokenBucket(rate=args.rate),
+                              http_session=http_session)
+    if args.lag:
+        print(json.dumps(scheduler.lag(), indent=2))
+    elif args.once:
+        print(json.dumps(scheduler.run_once(), indent=2, default=str))
+    else:
+        scheduler.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,27 @@
-from pytest import fixture
+from pytest import FixtureRequest, fixture, skip
 
-from spotify_advance.apis import client_data
+from spotify_advance.apis import get_client_data
 from spotify_advance.apis.spotify import SpotifyAPI
+from tests.helpers import FixtureAdapter, fixture_spotify_api
 
 
-@fixture(name="spotify_api", scope="session", autouse=True)
+# Live Spotify fixtures, requested only by the tests that talk to Spotify and MongoDB,
+# so the offline tests run without credentials
+@fixture(name="spotify_api", scope="session")
 def spotify_api_fixture() -> SpotifyAPI:
+    client_data = get_client_data()
+    if not client_data.get("client_id") or not client_data.get("client_secret"):
+        skip("Spotify credentials are not configured")
     return SpotifyAPI(**client_data)
 
 
-@fixture(name="user_id", scope="session", autouse=True)
+@fixture(name="user_id", scope="session")
 def user_id_fixture(spotify_api: SpotifyAPI) -> str:
     return spotify_api.current_user['id']
+
+
+# Offline client replaying recorded pages, parametrized indirectly with fixture_spotify_api's
+# arguments, e.g. @mark.parametrize("fixture_api", [{"pages": 4}], indirect=True)
+@fixture(name="fixture_api")
+def fixture_api_fixture(request: FixtureRequest) -> tuple[SpotifyAPI, FixtureAdapter]:
+    return fixture_spotify_api(**getattr(request, "param", {}))
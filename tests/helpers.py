@@ -0,0 +1,175 @@
+import copy
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from spotipy import MemoryCacheHandler
+
+from spotify_advance.apis.spotify import MAX_PAGE_SIZE, SpotifyAPI
+from spotify_advance.http_session import SpotifySession, build_session
+from spotify_advance.utils import datetime_to_unix_ms, parse_spotify_datetime
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+API_URL = "https://api.spotify.com/v1/"
+
+SCOPES = "user-read-email user-library-read user-top-read user-read-recently-played"
+
+START = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json")) as f:
+        return json.load(f)
+
+
+def fixture_id(index: int) -> str:
+    """A 22 character base62-looking ID unique per index."""
+    return f"{index:022d}"
+
+
+def _spotify_time(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class FixtureAdapter(HTTPAdapter):
+    """
+    Transport adapter replaying recorded Spotify pages, so clients page through a library of any
+    size without network access.
+
+    Recorded items are cycled with fresh track IDs and timestamps, one page per request, and
+    bodies are serialized once per URL so the measured time is the client's, not the fixture's.
+    """
+
+    def __init__(self, pages: int = 20, track_pool: int = 5000):
+        super().__init__()
+        self.pages = pages
+        self.requests = 0
+        self._current_user = json.dumps(load_fixture("current_user")).encode()
+        self._recently_played = self._build_pages(load_fixture("recently_played_page"), "played_at", track_pool)
+        # Saved tracks are served by offset and limit, so kept as one list
+        saved_pages = self._build_pages(load_fixture("saved_tracks_page"), "added_at", track_pool)
+        self._saved_tracks = [item for page in saved_pages for item in page]
+        self._bodies: dict[str, bytes] = {}
+
+    def _build_pages(self, recorded: dict, time_field: str, track_pool: int) -> list[list[dict]]:
+        templates = recorded["items"]
+        pages = []
+        for page in range(self.pages):
+            items = []
+            for offset in range(MAX_PAGE_SIZE):
+                index = page * MAX_PAGE_SIZE + offset
+                item = copy.deepcopy(templates[index % len(templates)])
+                item["track"]["id"] = fixture_id(index % track_pool)
+                item["track"]["uri"] = f"spotify:track:{item['track']['id']}"
+                # Newest first, like both endpoints
+                item[time_field] = _spotify_time(START - timedelta(minutes=3 * index))
+                items.append(item)
+            pages.append(items)
+        return pages
+
+    def _body(self, url: str) -> dict | bytes:
+        parsed = urlparse(url)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        path = parsed.path.removeprefix("/v1/").rstrip("/")
+        if path == "me":
+            return self._current_user
+        if path == "me/player/recently-played" and "after" in query:
+            # Like Spotify, a cursor query only returns the plays after it, here in a single page
+            after = int(query["after"])
+            return {
+                "items": [item for page in self._recently_played for item in page
+                          if datetime_to_unix_ms(parse_spotify_datetime(item["played_at"])) > after],
+                "next": None,
+                "cursors": None,
+                "limit": MAX_PAGE_SIZE,
+            }
+        if path == "me/player/recently-played":
+            page = int(query.get("page", 0))
+            has_next = page + 1 < self.pages
+            return {
+                "items": self._recently_played[page],
+                "next": f"{API_URL}me/player/recently-played?limit={MAX_PAGE_SIZE}&page={page + 1}" if has_next else None,
+                "cursors": None,
+                "limit": MAX_PAGE_SIZE,
+            }
+        if path == "me/tracks":
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 20))
+            total = len(self._saved_tracks)
+            has_next = offset + limit < total
+            return {
+                "items": self._saved_tracks[offset:offset + limit],
+                "next": f"{API_URL}me/tracks?offset={offset + limit}&limit={limit}" if has_next else None,
+                "offset": offset,
+                "limit": limit,
+                "total": total,
+            }
+        # Not a ValueError, which spotipy would swallow as an empty body
+        raise LookupError(f"No fixture for {url}")
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        self.requests += 1
+        body = self._bodies.get(request.url)
+        if body is None:
+            body = self._body(request.url)
+            body = self._bodies[request.url] = body if isinstance(body, bytes) else json.dumps(body).encode()
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        response.headers["Content-Type"] = "application/json"
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+
+def fixture_session(pages: int = 20) -> tuple[SpotifySession, FixtureAdapter]:
+    """Build a production-configured session whose Spotify API traffic is served by a FixtureAdapter."""
+    session = build_session()
+    adapter = FixtureAdapter(pages)
+    session.mount(API_URL, adapter)
+    return session, adapter
+
+
+def fixture_spotify_api(pages: int = 20, **kwargs) -> tuple[SpotifyAPI, FixtureAdapter]:
+    """
+    Build a SpotifyAPI authorized with a fake token and backed by recorded pages.
+
+    Args:
+        pages: Pages of 50 items returned by the paginated endpoints
+        **kwargs: Extra SpotifyAPI arguments
+
+    Returns:
+        tuple: Client and the adapter serving it
+    """
+    session, adapter = fixture_session(pages)
+    token = {
+        "access_token": "fixture",
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "expires_at": int(time.time()) + 86400,
+        "refresh_token": "fixture",
+        "scope": SCOPES,
+    }
+    spotify_api = SpotifyAPI(
+        "fixture-client", "fixture-secret", "http://localhost:8080/callback",
+        cache_handler=MemoryCacheHandler(token), http_session=session, **kwargs)
+    return spotify_api, adapter
+
+
+class FakeClock:
+    """Manually advanced monotonic clock, usable as both the clock and the sleep of the code under test."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
@@ -15,10 +15,14 @@ class MongoDBAPI:
     def __init__(self) -> None:
         self.url = "http://localhost:8000/"
 
-    def get_recently_played(self, user_id: str, limit: int = 20) -> list[TrackRecord]:
+    def get_recently_played(self, user_id: str, limit: int = 20, after: str = None) -> tuple[list[TrackRecord], str]:
+        params = {"limit": limit}
+        if after:
+            params["after"] = after
         response = requests.get(
-            f"{self.url}/recently_played/{user_id}?limit={limit}")
-        return [TrackRecord(**item) for item in response.json()]
+            f"{self.url}/recently_played/{user_id}", params=params)
+        page = response.json()
+        return [TrackRecord(**item) for item in page["items"]], page["next"]
 
     def store_recently_played(self, user_id: str, track_id: str, played_at: datetime) -> None:
         response = requests.post(f"{self.url}/recently_played", json={
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+from spotify_advance.analytics import HistoryFrame
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class TestHistoryFrame:
+
+    def setup_method(self):
+        hours = [100, 0, 1, 2, 30, 50]
+        self.frame = HistoryFrame.from_records(
+            [START + timedelta(hours=hour) for hour in hours],
+            ["b", "a", "b", "a", "c", "a"],
+            ["Y", "X", "Y", "X", "Z", "X"])
+
+    def test_sorted_by_played_at(self):
+        assert (self.frame.played_at[1:] >= self.frame.played_at[:-1]).all(), "Expected plays sorted by time"
+
+    def test_top_k(self):
+        assert self.frame.top_k(2) == [("a", 3), ("b", 2)], "Expected the 2 most played tracks"
+        assert self.frame.top_k(1, by="artist") == [("X", 3)], "Expected the most played artist"
+
+    def test_bucket_by_day(self):
+        _, counts = self.frame.bucket("day")
+        assert counts.tolist() == [3, 1, 1, 1], "Expected plays per day"
+
+    def test_rolling_count(self):
+        counts = self.frame.rolling_count(2 * 60 * 60 * 1000)
+        assert counts.tolist() == [1, 2, 2, 1, 1, 1], "Expected plays in the trailing 2 hours"
+
+    def test_longest_streak(self):
+        assert self.frame.longest_streak() == 3, "Expected 3 consecutive days"
+
+    def test_mixed_time_inputs(self):
+        frame = HistoryFrame.from_records(
+            [START.replace(tzinfo=None), "2024-01-01T01:00:00.500Z",
+             datetime(2024, 1, 1, 4, tzinfo=timezone(timedelta(hours=2)))], ["a", "b", "c"])
+        assert frame.played_at.tolist() == [1704067200000, 1704067200000 + 3600500, 1704067200000 + 7200000], \
+            "Expected naive datetimes as UTC and aware ones and strings normalized"
+
+    def test_between(self):
+        frame = self.frame.between(START + timedelta(hours=1), START + timedelta(hours=50))
+        assert len(frame) == 3 and isinstance(frame, HistoryFrame), "Expected the plays in [start, end)"
+        assert frame.group_counts() == {"a": 1, "b": 1, "c": 1}, "Expected the slice's own plays only"
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from spotify_advance.apis.mongodb import create_app, get_handler, gzip_chunks, ndjson_lines
+
+START = datetime(2024, 1, 1)
+
+
+class FakeHandler:
+
+    def __init__(self, history: list[dict] = ()):
+        self.stored = []
+        self.history = list(history)
+
+    async def iter_user_history(self, user_id, batch_size=1000):
+        for doc in self.history:
+            yield dict(doc)
+
+    async def store_saved_track(self, user_id, track_id, added_at):
+        self.stored.append((user_id, track_id, added_at))
+        return True, "Saved track stored successfully"
+
+    async def store_saved_tracks_many(self, records):
+        self.stored.extend(records)
+        return {"inserted": len(records), "duplicates": 0}, "Saved tracks stored successfully"
+
+
+class TestWriteRoutes:
+
+    def setup_method(self):
+        self.handler = FakeHandler()
+        app = create_app()
+        app.dependency_overrides[get_handler] = lambda: self.handler
+        self.client = TestClient(app)
+
+    def test_saved_track_without_id(self):
+        response = self.client.post("/saved_tracks", json={
+            "user_id": "user", "track_id": "track", "added_at": "2024-01-01T00:00:00Z"})
+        assert response.status_code == 200
+        assert "_id" not in response.json(), "Expected no ObjectId in the response"
+
+    def test_client_id_rejected(self):
+        body = {"_id": "65a000000000000000000000", "user_id": "user", "track_id": "track", "added_at": "2024-01-01T00:00:00Z"}
+        assert self.client.post("/saved_tracks", json=body).status_code == 422, "Expected a client _id to be rejected"
+        assert self.client.post("/saved_tracks/batch", json=[body]).status_code == 422
+        assert not self.handler.stored, "Expected nothing stored"
+
+    def test_schema_hides_id(self):
+        schemas = self.client.get("/openapi.json").json()["components"]["schemas"]
+        for name in ("SavedTrackRequest", "RecentlyPlayedRequest"):
+            assert "_id" not in schemas[name]["properties"], f"Expected no _id in {name}"
+
+
+class TestExport:
+
+    def setup_method(self):
+        self.handler = FakeHandler([
+            {"_id": ObjectId(), "user_id": "user", "track_id": f"track {index}", "type": "recently_played",
+             "played_at": START + timedelta(minutes=index)}
+            for index in range(5)])
+
+    def collect(self, chunks) -> list[bytes]:
+        async def run():
+            return [chunk async for chunk in chunks]
+
+        return asyncio.run(run())
+
+    def test_ndjson_batches(self):
+        chunks = self.collect(ndjson_lines(self.handler, "user", 2))
+        assert len(chunks) == 3 and all(chunk.endswith(b"\n") for chunk in chunks), \
+            "Expected one chunk per batch, each ending a line"
+
+    def test_gzip_stream_decompresses_to_json_lines(self):
+        chunks = self.collect(gzip_chunks(ndjson_lines(self.handler, "user", 2)))
+        lines = gzip.decompress(b"".join(chunks)).decode().splitlines()
+        docs = [json.loads(line) for line in lines]
+        assert [doc["track_id"] for doc in docs] == [f"track {index}" for index in range(5)], "Expected every document"
+        assert docs[0]["played_at"] == START.isoformat() and isinstance(docs[0]["_id"], str), \
+            "Expected datetimes and ObjectIds serialized as strings"
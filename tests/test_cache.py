@@ -0,0 +1,81 @@
+from spotify_advance.cache import RedisCache, TTLCache
+from tests.helpers import FakeClock
+
+
+class FakeRedis:
+    """The get, set and delete commands of a Redis client, recording each set's expiry."""
+
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    def set(self, key: str, value: str, px: int = None):
+        self.values[key] = value
+        self.expiries[key] = px
+
+    def delete(self, key: str) -> int:
+        self.expiries.pop(key, None)
+        return int(self.values.pop(key, None) is not None)
+
+
+class TestTTLCache:
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(max_size=2, default_ttl=10, clock=self.clock)
+
+    def test_expires_after_ttl(self):
+        self.cache.set(("recently_played", "user"), [1])
+        self.clock.now = 9
+        assert self.cache.get(("recently_played", "user")) == [1], "Expected a hit before the TTL"
+        self.clock.now = 10
+        assert self.cache.get(("recently_played", "user")) is None, "Expected a miss after the TTL"
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set(("a", "user"), 1)
+        self.cache.set(("b", "user"), 2)
+        self.cache.get(("a", "user"))
+        self.cache.set(("c", "user"), 3)
+        assert ("b", "user") not in self.cache, "Expected the least recently used entry to be evicted"
+        assert self.cache.stats()["evictions"] == 1, "Expected 1 eviction"
+
+    def test_invalidate_by_user(self):
+        self.cache.set(("saved_tracks", "user"), 1)
+        self.cache.set(("saved_tracks", "other"), 2)
+        assert self.cache.invalidate(user_id="user") == 1, "Expected 1 invalidated entry"
+        assert ("saved_tracks", "other") in self.cache, "Expected other users to stay cached"
+
+    def test_get_or_set_records_hit_ratio(self):
+        calls = []
+        for _ in range(4):
+            self.cache.get_or_set(("current_user", 1), lambda: calls.append(1) or {"id": "user"})
+        assert len(calls) == 1, "Expected a single fetch"
+        assert self.cache.stats()["hit_ratio"] == 0.75, "Expected 3 hits out of 4 lookups"
+
+    def test_zero_ttl_is_not_cached(self):
+        self.cache.set(("saved_tracks", "user"), [1], ttl=0)
+        assert self.cache.get(("saved_tracks", "user")) is None and len(self.cache) == 0, "Expected an expired entry"
+
+
+class TestRedisCache:
+
+    def setup_method(self):
+        # The client connects lazily, so no server is needed once it is replaced
+        self.cache = RedisCache(default_ttl=10)
+        self.cache._redis = FakeRedis()
+
+    def test_ttl_sets_expiry(self):
+        self.cache.set(("saved_tracks", "user"), [1])
+        self.cache.set(("current_user", "user"), {"id": "user"}, ttl=None)
+        assert self.cache._redis.expiries == {"spotify_advance:saved_tracks:user": 10000, "spotify_advance:current_user:user": None}
+        assert self.cache.get(("saved_tracks", "user")) == [1]
+
+    def test_zero_ttl_is_not_stored(self):
+        self.cache.set(("saved_tracks", "user"), [1])
+        for ttl in (0, -1):
+            self.cache.set(("saved_tracks", "user"), [2], ttl=ttl)
+            assert self.cache.get(("saved_tracks", "user")) is None, "Expected no entry without an expiry"
+        assert not self.cache._redis.expiries, "Expected the stale entry dropped too"
@@ -0,0 +1,25 @@
+from spotify_advance.http_session import RETRY_STATUSES, build_session, configure_shared_session, shared_session
+
+
+class TestSpotifySession:
+
+    def test_shared_session_reused(self):
+        assert shared_session() is shared_session(), "Expected one session per process"
+
+    def test_configure_replaces_shared_session(self):
+        previous = shared_session()
+        session = configure_shared_session(pool_size=4)
+        assert session is shared_session() and session is not previous, "Expected the configured session to be shared"
+        assert session.get_adapter("https://api.spotify.com")._pool_maxsize == 4, "Expected the pool sized as configured"
+
+    def test_close_keeps_pool(self):
+        session = build_session()
+        adapter = session.get_adapter("https://api.spotify.com")
+        adapter.poolmanager.connection_from_url("https://api.spotify.com")
+        session.close()
+        assert len(adapter.poolmanager.pools) == 1, "Expected close() from a client not to drop pooled connections"
+
+    def test_rate_limits_not_retried_by_adapter(self):
+        retry = build_session().get_adapter("https://api.spotify.com").max_retries
+        assert 429 not in retry.status_forcelist and set(RETRY_STATUSES) == set(retry.status_forcelist), \
+            "Expected 429 to be left to the shared rate limiter"
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from spotify_advance.metrics import (
+    HTTP_REQUEST_SECONDS,
+    MONGO_DOCUMENTS,
+    MONGO_OPERATION_SECONDS,
+    MetricsMiddleware,
+    Registry,
+    instrument_handler,
+    spotify_endpoint,
+)
+
+
+@instrument_handler
+class FakeHandler:
+
+    def get_items(self):
+        return [1, 2, 3], "Items retrieved successfully"
+
+    async def store_items(self):
+        return {"inserted": 2, "duplicates": 1}, "Items stored successfully"
+
+    def iter_items(self):
+        yield from range(4)
+
+    def get_missing(self):
+        return None, "Failed to get items"
+
+    async def delete_items(self):
+        raise RuntimeError("connection lost")
+
+
+class TestMetrics:
+
+    def test_histogram_render(self):
+        registry = Registry()
+        histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, route="/a")
+        histogram.observe(0.5, route="/a")
+        lines = registry.render().splitlines()
+        assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines, "Expected the first bucket to hold one observation"
+        assert 'latency_seconds_bucket{route="/a",le="+Inf"} 2' in lines, "Expected cumulative bucket counts"
+        assert 'latency_seconds_count{route="/a"} 2' in lines, "Expected the observation count"
+
+    def test_instrumented_handler_counts_documents(self):
+        handler = FakeHandler()
+        handler.get_items()
+        asyncio.run(handler.store_items())
+        assert list(handler.iter_items()) == [0, 1, 2, 3], "Expected generators to still yield every item"
+        for method, documents in (("get_items", 3), ("store_items", 2), ("iter_items", 4)):
+            labels = {"handler": "FakeHandler", "method": method, "status": "ok"}
+            assert MONGO_OPERATION_SECONDS.count(**labels) == 1, f"Expected {method} to be timed"
+            assert MONGO_DOCUMENTS.value(**labels) == documents, f"Expected {method} document count"
+
+    def test_failed_calls_are_recorded(self):
+        handler = FakeHandler()
+        handler.get_missing()
+        with pytest.raises(RuntimeError):
+            asyncio.run(handler.delete_items())
+        for method in ("get_missing", "delete_items"):
+            labels = {"handler": "FakeHandler", "method": method, "status": "error"}
+            assert MONGO_OPERATION_SECONDS.count(**labels) == 1, f"Expected {method} to be timed as an error"
+
+    def test_framework_routes_are_labelled(self):
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+        client = TestClient(app)
+        labels = [{"method": "GET", "route": "/openapi.json", "status": 200},
+                  {"method": "GET", "route": "unmatched", "status": 404}]
+        before = [HTTP_REQUEST_SECONDS.count(**series) for series in labels]
+        client.get("/openapi.json")
+        client.get("/missing")
+        after = [HTTP_REQUEST_SECONDS.count(**series) for series in labels]
+        assert after[0] - before[0] == 1, "Expected FastAPI's own routes labelled with their path"
+        assert after[1] - before[1] == 1, "Expected unknown paths to share one series"
+
+    def test_spotify_endpoint_hides_ids(self):
+        assert spotify_endpoint("https://api.spotify.com/v1/tracks/4uLU6hMCjMI75M1A2tKUQC?market=IL") == \
+            "api.spotify.com/v1/tracks/{id}", "Expected track IDs replaced and the query dropped"
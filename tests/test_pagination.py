@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from spotify_advance.handlers.pagination import decode_cursor, encode_cursor, keyset_query, keyset_sort, next_cursor
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def matches(doc: dict, query: dict) -> bool:
+    """Evaluate the equality, $gt, $lt and $or filters built by keyset_query."""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            (op, value), = condition.items()
+            if not (doc[key] > value if op == "$gt" else doc[key] < value):
+                return False
+        elif doc[key] != condition:
+            return False
+    return True
+
+
+def page_through(docs: list[dict], field: str | None, direction: int, limit: int) -> list[list[dict]]:
+    reverse = direction == DESCENDING
+    ordered = sorted(docs, key=lambda doc: tuple(doc[key] for key, _ in keyset_sort(field, direction)), reverse=reverse)
+    pages, after = [], None
+    while True:
+        query = keyset_query({"user_id": "user"}, field, direction, after)
+        page = [doc for doc in ordered if matches(doc, query)][:limit]
+        if page:
+            pages.append(page)
+        after = next_cursor(page, field, limit)
+        if after is None:
+            return pages
+
+
+class TestCursor:
+
+    def test_round_trip(self):
+        _id = ObjectId()
+        assert decode_cursor(encode_cursor(START, _id)) == (START, _id), "Expected the sort key back"
+        assert decode_cursor(encode_cursor(None, _id)) == (None, _id), "Expected _id only cursors"
+
+    @pytest.mark.parametrize("cursor", ["", "not base64!", "eyJ2IjogMX0=", encode_cursor(START, "x")[:-4]])
+    def test_malformed_cursor_rejected(self, cursor):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+    def test_no_cursor_on_short_page(self):
+        assert next_cursor([{"_id": ObjectId(), "played_at": START}], "played_at", 2) is None
+        assert next_cursor([], "played_at", 2) is None
+
+
+class TestKeyset:
+
+    def setup_method(self):
+        # Several plays share a played_at, so only _id orders them
+        self.docs = [
+            {"_id": ObjectId(), "user_id": "user", "played_at": START + timedelta(minutes=index // 3)}
+            for index in range(10)
+        ]
+
+    @pytest.mark.parametrize("direction", [ASCENDING, DESCENDING])
+    def test_ties_broken_by_id(self, direction):
+        pages = page_through(self.docs, "played_at", direction, limit=2)
+        seen = [doc["_id"] for page in pages for doc in page]
+        assert sorted(seen) == sorted(doc["_id"] for doc in self.docs), "Expected every play once across pages"
+        assert len(set(seen)) == len(seen), "Expected no play repeated on a tie"
+
+    def test_id_only_paging(self):
+        pages = page_through(self.docs, None, ASCENDING, limit=3)
+        assert [doc["_id"] for page in pages for doc in page] == sorted(doc["_id"] for doc in self.docs)
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+from spotify_advance.pipeline import Prefetcher, aprefetch, astore_pages, store_pages
+from spotify_advance.sync import play_records, saved_track_records
+from spotify_advance.utils import datetime_to_unix_ms, parse_spotify_datetime
+
+
+def counting_source(pages: int, produced: list):
+    for page in range(pages):
+        produced.append(page)
+        yield [{"page": page}]
+
+
+class TestPrefetcher:
+
+    def test_prefetch_is_bounded(self):
+        produced = []
+        prefetcher = Prefetcher(counting_source(100, produced), depth=2)
+        time.sleep(0.3)
+        # Two buffered pages and one more fetched, waiting for room
+        assert len(produced) == 3, "Expected the producer to stop at the prefetch depth"
+        assert next(prefetcher) == [{"page": 0}], "Expected pages in order"
+        prefetcher.close()
+
+    def test_source_errors_reach_the_consumer(self):
+        def failing():
+            yield [1]
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            list(Prefetcher(failing()))
+
+    def test_async_prefetch(self):
+        async def collect():
+            return [page async for page in aprefetch(counting_source(5, []))]
+
+        assert len(asyncio.run(collect())) == 5, "Expected every page"
+
+
+@pytest.mark.parametrize("fixture_api", [{"pages": 4}], indirect=True)
+class TestStorePages:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, fixture_api):
+        self.spotify_api, self.adapter = fixture_api
+        self.written = []
+
+    def write(self, records: list[dict]) -> tuple[dict, str]:
+        self.written.append(len(records))
+        return {"inserted": len(records), "duplicates": 0}, "stored"
+
+    def test_writes_every_page(self):
+        totals = store_pages(
+            self.spotify_api.iter_recently_played(), lambda items: play_records("user", items), self.write)
+        assert self.written == [50, 50, 50, 50], "Expected one bulk write per page"
+        assert totals == {"pages": 4, "fetched": 200, "inserted": 200, "duplicates": 0}
+
+    def test_saved_tracks_stop_at_cursor(self):
+        items = [item for page in self.spotify_api.iter_saved_tracks() for item in page]
+        cursor = datetime_to_unix_ms(parse_spotify_datetime(items[70]['added_at']))
+        requests = self.adapter.requests
+        pages = list(self.spotify_api.iter_saved_tracks(after=cursor))
+        assert [len(page) for page in pages] == [50, 20], "Expected only tracks newer than the cursor"
+        assert self.adapter.requests - requests == 2, "Expected paging to stop at the cursor"
+
+    def test_failed_write_raises(self):
+        with pytest.raises(RuntimeError):
+            store_pages(self.spotify_api.iter_saved_tracks(), lambda items: items, lambda records: (None, "failed"))
+
+    def test_async_store_pages(self):
+        async def write(records):
+            return self.write(records)
+
+        totals = asyncio.run(astore_pages(
+            self.spotify_api.aiter_saved_tracks(), lambda items: saved_track_records("user", items), write))
+        assert totals["fetched"] == 200 and len(self.written) == 4, "Expected one bulk write per page"
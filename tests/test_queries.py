@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo import DeleteMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from spotify_advance.cache import TTLCache
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.handlers.queries import (
+    add_plays,
+    cache_track,
+    late_plays_query,
+    ordered_tracks,
+    saved_tracks_delta_operations,
+    split_cached_tracks,
+    upserted_indexes,
+    with_track_metadata,
+)
+from spotify_advance.sessions import SessionBuilder
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class TestTrackCache:
+
+    def test_split_and_order(self):
+        cache = TTLCache(max_size=16)
+        cache_track(cache, {"_id": ObjectId(), "track_id": "a"})
+        found, misses = split_cached_tracks(cache, ["b", "a", "b"])
+        assert list(found) == ["a"] and misses == ["b"], "Expected distinct misses only"
+        found["b"] = {"track_id": "b"}
+        assert [track["track_id"] for track in ordered_tracks(found, ["b", "a", "c"])] == ["b", "a"], "Expected input order"
+        assert isinstance(found["a"]["_id"], str), "Expected cached tracks to be JSON friendly"
+
+
+class TestBuilders:
+
+    def test_add_plays_uses_durations(self):
+        plays = [{"track_id": "a", "played_at": START}, {"track_id": "b", "played_at": START + timedelta(minutes=10)}]
+        sessions, _ = add_plays(SessionBuilder("user", gap_ms=60 * 1000), plays, [{"track_id": "a", "duration_ms": 600000}])
+        assert len(sessions) == 1, "Expected the known duration to bridge the gap"
+
+    def test_delta_operations(self):
+        operations = saved_tracks_delta_operations("user", [{"user_id": "user", "track_id": "a", "added_at": START}], ["b"])
+        assert len(operations) == 2 and isinstance(operations[-1], DeleteMany), "Expected one delete after the upserts"
+        assert operations[0] == UpdateOne({"user_id": "user", "track_id": "a"}, {"$set": {"added_at": START}}, upsert=True), \
+            "Expected a stored track saved again to take the new added_at"
+        assert len(saved_tracks_delta_operations("user", [], [])) == 0
+
+    def test_related_metadata(self):
+        related = with_track_metadata([{"track_id": "a", "count": 2}, {"track_id": "x", "count": 1}],
+                                      [{"track_id": "a", "name": "A", "artists": ["X"]}])
+        assert related[0]["name"] == "A" and related[1]["name"] is None, "Expected unknown tracks without metadata"
+
+    def test_late_plays_query(self):
+        stored_through = ObjectId()
+        query = late_plays_query("user", stored_through, START)
+        assert query["_id"] == {"$gt": stored_through}, "Expected plays stored after the last refresh"
+        assert query["played_at"] == {"$lte": START}, "Expected only plays the last session's end does not reach"
+
+
+def bulk_write_error(upserted: list[int], codes: list[int]) -> BulkWriteError:
+    """A BulkWriteError as raised by an unordered bulk write, with a write error per code."""
+    return BulkWriteError({
+        "writeErrors": [{"index": index, "code": code, "errmsg": f"E{code}"} for index, code in enumerate(codes)],
+        "upserted": [{"index": index, "_id": ObjectId()} for index in upserted],
+        "nInserted": 0, "nUpserted": len(upserted), "nMatched": 0, "nModified": 0, "nRemoved": 0,
+        "writeConcernErrors": [],
+    })
+
+
+class FailingCollection:
+
+    def __init__(self, error: BulkWriteError):
+        self.error = error
+
+    def bulk_write(self, operations: list, ordered: bool = True):
+        raise self.error
+
+
+class TestBulkUpsert:
+
+    def setup_method(self):
+        # The client connects lazily, so no server is needed
+        self.handler = MongoDBHandler("mongodb://localhost:27017", create_indexes=False)
+        self.docs = [{"user_id": "user", "track_id": str(index)} for index in range(4)]
+
+    def test_duplicate_keys_are_skipped(self):
+        error = bulk_write_error([1, 3], [11000, 11000])
+        assert upserted_indexes(error) == [1, 3], "Expected the upserted operations only"
+        inserted = self.handler._bulk_upsert(FailingCollection(error), ("user_id", "track_id"), self.docs)
+        assert inserted == [self.docs[1], self.docs[3]], "Expected the racing duplicates left out"
+
+    @pytest.mark.parametrize("codes", [[121], [11000, 121], [121, 11000, 11000]])
+    def test_other_errors_still_fail(self, codes: list[int]):
+        error = bulk_write_error([3], codes)
+        with pytest.raises(BulkWriteError):
+            upserted_indexes(error)
+        with pytest.raises(BulkWriteError):
+            self.handler._bulk_upsert(FailingCollection(error), ("user_id", "track_id"), self.docs)
@@ -0,0 +1,24 @@
+from spotify_advance.ratelimit import TokenBucket
+from tests.helpers import FakeClock
+
+
+class TestTokenBucket:
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=2, capacity=2, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_then_refill(self):
+        assert self.bucket.acquire() == 0 and self.bucket.acquire() == 0, "Expected a full bucket to allow a burst"
+        assert self.bucket.acquire() == 0.5, "Expected to wait for one token at 2 per second"
+
+    def test_pause_blocks_and_does_not_refill(self):
+        self.bucket.pause(10)
+        assert self.bucket.try_acquire() == 10, "Expected the pause to block acquisition"
+        self.clock.now = 10
+        assert self.bucket.try_acquire() == 0.5, "Expected no tokens accrued during the pause"
+
+    def test_pause_never_shortens(self):
+        self.bucket.pause(10)
+        self.bucket.pause(1)
+        assert self.bucket.try_acquire() == 10, "Expected the longer pause to be kept"
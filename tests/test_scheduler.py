@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+
+from spotify_advance.scheduler import SyncScheduler
+from tests.helpers import FakeClock
+
+START = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+HOUR = 60 * 60
+
+
+class FakeHandler:
+    """The token and sync state reads of MongoDBHandler, kept in memory."""
+
+    def __init__(self, user_ids: list[str], states: list[dict]):
+        self.user_ids = user_ids
+        self.states = states
+
+    def get_token_user_ids(self) -> list[str]:
+        return self.user_ids
+
+    def get_sync_states(self, stream: str = None) -> list[dict]:
+        return self.states
+
+
+def states(user_id: str, last_run: float, newest_play: float = None, error: str = None) -> list[dict]:
+    """sync_state documents of both streams, times given as Unix seconds."""
+    last_run_at = datetime.fromtimestamp(last_run, timezone.utc).replace(tzinfo=None)
+    return [
+        {"user_id": user_id, "stream": stream, "last_run_at": last_run_at, "last_error": error,
+         **({} if error else {"last_success_at": last_run_at}),
+         **({"high_water_mark": int(newest_play * 1000)} if newest_play is not None else {})}
+        for stream in ("recently_played", "saved_tracks")
+    ]
+
+
+class TestSyncScheduler:
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.clock.now = START.timestamp()
+        now = self.clock()
+        self.handler = FakeHandler(
+            ["idle", "active", "new"],
+            [*states("idle", now - 10 * 60, newest_play=now - 48 * HOUR),
+             *states("active", now - 10 * 60, newest_play=now - HOUR)])
+        self.scheduler = SyncScheduler(self.handler, {}, active_interval=5 * 60, idle_interval=HOUR)
+
+    def test_due_users(self):
+        assert self.scheduler.due_users(self.clock()) == ["active", "new"], \
+            "Expected active users first, then never synced ones, idle users within their interval left out"
+        self.clock.sleep(HOUR)
+        assert self.scheduler.due_users(self.clock()) == ["active", "new", "idle"], \
+            "Expected idle users due once their interval elapsed, stalest first"
+
+    def test_active_user_goes_idle(self):
+        self.clock.sleep(24 * HOUR)
+        assert self.scheduler.due_users(self.clock())[0] == "new", \
+            "Expected a user without plays in the active window ordered as idle"
+
+    def test_partial_state_is_due(self):
+        self.handler.states = [state for state in self.handler.states if state["stream"] == "recently_played"]
+        assert "idle" in self.scheduler.due_users(self.clock()), "Expected a stream never run to make the user due"
+
+    def test_lag(self):
+        self.handler.states += states("new", self.clock() - 2 * HOUR, error="boom")
+        self.clock.sleep(HOUR)
+        report = self.scheduler.lag(self.clock())
+        assert [(row["user_id"], row["lag_seconds"]) for row in report[::2]] == \
+            [("new", None), ("idle", HOUR + 10 * 60), ("active", HOUR + 10 * 60)], \
+            "Expected never succeeded streams first, then the most lagging"
+        active = next(row for row in report if row["user_id"] == "active")
+        assert active["newest_item_age_seconds"] == 2 * HOUR, "Expected the age of the newest synced play"
+        assert report[0]["last_error"] == "boom", "Expected the last error reported"
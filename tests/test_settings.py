@@ -0,0 +1,28 @@
+import os
+
+from spotify_advance.apis import Settings, load_settings
+from spotify_advance.apis.mongodb import create_app
+
+
+class TestSettings:
+
+    def test_env_overrides_config_file(self, tmp_path):
+        path = tmp_path / "conf.yaml"
+        path.write_text("spotify:\n  client_id: file\nmongodb:\n  uri: mongodb://file\n  max_pool_size: 10\n")
+        settings = load_settings(str(path), {
+            "SPOTIFY_ADVANCE_MONGODB__URI": "mongodb://env",
+            "SPOTIFY_ADVANCE_MONGODB__MAX_POOL_SIZE": "50",
+            "SPOTIFY_ADVANCE_API__SLOW_REQUEST_MS": "250",
+        })
+        assert settings.spotify == {"client_id": "file"}, "Expected values without overrides to come from the file"
+        assert settings.mongodb == {"uri": "mongodb://env", "max_pool_size": 50}, "Expected typed env overrides"
+        assert settings.api == {"slow_request_ms": 250}, "Expected overrides to create missing sections"
+
+    def test_missing_file_uses_environment(self, tmp_path):
+        settings = load_settings(os.path.join(tmp_path, "missing.yaml"), {"SPOTIFY_ADVANCE_MONGODB__URI": "mongodb://env"})
+        assert settings == Settings(mongodb={"uri": "mongodb://env"}), "Expected env-only settings"
+
+    def test_create_app_is_lazy(self):
+        app = create_app(Settings())
+        resources = app.state.resources
+        assert resources._handler is None and resources._spotify_api is None, "Expected no clients before first use"
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+from spotify_advance.handlers.similarity import (
+    RELATED_TRACKS_REBUILD,
+    PairClaim,
+    neighbors_pipeline,
+    pair_counts,
+    saved_pair_counts,
+    saved_window_query,
+    session_pair_counts,
+    withdrawn_pairs,
+)
+from spotify_advance.sessions import SessionBuilder
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class TestCoListens:
+
+    def test_pair_counts_symmetric(self):
+        pairs = pair_counts("a", ["b", "a", "c"])
+        assert pairs == {("a", "b"): 1, ("b", "a"): 1, ("a", "c"): 1, ("c", "a"): 1}, "Expected symmetric pairs without self pairs"
+
+    def test_session_pairs(self):
+        builder = SessionBuilder("user", gap_ms=60 * 1000)
+        for minutes, track_id in [(0, "a"), (1, "b"), (2, "a"), (30, "c")]:
+            builder.add(START + timedelta(minutes=minutes), track_id, None)
+        sessions, pairs = builder.drain()
+        assert len(sessions) == 2, "Expected the gap to split two sessions"
+        assert pairs == {("a", "b"): 1, ("b", "a"): 1}, "Expected only tracks of the same session to be paired"
+
+    def test_counted_plays_are_not_paired_again(self):
+        builder = SessionBuilder("user", gap_ms=60 * 1000, pair_after=START + timedelta(minutes=1))
+        for minutes, track_id in [(0, "a"), (1, "b"), (2, "c")]:
+            builder.add(START + timedelta(minutes=minutes), track_id, None)
+        _, pairs = builder.drain()
+        assert set(pairs) == {("c", "a"), ("a", "c"), ("c", "b"), ("b", "c")}, "Expected only plays after pair_after paired"
+
+    def test_stored_session_pairs_match_builder(self):
+        builder = SessionBuilder("user", gap_ms=60 * 1000)
+        track_ids = [f"t{index % 30}" for index in range(45)]
+        for minutes, track_id in enumerate(track_ids):
+            builder.add(START + timedelta(minutes=minutes), track_id, None)
+        (session,), pairs = builder.drain()
+        assert session_pair_counts(session["track_ids"]) == pairs, "Expected a rebuild to recount the builder's pairs"
+
+    def test_full_neighbors_rebuild(self):
+        pipeline = neighbors_pipeline(None, into=RELATED_TRACKS_REBUILD)
+        assert "$match" not in pipeline[0], "Expected every track recomputed"
+        assert pipeline[-1]["$merge"]["into"] == RELATED_TRACKS_REBUILD
+
+    def test_rebuild_skips_pairs(self):
+        builder = SessionBuilder("user", pair_tracks=False)
+        builder.add(START, "a", None)
+        builder.add(START + timedelta(minutes=1), "b", None)
+        _, pairs = builder.drain()
+        assert not pairs, "Expected no pairs when pairing is off"
+
+    def test_saved_pair_counts_window(self):
+        saved = [
+            {"user_id": "user", "track_id": "a", "added_at": START},
+            {"user_id": "user", "track_id": "b", "added_at": START + timedelta(minutes=10)},
+            {"user_id": "user", "track_id": "c", "added_at": START + timedelta(days=1)},
+            {"user_id": "other", "track_id": "c", "added_at": START},
+        ]
+        assert saved_pair_counts(saved) == {("b", "a"): 1, ("a", "b"): 1}, "Expected saves close in time by the same user paired"
+
+    def test_changed_saved_pairs_keep_library_counts(self):
+        library = [
+            {"user_id": "user", "track_id": track_id, "added_at": START + timedelta(minutes=minutes)}
+            for track_id, minutes in [("a", 0), ("b", 20), ("c", 50), ("d", 200)]
+        ]
+        removed = {("user", "b")}
+        counts = saved_pair_counts(library) + withdrawn_pairs(saved_pair_counts(library, removed))
+        kept = [doc for doc in library if doc["track_id"] != "b"]
+        assert +counts == saved_pair_counts(kept), "Expected withdrawing a removed track to leave the library's pairs"
+        added = saved_pair_counts(library, {("user", "d")}) + saved_pair_counts(library[:3])
+        assert added == saved_pair_counts(library), "Expected an added track to pair with its stored neighbors once"
+
+    def test_resaved_pairs_keep_library_counts(self):
+        library = [
+            {"user_id": "user", "track_id": track_id, "added_at": START + timedelta(minutes=minutes)}
+            for track_id, minutes in [("a", 0), ("b", 20), ("c", 200), ("d", 220)]
+        ]
+        resaved = {**library[0], "added_at": START + timedelta(minutes=210)}
+        changed = {("user", "a")}
+        after = [resaved, *library[1:]]
+        counts = saved_pair_counts(library) + withdrawn_pairs(saved_pair_counts(library, changed)) + \
+            saved_pair_counts(after, changed)
+        assert +counts == saved_pair_counts(after), "Expected a re-saved track's pairs to move to its new save time"
+
+    def test_saved_window_query(self):
+        saved = [{"user_id": "user", "track_id": "a", "added_at": START}]
+        query = saved_window_query(saved)["$or"][0]
+        assert query["added_at"]["$gte"] < START < query["added_at"]["$lte"], "Expected the window around the saves"
+
+
+class TestPairClaim:
+
+    def test_claim_moves_forward_only(self):
+        claim = PairClaim("user", {"pairs_through": START})
+        assert claim.query()["pairs_through"] == START, "Expected the compare-and-set on the value read"
+        assert not claim.claimable(START), "Expected plays up to the cursor to be counted already"
+        assert claim.claimable(START + timedelta(minutes=1)), "Expected newer plays to be claimable"
+
+    def test_lost_claim_stops_counting(self):
+        claim = PairClaim("user", None)
+        claim.lost = True
+        assert not claim.claimable(START), "Expected no counting after a concurrent refresh won a claim"
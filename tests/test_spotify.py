@@ -0,0 +1,55 @@
+import pytest
+
+from spotify_advance.apis.spotify import SpotifyAPI
+from spotify_advance.cache import TTLCache
+from tests.helpers import fixture_spotify_api
+
+
+def profile_client(spotify_api: SpotifyAPI, user_id: str, calls: list) -> SpotifyAPI:
+    def current_user():
+        calls.append(user_id)
+        return {"id": user_id}
+
+    spotify_api.sp.current_user = current_user
+    return spotify_api
+
+
+class TestCurrentUser:
+
+    def setup_method(self):
+        self.cache = TTLCache(max_size=16)
+        self.calls = []
+
+    def test_clients_sharing_a_cache_keep_their_profile(self):
+        # Several clients on one cache, so built here rather than by the fixture_api fixture
+        first = profile_client(fixture_spotify_api(cache=self.cache)[0], "first", self.calls)
+        assert first.user_id == "first"
+        # A client built after the first is collected may reuse its id()s
+        del first
+        for user_id in ("second", "third"):
+            client = profile_client(fixture_spotify_api(cache=self.cache)[0], user_id, self.calls)
+            assert client.user_id == user_id, "Expected every client to fetch its own profile"
+            assert client.user_id == user_id
+        assert self.calls == ["first", "second", "third"], "Expected one profile request per client"
+
+    def test_invalidate_all_drops_profile(self, fixture_api):
+        client = profile_client(fixture_api[0], "user", self.calls)
+        client.cache.set(("saved_tracks", "user", 50), [1])
+        assert client.invalidate_cache() == 2, "Expected the saved tracks and the profile dropped"
+        client.user_id
+        assert self.calls == ["user", "user"], "Expected the profile fetched again"
+
+
+@pytest.mark.parametrize("fixture_api", [{"pages": 5}], indirect=True)
+class TestSavedTracks:
+
+    @pytest.mark.parametrize("limit, offset", [(20, 0), (50, 0), (20, 30), (50, 240)])
+    def test_parallel_matches_sequential(self, fixture_api, limit: int, offset: int):
+        spotify_api, _ = fixture_api
+        sequential = spotify_api.get_saved_tracks(limit, offset, concurrency=1)
+        spotify_api.invalidate_cache("saved_tracks")
+        parallel = spotify_api.get_saved_tracks(limit, offset, concurrency=4)
+        assert len(sequential) == 250 - offset, "Expected the library from offset to the end"
+        assert [item["track"]["id"] for item in parallel] == [item["track"]["id"] for item in sequential], \
+            "Expected the same tracks in the same order"
+        assert parallel == sequential
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo import UpdateOne
+
+from spotify_advance.handlers.stats import increment_operations, play_day, stale_buckets_query, window_start
+
+NOW = datetime(2024, 3, 1, 12, 30, tzinfo=timezone.utc)
+
+
+class TestWindows:
+
+    def test_window_crosses_month_boundary(self):
+        assert window_start("1d", NOW) == datetime(2024, 3, 1), "Expected today only"
+        assert window_start("7d", NOW) == datetime(2024, 2, 24), "Expected six days back into February"
+        assert window_start("30d", NOW) == datetime(2024, 2, 1), "Expected the leap day counted"
+
+    def test_window_crosses_week_and_year(self):
+        assert window_start("7d", datetime(2024, 1, 3, tzinfo=timezone.utc)) == datetime(2023, 12, 28)
+
+    def test_aware_and_naive_reference(self):
+        local = datetime(2024, 3, 2, 1, 0, tzinfo=timezone(timedelta(hours=5)))
+        assert window_start("1d", local) == datetime(2024, 3, 1), "Expected the UTC day of an aware time"
+        assert window_start("1d", datetime(2024, 3, 1, 23, 59)) == datetime(2024, 3, 1), "Expected naive times taken as UTC"
+
+    def test_all_and_malformed(self):
+        assert window_start("all", NOW) is None
+        for window in ("0d", "7", "1w", "-1d"):
+            with pytest.raises(ValueError):
+                window_start(window, NOW)
+
+
+class TestIncrements:
+
+    def test_plays_grouped_per_utc_day(self):
+        plays = [
+            {"user_id": "user", "track_id": "a", "played_at": datetime(2024, 2, 29, 23, 59, tzinfo=timezone.utc)},
+            {"user_id": "user", "track_id": "a", "played_at": datetime(2024, 3, 1, 0, 30, tzinfo=timezone(timedelta(hours=1)))},
+            {"user_id": "user", "track_id": "a", "played_at": datetime(2024, 3, 1, 0, 0)},
+        ]
+        expected = [
+            UpdateOne({"user_id": "user", "day": day, "track_id": "a"},
+                      {"$inc": {"count": count}, "$currentDate": {"updated_at": True}}, upsert=True)
+            for day, count in ((datetime(2024, 2, 29), 2), (datetime(2024, 3, 1), 1))
+        ]
+        assert increment_operations(plays) == expected, \
+            "Expected an aware time converted to its UTC day and a naive one taken as UTC"
+
+    def test_play_day_is_naive_utc(self):
+        assert play_day(datetime(2024, 3, 1, 5, tzinfo=timezone(timedelta(hours=6)))) == datetime(2024, 2, 29)
+
+    def test_stale_buckets_keep_concurrent_increments(self):
+        query = stale_buckets_query(NOW, "user")
+        assert query["user_id"] == "user" and query["rebuilt_at"] == {"$ne": NOW}
+        assert {"updated_at": {"$lt": NOW}} in query["$or"], "Expected buckets incremented since the rebuild kept"
@@ -0,0 +1,124 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from spotify_advance.sync import RecentlyPlayedSync, SavedTracksSync
+from spotify_advance.utils import datetime_to_unix_ms, parse_spotify_datetime
+from tests.helpers import fixture_id
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeHandler:
+    """The sync state, plays and saved tracks methods of MongoDBHandler, kept in memory."""
+
+    def __init__(self, saved: dict[str, dict]):
+        self.saved = saved
+        self.plays = []
+        self.marks: dict[tuple[str, str], int] = {}
+        self.deltas = []
+        self.session_updates = 0
+
+    def get_high_water_mark(self, user_id: str, stream: str) -> int | None:
+        return self.marks.get((user_id, stream))
+
+    def set_high_water_mark(self, user_id: str, stream: str, high_water_mark: int) -> None:
+        self.marks[(user_id, stream)] = max(high_water_mark, self.marks.get((user_id, stream), high_water_mark))
+
+    def store_recently_played_many(self, records: list[dict]) -> tuple[dict, str]:
+        self.plays.extend(records)
+        return {"inserted": len(records), "duplicates": 0}, "ok"
+
+    def update_sessions(self, user_id: str) -> tuple[int, str]:
+        self.session_updates += 1
+        return 0, "ok"
+
+    def get_newest_added_at(self, user_id: str):
+        return max((record["added_at"] for record in self.saved.values()), default=None)
+
+    def get_saved_track_added_at(self, user_id: str) -> tuple[dict, str]:
+        return {track_id: record.get("added_at", START) for track_id, record in self.saved.items()}, "ok"
+
+    def store_saved_tracks_many(self, records: list[dict]) -> tuple[dict, str]:
+        inserted = [record for record in records if record["track_id"] not in self.saved]
+        self.saved.update((record["track_id"], record) for record in inserted)
+        return {"inserted": len(inserted), "duplicates": len(records) - len(inserted)}, "ok"
+
+    def apply_saved_tracks_delta(self, user_id: str, added: list[dict], removed: list[str]) -> tuple[dict, str]:
+        self.deltas.append((added, removed))
+        updated = sum(record["track_id"] in self.saved for record in added)
+        self.saved.update((record["track_id"], record) for record in added)
+        for track_id in removed:
+            self.saved.pop(track_id)
+        return {"inserted": len(added) - updated, "updated": updated, "removed": len(removed)}, "ok"
+
+
+@pytest.mark.parametrize("fixture_api", [{"pages": 4}], indirect=True)
+class TestRecentlyPlayedSync:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, fixture_api):
+        self.spotify_api, self.adapter = fixture_api
+        self.handler = FakeHandler({})
+        self.sync = RecentlyPlayedSync(self.spotify_api, self.handler)
+        self.played_at = [datetime_to_unix_ms(parse_spotify_datetime(item["played_at"]))
+                          for page in self.spotify_api.iter_recently_played() for item in page]
+
+    def test_cursor_advances_to_newest_play(self):
+        self.handler.marks[("user", RecentlyPlayedSync.STREAM)] = self.played_at[10]
+        result = self.sync.run("user")
+        assert result["fetched"] == 10 and len(self.handler.plays) == 10, "Expected only plays after the cursor"
+        assert self.handler.marks[("user", RecentlyPlayedSync.STREAM)] == self.played_at[0], \
+            "Expected the cursor moved to the newest play"
+        assert self.handler.session_updates == 1, "Expected the new plays sessionized"
+
+    def test_no_new_plays(self):
+        self.handler.marks[("user", RecentlyPlayedSync.STREAM)] = self.played_at[0]
+        result = self.sync.run("user")
+        assert result == {"fetched": 0, "inserted": 0, "duplicates": 0, "high_water_mark": self.played_at[0]}
+        assert self.handler.marks[("user", RecentlyPlayedSync.STREAM)] == self.played_at[0], "Expected the cursor kept"
+        assert not self.handler.plays and not self.handler.session_updates, "Expected nothing written"
+
+    def test_backfill_ignores_cursor(self):
+        self.handler.marks[("user", RecentlyPlayedSync.STREAM)] = self.played_at[0]
+        result = self.sync.run("user", backfill=True)
+        assert result["fetched"] == len(self.played_at), "Expected the full history"
+
+
+@pytest.mark.parametrize("fixture_api", [{"pages": 4}], indirect=True)
+class TestSavedTracksSync:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, fixture_api):
+        self.spotify_api, self.adapter = fixture_api
+        self.handler = FakeHandler({"stale": {"track_id": "stale"}})
+        self.sync = SavedTracksSync(self.spotify_api, self.handler)
+
+    def test_reconcile_applies_set_differences_once(self):
+        result = self.sync.run("user")
+        assert result["reconciled"], "Expected the first run to reconcile"
+        assert (result["inserted"], result["removed"]) == (200, 1), "Expected the library added and the stale track removed"
+        assert len(self.handler.deltas) == 1, "Expected adds and removes in one bulk write"
+        assert "stale" not in self.handler.saved and fixture_id(0) in self.handler.saved
+
+    def test_reconcile_moves_resaved_tracks_to_new_added_at(self):
+        self.sync.run("user")
+        self.handler.saved[fixture_id(5)] = {**self.handler.saved[fixture_id(5)], "added_at": START}
+        result = self.sync.run("user", reconcile=True)
+        assert (result["inserted"], result["updated"], result["removed"]) == (0, 1, 0), "Expected the re-saved track updated"
+        assert [record["track_id"] for record in self.handler.deltas[-1][0]] == [fixture_id(5)], \
+            "Expected unchanged tracks left out of the write"
+        assert self.handler.saved[fixture_id(5)]["added_at"] > START, "Expected the new added_at stored"
+
+    def test_routine_sync_stops_at_known_added_at(self):
+        self.sync.run("user")
+        requests = self.adapter.requests
+        result = self.sync.run("user")
+        assert "reconciled" not in result, "Expected no reconcile before the interval elapsed"
+        assert result["fetched"] == 0 and self.adapter.requests - requests == 1, "Expected a single page"
+
+    def test_cursor_falls_back_to_stored_tracks(self):
+        self.handler.saved["stale"]["added_at"] = parse_spotify_datetime(
+            next(self.spotify_api.iter_saved_tracks())[10]["added_at"])
+        result = self.sync.run("user", reconcile=False)
+        assert result["fetched"] == 10, "Expected paging to stop at the newest stored track"
@@ -1,14 +1,24 @@
-from spotify_advance.apis import client_data
+from argparse import ArgumentParser
+
+from spotify_advance.apis import get_client_data, get_mongodb_data
 from spotify_advance.apis.spotify import SpotifyAPI
-from spotify_advance.utils import get_one_week_before
+from spotify_advance.handlers.mongodb import MongoDBHandler
+from spotify_advance.sync import RecentlyPlayedSync
 
 
 def main():
-    spotify_api = SpotifyAPI(**client_data)
-    one_week_before = get_one_week_before()
-    recently_played = spotify_api.get_recently_played(
-        limit=50, after=one_week_before)
-    print(recently_played)
+    parser = ArgumentParser(description="Sync recently played tracks from Spotify into MongoDB")
+    parser.add_argument("--backfill", action="store_true",
+                        help="ignore the stored cursor and fetch all history Spotify still returns")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="fetch and count new plays without writing them")
+    args = parser.parse_args()
+
+    spotify_api = SpotifyAPI(**get_client_data())
+    handler = MongoDBHandler(get_mongodb_data()['uri'])
+    sync = RecentlyPlayedSync(spotify_api, handler)
+    print(sync.run(spotify_api.current_user['id'], backfill=args.backfill, dry_run=args.dry_run))
 
 
-main()
+if __name__ == "__main__":
+    main()